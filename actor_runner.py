@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+from metrics import actor_call_seconds, actor_runs_total, dataset_items_total
+from structured_log import get_logger, kv
+
+# Sharded Apify actor execution on the async client.
+# Profiles / post URLs are split into shards that run as parallel actor runs
+# (at most fan_out at a time). A failed shard is retried on its own instead of
+# losing the whole cycle, and the datasets are streamed back as each shard
+# finishes, deduplicated on a key.
+#
+# With a work log (work_log.py) every run is recorded as soon as it starts and
+# every item carries its position in the dataset ('_position'), so a restart
+# can resume unfinished runs from where they were instead of starting new ones.
+
+logger = get_logger(__name__)
+
+
+class ActorRunner:
+    def __init__(self, client_async, fan_out=4, max_retries=2, retry_delay=30, page_size=500):
+        self.client = client_async
+        self.fan_out = fan_out
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.page_size = page_size
+
+    async def _start_and_wait(self, actor_id, run_input, work_log):
+        # Same as actor.call(), but the run is in the work log before we wait for it
+        run = await self.client.actor(actor_id).start(run_input=run_input)
+        work_log.start_run(actor_id, run['id'], run['defaultDatasetId'], run_input)
+        finished = await self.client.run(run['id']).wait_for_finish()
+        if finished is None or finished.get('status') != 'SUCCEEDED':
+            work_log.finish_runs([run['id']])
+        return finished
+
+    async def _call(self, actor_id, run_input, semaphore, work_log=None):
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                started = time.monotonic()
+                try:
+                    if work_log is None:
+                        run = await self.client.actor(actor_id).call(run_input=run_input)
+                    else:
+                        run = await self._start_and_wait(actor_id, run_input, work_log)
+                    if run is None or run.get('status') != 'SUCCEEDED':
+                        raise RuntimeError(f"run finished with status {run.get('status') if run else None}")
+                except Exception as e:
+                    actor_call_seconds.observe(time.monotonic() - started, actor=actor_id)
+                    actor_runs_total.inc(actor=actor_id, status='failed')
+                    if attempt == self.max_retries:
+                        raise
+                    logger.warning("Actor shard failed, retrying", extra=kv(
+                        actor=actor_id, error=e, retry_in=self.retry_delay * (attempt + 1)))
+                    await asyncio.sleep(self.retry_delay * (attempt + 1))
+                else:
+                    actor_call_seconds.observe(time.monotonic() - started, actor=actor_id)
+                    actor_runs_total.inc(actor=actor_id, status='succeeded')
+                    return run
+
+    async def iterate_dataset(self, dataset_id, actor_id=None, offset=0, run_id=None):
+        # With a run_id every item is tagged with its (run_id, index) position
+        dataset = self.client.dataset(dataset_id)
+        while True:
+            page = await dataset.list_items(offset=offset, limit=self.page_size)
+            dataset_items_total.inc(len(page.items), actor=actor_id)
+            for index, item in enumerate(page.items, offset):
+                if run_id is not None:
+                    item['_position'] = (run_id, index)
+                yield item
+            offset += len(page.items)
+            if not page.items or offset >= page.total:
+                break
+
+    async def _dedup(self, items, dedup_key, seen, work_log):
+        async for item in items:
+            if dedup_key is not None:
+                key = item.get(dedup_key)
+                if key is not None:
+                    if key in seen:
+                        if work_log is not None:
+                            work_log.done(item.get('_position'))
+                        continue
+                    seen.add(key)
+            yield item
+
+    async def iter_items(self, actor_id, build_input, values, shard_size, dedup_key=None, failed=None,
+                         work_log=None, runs=None):
+        # build_input(shard) returns the run_input for one shard of values.
+        # Values of shards that still fail after the retries are appended to failed,
+        # and with a work log the ids of the runs read are appended to runs.
+        shards = [values[i:i + shard_size] for i in range(0, len(values), shard_size)]
+        if not shards:
+            return
+        semaphore = asyncio.Semaphore(self.fan_out)
+        tasks = {asyncio.create_task(self._call(actor_id, build_input(shard), semaphore, work_log)): shard
+                 for shard in shards}
+        seen = set()
+
+        try:
+            for finished in asyncio.as_completed(list(tasks)):
+                try:
+                    run = await finished
+                except Exception as e:
+                    logger.error("An error occurred while running actor", extra=kv(actor=actor_id, error=e))
+                    continue
+
+                run_id = run['id'] if work_log is not None else None
+                if runs is not None and run_id is not None:
+                    runs.append(run_id)
+                items = self.iterate_dataset(run["defaultDatasetId"], actor_id, run_id=run_id)
+                async for item in self._dedup(items, dedup_key, seen, work_log):
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            # as_completed hands back new futures, so failures are read from the tasks
+            if failed is not None:
+                for task, shard in tasks.items():
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        failed.extend(shard)
+
+    async def resume_items(self, actor_id, work_log, dedup_key=None, runs=None, resumed=None):
+        # Items of the runs a crash left unfinished, from their saved offset on. The
+        # ids of the runs read go to runs and their run inputs to resumed.
+        seen = set()
+        for run_id, dataset_id, run_input, offset in work_log.pending_runs(actor_id):
+            try:
+                run = await self.client.run(run_id).wait_for_finish()
+            except Exception as e:
+                logger.error("Unfinished run could not be resumed", extra=kv(actor=actor_id, run_id=run_id, error=e))
+                work_log.finish_runs([run_id])
+                continue
+            if run is None or run.get('status') != 'SUCCEEDED':
+                logger.warning("Unfinished run did not succeed, dropping it", extra=kv(
+                    actor=actor_id, run_id=run_id, status=run.get('status') if run else None))
+                work_log.finish_runs([run_id])
+                continue
+
+            logger.info("Resuming actor run", extra=kv(actor=actor_id, run_id=run_id, offset=offset))
+            if runs is not None:
+                runs.append(run_id)
+            if resumed is not None:
+                resumed.append(run_input)
+            items = self.iterate_dataset(dataset_id, actor_id, offset=offset, run_id=run_id)
+            async for item in self._dedup(items, dedup_key, seen, work_log):
+                yield item
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import random
+import time
+
+from metrics import classification_seconds, openai_requests_total, openai_tokens_total
+from rate_limit import TokenBucket
+from structured_log import get_logger, kv
+
+# Non-blocking classification engine on top of AsyncOpenAI.
+# A semaphore bounds how many requests are in flight, a limiter keeps us under
+# the account's requests-per-minute and tokens-per-minute quotas, and 429s /
+# transient errors are retried with exponential backoff and jitter.
+
+logger = get_logger(__name__)
+
+
+class RateLimiter:
+    # Requests per minute and tokens per minute, both as token buckets
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        async with self.lock:
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+
+    def adjust(self, estimated, actual):
+        # Charge the difference once the real usage is known
+        self.tokens.take(actual - estimated)
+
+
+def estimate_tokens(messages, completion_tokens=200):
+    # ~4 characters per token is close enough for Spanish text
+    characters = sum(len(message.get('content') or '') for message in messages)
+    return characters // 4 + completion_tokens
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    value = response.headers.get('retry-after')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class AsyncClassifier:
+    def __init__(self, client, concurrency=8, rpm=500, tpm=200000, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(rpm, tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def complete(self, model, messages, completion_tokens=200):
+        # Imported on the first request, not when the collector starts
+        from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+        estimated = estimate_tokens(messages, completion_tokens)
+
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.limiter.acquire(estimated)
+                started = time.monotonic()
+                try:
+                    completion = await self.client.chat.completions.create(model=model, messages=messages)
+                except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+                    openai_requests_total.inc(model=model, status=type(e).__name__)
+                    if attempt == self.max_retries:
+                        raise
+                    delay = _retry_after(e)
+                    if delay is None:
+                        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                        delay = delay / 2 + random.uniform(0, delay / 2)
+                    logger.warning("OpenAI request failed, retrying", extra=kv(
+                        error=type(e).__name__, retry_in=round(delay, 1), attempt=attempt + 1))
+                    await asyncio.sleep(delay)
+                    continue
+
+                classification_seconds.observe(time.monotonic() - started, model=model)
+                openai_requests_total.inc(model=model, status='ok')
+                usage = getattr(completion, 'usage', None)
+                if usage is not None and usage.total_tokens:
+                    self.limiter.adjust(estimated, usage.total_tokens)
+                    openai_tokens_total.inc(usage.prompt_tokens or 0, model=model, kind='prompt')
+                    openai_tokens_total.inc(usage.completion_tokens or 0, model=model, kind='completion')
+                return completion.choices[0].message.content
+
+
+def parse_batch_labels(text, expected_ids, allowed_labels):
+    # Expects a JSON array of {"id": ..., "clasificacion": ...}. Anything that
+    # is not a known id with an allowed label is dropped, so the caller can
+    # re-ask for what is missing.
+    text = (text or '').strip()
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        answers = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+
+    labels = {}
+    for answer in answers if isinstance(answers, list) else []:
+        if not isinstance(answer, dict):
+            continue
+        answer_id = str(answer.get('id'))
+        label = str(answer.get('clasificacion', '')).strip().lower()
+        if answer_id in expected_ids and label in allowed_labels:
+            labels[answer_id] = label
+    return labels
+
+
+async def classify_batch(classifier, model, build_messages, comments, allowed_labels, classify_one, split=True):
+    # comments is a list of (comment_id, texto). One request classifies the
+    # whole batch; ids missing from a partial or malformed answer are split in
+    # halves and retried once, and what is still missing after that (or a
+    # lone comment) falls back to classify_one, one request per comment.
+    if not comments:
+        return {}
+    if len(comments) == 1:
+        comment_id, texto = comments[0]
+        return {comment_id: await classify_one(texto)}
+
+    expected_ids = {comment_id for comment_id, _ in comments}
+    respuesta = await classifier.complete(model, build_messages(comments), completion_tokens=20 * len(comments))
+    labels = parse_batch_labels(respuesta, expected_ids, allowed_labels)
+
+    missing = [comment for comment in comments if comment[0] not in labels]
+    if missing:
+        logger.info("Batch answer incomplete, re-splitting" if split else "Batch answer incomplete, one by one", extra=kv(
+            covered=len(labels), batch=len(comments), missing=len(missing)))
+        if not split:
+            # The retry came back incomplete too: splitting further costs more requests than it saves
+            answers = await asyncio.gather(*(classify_one(texto) for _, texto in missing))
+            labels.update((comment_id, answer) for (comment_id, _), answer in zip(missing, answers))
+            return labels
+        if len(missing) == len(comments):
+            halves = [missing[:len(missing) // 2], missing[len(missing) // 2:]]
+        else:
+            halves = [missing]
+        for partial in await asyncio.gather(*(classify_batch(classifier, model, build_messages, half, allowed_labels, classify_one, False) for half in halves)):
+            labels.update(partial)
+    return labels
@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_services import FakeState, start_fake_server
+
+# Offline replay / load benchmark.
+# Starts local fake Apify, OpenAI and Telegram servers (fake_services.py), points
+# the collectors at them through config's endpoint variables and runs one
+# fetch_tiktok_posts + fetch_tiktok_comments cycle in a scratch directory.
+# Without --comments it replays tiktok_posts.json / tiktok_comments.json; with
+# --comments N it serves N synthetic comments instead. Reports throughput and
+# p50/p95/p99 latency per pipeline stage, plus Telegram delivery latency.
+# With --cold-start N it instead runs `main.py --once` N times in fresh
+# processes against the same fake services and reports each run's cold start
+# (imports + state loading), cycle and wall time; the first run starts from
+# empty state, the next ones from the state and snapshots the previous left.
+#
+#   python benchmark.py
+#   python benchmark.py --comments 1000000 --openai-latency 0.3 --openai-429 0.05
+#   python benchmark.py --cold-start 5
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def latency_row(name, count, elapsed, latencies):
+    rate = count / elapsed if elapsed > 0 else 0.0
+    return (f"{name:<12} {count:>10} {rate:>12.1f} "
+            f"{percentile(latencies, 50) * 1000:>10.1f} {percentile(latencies, 95) * 1000:>10.1f} "
+            f"{percentile(latencies, 99) * 1000:>10.1f}")
+
+
+def load_json(file_name):
+    try:
+        with open(file_name, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay / load benchmark against local fake services")
+    parser.add_argument('--comments', type=int, default=0, help="synthetic comments to serve (0 replays tiktok_comments.json)")
+    parser.add_argument('--posts-file', default='tiktok_posts.json')
+    parser.add_argument('--comments-file', default='tiktok_comments.json')
+    for service in ('apify', 'openai', 'telegram'):
+        parser.add_argument(f'--{service}-latency', type=float, default=0.0, help="seconds added to each request")
+        parser.add_argument(f'--{service}-429', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--telegram-per-minute', type=int, default=20, help="per-chat send rate of the dispatcher")
+    parser.add_argument('--drain-timeout', type=float, default=60, help="seconds to wait for queued Telegram messages")
+    parser.add_argument('--workdir', default=None, help="scratch directory (default: a temporary one)")
+    parser.add_argument('--cold-start', type=int, default=0, help="one-shot runs (main.py --once) to time")
+    parser.add_argument('--verbose', action='store_true', help="show the collectors' output")
+    return parser.parse_args()
+
+
+async def run_cycle(args, posts_bg, comments_bg, dispatcher):
+    timings = {}
+
+    started = time.monotonic()
+    await posts_bg.fetch_tiktok_posts()
+    timings['posts'] = time.monotonic() - started
+
+    started = time.monotonic()
+    await comments_bg.fetch_tiktok_comments()
+    timings['comments'] = time.monotonic() - started
+
+    started = time.monotonic()
+    comments_bg.flush_digests()
+    await dispatcher.close(drain_timeout=args.drain_timeout)
+    timings['telegram'] = time.monotonic() - started
+    return timings
+
+
+def measure_cold_start(args, repo_dir):
+    # Each run is a new interpreter; its own timings come from main.py's JSON log line
+    print(f"{'run':>4} {'wall s':>10} {'cold start s':>14} {'cycle s':>10}")
+    for run in range(1, args.cold_start + 1):
+        started = time.monotonic()
+        result = subprocess.run([sys.executable, os.path.join(repo_dir, 'main.py'), '--once'],
+                                env={**os.environ, 'log_format': 'json', 'log_level': 'INFO'},
+                                capture_output=True, text=True)
+        wall = time.monotonic() - started
+        summary = {}
+        for line in result.stdout.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(entry, dict) and entry.get('message') == "One-shot run finished":
+                summary = entry
+        if result.returncode != 0 or not summary:
+            print(f"{run:>4} {wall:>10.3f}  failed (exit code {result.returncode})")
+            if args.verbose:
+                print(result.stdout[-2000:], result.stderr[-2000:])
+            continue
+        print(f"{run:>4} {wall:>10.3f} {summary['cold_start_seconds']:>14.3f} {summary['cycle_seconds']:>10.3f}")
+
+
+def main():
+    args = parse_args()
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    posts = load_json(os.path.join(repo_dir, args.posts_file))
+    comments = load_json(os.path.join(repo_dir, args.comments_file))
+
+    state = FakeState(
+        posts=posts,
+        comments=comments,
+        synthetic_comments=args.comments,
+        latency={'apify': args.apify_latency, 'openai': args.openai_latency, 'telegram': args.telegram_latency},
+        error_rate={'apify': args.apify_429, 'openai': args.openai_429, 'telegram': args.telegram_429},
+    )
+    server, base_url = start_fake_server(state)
+
+    # The collectors write relative paths (and ../aggregated_data), so run two levels deep in scratch
+    workdir = args.workdir or os.path.join(tempfile.mkdtemp(prefix='tiktok_benchmark_'), 'work')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, repo_dir)
+
+    os.environ['apify_token'] = 'benchmark'
+    os.environ['apify_api_url'] = base_url
+    os.environ['openai_base_url'] = f"{base_url}/v1"
+    os.environ['OPENAI_API_KEY'] = 'benchmark'  # config clears openai_key from the environment
+    os.environ['telegram_api_url'] = base_url
+    os.environ.setdefault('log_level', 'INFO' if args.verbose else 'WARNING')
+
+    if args.cold_start:
+        measure_cold_start(args, repo_dir)
+        server.shutdown()
+        print(f"Workdir: {workdir}")
+        return
+
+    output = None if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output) if output is not None else contextlib.nullcontext():
+        import config
+        # config clears these from the environment, so they are set after it loads
+        config.canal_cerrado_telegram_bot_token = os.environ['canal_cerrado_telegram_bot_token'] = 'benchmark'
+        config.canal_cerrado_telegram_chat_id = os.environ['canal_cerrado_telegram_chat_id'] = '-100'
+        import pipeline
+        import posts_bg
+        import comments_bg
+        from telegram_dispatcher import dispatcher_for
+
+        dispatcher = dispatcher_for(config.canal_cerrado_telegram_bot_token)
+        dispatcher.per_chat_per_minute = args.telegram_per_minute
+
+        started = time.monotonic()
+        timings = asyncio.run(run_cycle(args, posts_bg, comments_bg, dispatcher))
+        total = time.monotonic() - started
+        posts_bg.shutdown()
+        comments_bg.seen_comments.close()
+    server.shutdown()
+
+    print(f"Workdir: {workdir}")
+    print(f"Mode: {'synthetic' if args.comments else 'replay'}, {len(state.posts)} posts, "
+          f"{args.comments or len(comments)} comments served")
+    print(f"Fake services: {state.counters}")
+    print(f"Wall time: {total:.2f}s (posts {timings['posts']:.2f}s, comments {timings['comments']:.2f}s, "
+          f"telegram drain {timings['telegram']:.2f}s)")
+    print()
+    print(f"{'stage':<12} {'items':>10} {'items/s':>12} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+
+    # Stages of every run of the cycle (one pipeline per page size), merged by name
+    stages = {}
+    for run in pipeline.completed_runs:
+        for stage in run:
+            merged = stages.setdefault(stage.name, {'processed': 0, 'errors': 0, 'latencies': []})
+            merged['processed'] += stage.processed
+            merged['errors'] += stage.errors
+            merged['latencies'].extend(stage.latencies)
+    for name, merged in stages.items():
+        print(latency_row(name, merged['processed'], timings['comments'], merged['latencies']))
+    print(latency_row('telegram', dispatcher.sent, timings['comments'] + timings['telegram'], dispatcher.latencies))
+    print()
+    print(f"Stage errors: { {name: merged['errors'] for name, merged in stages.items()} }")
+    print(f"Telegram: {dispatcher.sent} sent, {dispatcher.throttled} throttled, "
+          f"{len(dispatcher.dead_letters)} dead letters")
+
+
+if __name__ == "__main__":
+    main()
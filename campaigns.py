@@ -0,0 +1,116 @@
+import json
+import os
+import re
+
+from structured_log import get_logger, kv
+
+# Campaign registry.
+# Each campaign declares the TikTok profiles it follows, the classifier that
+# labels its comments (a built-in one or its own prompt), the fields that
+# classifier writes and where its Telegram alerts go. posts_bg fetches the union
+# of every campaign's profiles once, and comments_bg classifies each new comment
+# for every campaign whose profiles include the post, in the same pass, so a
+# post shared by several campaigns is scraped and stored only once.
+#
+# The registry is read from campaigns.json (env campaigns_file), a list like:
+#
+#   [{"name": "banisi", "profiles": ["banisipanama"], "classifier": "banisi",
+#     "telegram": {"bot_token_env": "banisi_telegram_bot_token", "chat_id_env": "banisi_telegram_chat_id",
+#                  "format": "banisi"}},
+#    {"name": "seguridad", "profiles": ["policiaecuador"], "classifier": "prompt", "model": "gpt-5",
+#     "prompt": "...", "labels": ["positivo", "negativo", "neutral", "sin contexto"]}]
+#
+# "output" lists [field, json key] pairs for classifiers that answer in JSON (the
+# first field is the sentiment and must be "clasificacion"). Without the file the
+# registry holds the political-coyuntura campaign this collector always ran.
+
+logger = get_logger(__name__)
+
+campaigns_file = os.getenv('campaigns_file', 'campaigns.json')
+
+# Alert layouts comments_bg knows how to render (telegram "format")
+telegram_format_names = ('sentimiento', 'banisi')
+
+default_campaigns = [
+    {
+        "name": "coyuntura_politica",
+        "profiles": ["danielnoboaok", "presidenciaec", "comunicacionec", "aquilesalvarz.h", "alcaldiagye"],
+        "classifier": "coyuntura_politica",
+        "telegram": {"bot_token_env": "canal_cerrado_telegram_bot_token", "chat_id_env": "canal_cerrado_telegram_chat_id"},
+    },
+]
+
+
+def profile_of(url):
+    match = re.search(r'/@([^/?]+)', url or '')
+    return match.group(1).lower() if match else None
+
+
+class Campaign:
+    def __init__(self, name, profiles, classifier, model=None, prompt=None, labels=None, output=None, telegram=None):
+        self.name = name
+        self.profiles = list(profiles)
+        self.profile_set = {profile.lower() for profile in self.profiles}
+        self.classifier = classifier
+        self.model = model
+        self.prompt = prompt
+        self.labels = {label.lower() for label in labels} if labels else None
+        self.output = [tuple(pair) for pair in output] if output else None
+        self.telegram = telegram or {}
+
+    def __repr__(self):
+        return f"Campaign({self.name!r}, classifier={self.classifier!r}, profiles={len(self.profiles)})"
+
+    def matches(self, url):
+        # Comments whose post URL carries no profile go to every campaign
+        profile = profile_of(url)
+        return profile is None or profile in self.profile_set
+
+    def telegram_destination(self):
+        # (bot token, chat id) from the environment, or (None, None) when the campaign has no alerts
+        bot_token = os.getenv(self.telegram.get('bot_token_env') or '')
+        chat_id = os.getenv(self.telegram.get('chat_id_env') or '')
+        return (bot_token, chat_id) if bot_token and chat_id else (None, None)
+
+    @property
+    def telegram_format(self):
+        return self.telegram.get('format', 'sentimiento')
+
+
+def load_campaigns(file_name=campaigns_file):
+    if os.path.exists(file_name):
+        with open(file_name, 'r', encoding='utf-8') as file:
+            specs = json.load(file)
+    else:
+        specs = default_campaigns
+
+    campaigns = [Campaign(**spec) for spec in specs]
+    names = [campaign.name for campaign in campaigns]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicated campaign names in {file_name}: {names}")
+    for campaign in campaigns:
+        if campaign.output and campaign.output[0][0] != 'clasificacion':
+            raise ValueError(f"Campaign {campaign.name}: the first output field must be 'clasificacion'")
+        if campaign.telegram_format not in telegram_format_names:
+            raise ValueError(f"Campaign {campaign.name}: unknown telegram format {campaign.telegram_format!r}, "
+                             f"expected one of {', '.join(telegram_format_names)}")
+    logger.info("Campaigns loaded", extra=kv(
+        source=file_name if specs is not default_campaigns else 'default', campaigns=','.join(names)))
+    return campaigns
+
+
+def all_profiles(campaigns):
+    # Union of the campaigns' profiles, in declaration order
+    profiles = []
+    for campaign in campaigns:
+        for profile in campaign.profiles:
+            if profile not in profiles:
+                profiles.append(profile)
+    return profiles
+
+
+def campaigns_for(url, campaigns):
+    return [campaign for campaign in campaigns if campaign.matches(url)]
+
+
+campaigns = load_campaigns()
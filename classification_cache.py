@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+
+from structured_log import get_logger, kv
+
+# Classification cache keyed by normalized text, model and prompt version, plus a
+# deterministic pre-classifier for comments that carry no content ('jajaja',
+# 'gracias', emojis only...). Both run before any request reaches the LLM.
+
+logger = get_logger(__name__)
+
+
+def normalizar_texto(texto):
+    texto = unicodedata.normalize('NFKC', texto or '').lower()
+    texto = re.sub(r'\s+', ' ', texto)
+    return texto.strip(' .,;:!¡?¿')
+
+
+def prompt_version(prompt):
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12]
+
+
+# Palabras que por sí solas no permiten clasificar (ver reglas de exclusión del prompt).
+# "Sí", "no" o "ya" no están: responden al video, son una postura y la clasifica el LLM
+palabras_sin_contexto = {
+    'ok', 'oki', 'okey', 'okay', 'gracias', 'grasias', 'muchas gracias', 'thanks',
+    'hola', 'buenas', 'buenos dias', 'buenos días', 'uff', 'ufff', 'ah', 'oh',
+    'first', 'primero', 'primer', 'xd', 'lol', 'pov', 'yo', 'aja', 'ajá', 'mmm',
+}
+
+# Risa = sílaba repetida ('jaja', 'ajaja', 'jsjs', 'hehe', 'kkk'): una sola ('joe', 'ha') es una palabra
+_risa = re.compile(r'^([aeiou]*(j+[aeiou]+){2,}j*|(j+s+){2,}j*|(h+[aeiou]+){2,}h*|k{3,}|(x+d+)+|(l+o+l+)+)$')
+_menciones_y_enlaces = re.compile(r'(@[\w.]+|#\w+|https?://\S+|www\.\S+)')
+
+
+def preclasificar(texto):
+    # Returns 'sin contexto' for trivially empty content, None when the LLM is needed
+    normalizado = normalizar_texto(texto)
+    sin_menciones = _menciones_y_enlaces.sub(' ', normalizado)
+
+    # Keep only letters and digits: emojis, stickers and punctuation disappear
+    alfanumerico = ''.join(ch for ch in sin_menciones if ch.isalnum() or ch == ' ')
+    alfanumerico = re.sub(r'\s+', ' ', alfanumerico).strip()
+
+    # Only emojis, stickers or punctuation; short words and numbers ('15') go on to the LLM
+    if not alfanumerico:
+        return 'sin contexto'
+    if alfanumerico in palabras_sin_contexto:
+        return 'sin contexto'
+    if all(_risa.match(palabra) for palabra in alfanumerico.split(' ')):
+        return 'sin contexto'
+    return None
+
+
+class ClassificationCache:
+    # LRU cache persisted as a JSON list of [key, label] pairs, oldest first
+
+    def __init__(self, file_name, max_entries=50000):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        if os.path.exists(file_name):
+            try:
+                with open(file_name, 'r') as file:
+                    self.entries = OrderedDict(json.load(file))
+            except (json.JSONDecodeError, ValueError):
+                self.entries = OrderedDict()
+
+    @staticmethod
+    def key(texto, model, version):
+        return hashlib.sha1(f"{model}\x00{version}\x00{normalizar_texto(texto)}".encode('utf-8')).hexdigest()
+
+    def get(self, texto, model, version):
+        key = self.key(texto, model, version)
+        label = self.entries.get(key)
+        if label is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return label
+
+    def put(self, texto, model, version, label):
+        key = self.key(texto, model, version)
+        self.entries[key] = label
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_file = f"{self.file_name}.tmp"
+        with open(tmp_file, 'w') as file:
+            json.dump(list(self.entries.items()), file)
+        os.replace(tmp_file, self.file_name)
+        self.dirty = False
+        logger.info("Classification cache saved", extra=kv(entries=len(self.entries), hits=self.hits, misses=self.misses))
@@ -0,0 +1,221 @@
+import argparse
+import sqlite3
+import time
+
+from campaigns import profile_of
+from jsonl_store import iter_records
+from normalizer import unknown_time
+from structured_log import get_logger, kv
+
+# Embedded search index over the collected comments.
+# Every saved comment is also written to a SQLite table (text, user, user_id,
+# url, profile, created_at, clasificacion, likes_count) with B-tree indexes on
+# the filter columns and an FTS5 index on the text, kept in sync by triggers.
+# "What did people say about X on post Y last week" becomes one query instead
+# of loading tiktok_comments.json into pandas.
+#
+#   python comment_search.py "vacuna" --profile presidenciaec --since 2025-10-20 --sentimiento negativo
+#   python comment_search.py --post https://www.tiktok.com/@presidenciaec/video/7567060286889348359 --min-likes 50
+
+logger = get_logger(__name__)
+
+indexed_fields = ('comment_id', 'url', 'profile', 'text', 'user', 'user_id', 'created_at', 'clasificacion', 'likes_count')
+
+
+class CommentSearch:
+    def __init__(self, db_file='comment_search.db', commit_every=2.0):
+        self.db_file = db_file
+        self.commit_every = commit_every
+        self.last_commit = time.monotonic()
+
+        self.conn = sqlite3.connect(db_file)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS comments ("
+            "id INTEGER PRIMARY KEY, comment_id TEXT NOT NULL UNIQUE, url TEXT, profile TEXT, text TEXT, "
+            "user TEXT, user_id TEXT, created_at TEXT, clasificacion TEXT, likes_count INTEGER)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS comments_created_idx ON comments (created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS comments_profile_idx ON comments (profile, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS comments_url_idx ON comments (url, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS comments_clasificacion_idx ON comments (clasificacion COLLATE NOCASE, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS comments_user_idx ON comments (user)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS comments_likes_idx ON comments (likes_count)")
+        # External-content FTS table: the text is stored once, in comments
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5("
+            "text, content='comments', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        self.conn.executescript(
+            "CREATE TRIGGER IF NOT EXISTS comments_ai AFTER INSERT ON comments BEGIN "
+            "INSERT INTO comments_fts (rowid, text) VALUES (new.id, new.text); END;"
+            "CREATE TRIGGER IF NOT EXISTS comments_ad AFTER DELETE ON comments BEGIN "
+            "INSERT INTO comments_fts (comments_fts, rowid, text) VALUES ('delete', old.id, old.text); END;"
+            "CREATE TRIGGER IF NOT EXISTS comments_au AFTER UPDATE OF text ON comments BEGIN "
+            "INSERT INTO comments_fts (comments_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+            "INSERT INTO comments_fts (rowid, text) VALUES (new.id, new.text); END;"
+        )
+        self.conn.commit()
+
+    def __repr__(self):
+        return f"CommentSearch({self.db_file!r})"
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM comments").fetchone()[0]
+
+    def is_empty(self):
+        # One row lookup, not the COUNT(*) scan of __len__
+        return self.conn.execute("SELECT 1 FROM comments LIMIT 1").fetchone() is None
+
+    @staticmethod
+    def _row(comment):
+        created_at = comment.get('created_at')
+        likes = comment.get('likes_count')
+        return (
+            str(comment.get('comment_id')), comment.get('url'), profile_of(comment.get('url')), comment.get('text'),
+            comment.get('user'), None if comment.get('user_id') is None else str(comment.get('user_id')),
+            None if created_at == unknown_time else created_at, comment.get('clasificacion'),
+            int(likes) if isinstance(likes, (int, float)) else None,
+        )
+
+    def add_many(self, comments):
+        # A comment saved again (e.g. reclassified) replaces its row
+        rows = [self._row(comment) for comment in comments if comment.get('comment_id') is not None]
+        self.conn.executemany(
+            "INSERT INTO comments (comment_id, url, profile, text, user, user_id, created_at, clasificacion, likes_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(comment_id) DO UPDATE SET "
+            "url = excluded.url, profile = excluded.profile, text = excluded.text, user = excluded.user, "
+            "user_id = excluded.user_id, created_at = excluded.created_at, clasificacion = excluded.clasificacion, "
+            "likes_count = excluded.likes_count",
+            rows
+        )
+        self._maybe_commit()
+        return len(rows)
+
+    def add(self, comment):
+        self.add_many([comment])
+
+    def search(self, query=None, since=None, until=None, clasificacion=None, profile=None, post=None, user=None,
+               min_likes=None, max_likes=None, order='relevance', limit=50):
+        # query is free text: every word must appear (accents and case ignored).
+        # since / until are 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' local time, until is inclusive.
+        # order: 'relevance' (bm25, only with a query), 'recent' or 'likes'.
+        where, params = [], []
+        if since:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until:
+            where.append("created_at <= ?")
+            params.append(until + ' 23:59:59' if len(until) == 10 else until)
+        if clasificacion:
+            where.append("clasificacion = ? COLLATE NOCASE")
+            params.append(clasificacion)
+        if profile:
+            where.append("profile = ?")
+            params.append(profile.lstrip('@').lower())
+        if post:
+            where.append("url = ?")
+            params.append(post)
+        if user:
+            where.append("user = ?")
+            params.append(user.lstrip('@'))
+        if min_likes is not None:
+            where.append("likes_count >= ?")
+            params.append(min_likes)
+        if max_likes is not None:
+            where.append("likes_count <= ?")
+            params.append(max_likes)
+
+        if query:
+            # The FTS match drives the query; bm25 ranks it (lower is better)
+            sql = ("SELECT comments.* FROM comments_fts JOIN comments ON comments.id = comments_fts.rowid "
+                   "WHERE comments_fts MATCH ?")
+            params.insert(0, fts_query(query))
+            sql += ''.join(f" AND {condition}" for condition in where)
+        else:
+            sql = "SELECT comments.* FROM comments"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+        if order == 'relevance' and query:
+            sql += " ORDER BY bm25(comments_fts)"
+        elif order == 'likes':
+            sql += " ORDER BY likes_count DESC"
+        else:
+            sql += " ORDER BY created_at DESC"
+        sql += " LIMIT ?"
+        params.append(limit)
+        return [{field: row[field] for field in indexed_fields} for row in self.conn.execute(sql, params)]
+
+    def _maybe_commit(self):
+        if time.monotonic() - self.last_commit >= self.commit_every:
+            self.save()
+
+    def save(self):
+        self.conn.commit()
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.save()
+        self.conn.close()
+
+
+def fts_query(text):
+    # Free text -> FTS5 query: each word quoted (no operators from user input), all of them required
+    words = [word.replace('"', '') for word in text.split()]
+    return ' '.join(f'"{word}"' for word in words if word)
+
+
+def open_comment_search(db_file='comment_search.db', seed=None, **kwargs):
+    # seed is a callable returning the stored comments; it only runs while the index is empty
+    index = CommentSearch(db_file, **kwargs)
+    if seed is not None and index.is_empty():
+        count = 0
+        batch = []
+        for comment in seed():
+            batch.append(comment)
+            if len(batch) >= 5000:
+                count += index.add_many(batch)
+                batch = []
+        count += index.add_many(batch)
+        index.save()
+        logger.info("Seeded comment search index", extra=kv(db=db_file, count=count))
+    return index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Search the collected comments")
+    parser.add_argument('query', nargs='?', default=None, help="words that must appear in the comment")
+    parser.add_argument('--since', help="YYYY-MM-DD[ HH:MM:SS], local time")
+    parser.add_argument('--until', help="YYYY-MM-DD[ HH:MM:SS], local time, inclusive")
+    parser.add_argument('--sentimiento', '--clasificacion', dest='clasificacion')
+    parser.add_argument('--profile', help="TikTok profile of the post")
+    parser.add_argument('--post', help="post URL")
+    parser.add_argument('--user', help="comment author")
+    parser.add_argument('--min-likes', type=int)
+    parser.add_argument('--max-likes', type=int)
+    parser.add_argument('--order', choices=('relevance', 'recent', 'likes'), default='relevance')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--db', default='comment_search.db')
+    parser.add_argument('--source', default='tiktok_comments.jsonl', help="comments used to build an empty index")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    search_index = open_comment_search(args.db, seed=lambda: iter_records(args.source))
+    started = time.perf_counter()
+    results = search_index.search(
+        args.query, since=args.since, until=args.until, clasificacion=args.clasificacion, profile=args.profile,
+        post=args.post, user=args.user, min_likes=args.min_likes, max_likes=args.max_likes,
+        order=args.order, limit=args.limit,
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    for comment in results:
+        text = (comment['text'] or '').replace('\n', ' ')
+        print(f"{comment['created_at'] or '-':<19}  {comment['likes_count'] or 0:>6}  {comment['clasificacion'] or '-':<12}  "
+              f"@{comment['user']}: {text}")
+        print(f"{'':<29}{comment['url']}")
+    print(f"{len(results)} comments in {elapsed:.1f} ms")
+    search_index.close()
@@ -1,75 +1,149 @@
 import asyncio
-from apify_client import ApifyClient
 import json
+from collections import Counter
 import os
-from datetime import datetime, timedelta
-import pytz
-from dotenv import load_dotenv, find_dotenv
-import aiohttp
-from openai import OpenAI
-import pandas as pd
-
-# Clear any existing environment variables
-keys = ['apify_key', 'canal_cerrado_telegram_bot_token', 'canal_cerrado_telegram_chat_id', 'openai_key']
-
-for key in keys:
-    if key in os.environ:
-        del os.environ[key]
-
-# Load dotenv()
-try:
-    load_dotenv(find_dotenv())
-    print("Environment variables loaded successfully")
-except Exception as e:
-    print(f"An error occurred while loading the environment variables: {e}")
-
-# Accesing Environment Variables
-apify_key = os.getenv("apify_token")                                                   
-canal_cerrado_telegram_bot_token = os.getenv('canal_cerrado_telegram_bot_token')
-canal_cerrado_telegram_chat_id = os.getenv('canal_cerrado_telegram_chat_id')
-openai_key = os.getenv('openai_key')
-
-print("Environment Variables Loaded from Functions:")
-print(f"APIFY_API_KEY: {apify_key}")
-print(f"canal_cerrado_telegram_bot_token: {canal_cerrado_telegram_bot_token}")
-print(f"canal_cerrado_telegram_chat_id: {canal_cerrado_telegram_chat_id}")
-print(f"openai_key: {openai_key}")
-
-
-# Cliente de Apify
-client = ApifyClient(apify_key)
-
-# Cliente de Open AI
-client_openai = OpenAI(api_key=openai_key)
+import random
+from config import actor_runner, client_openai, client_openai_async
+from async_classifier import AsyncClassifier, classify_batch
+from campaigns import campaigns
+from classification_cache import ClassificationCache, preclasificar, prompt_version
+from comment_search import open_comment_search
+from consolidated_store import ConsolidatedWriter
+from coyuntura_politica import etiquetas_coyuntura_politica, prompt_coyuntura_politica, version_coyuntura_politica
+from dedup_index import open_dedup_index
+from jsonl_store import append_record, iter_records, migrate_json_array, start_background_compaction
+from local_model import NaiveBayesModel
+from metrics import (
+    bot_verdicts_total, classifications_total, comments_total, local_model_agreement_total, start_metrics_server
+)
+from near_duplicates import NearDuplicateDetector, usuario_real
+from normalizer import as_dict, normalize_comments
+from parquet_archive import comments_archive, export_in_background
+from pipeline import Pipeline, Stage
+from post_tiering import post_key, post_tier_scheduler, track_recent_posts
+from recent_posts import recent_post_index
+from reply_threads import ReplyThreads
+from telegram_digest import TelegramDigest
+from structured_log import get_logger, kv
+from telegram_dispatcher import close_dispatchers, dispatcher_for
+from work_log import WorkLog
+
+logger = get_logger('comments_bg')
+
+# Clasificaciones concurrentes sin bloquear el event loop
+classifier = AsyncClassifier(
+    client_openai_async,
+    concurrency=int(os.getenv('openai_concurrency', 8)),
+    rpm=int(os.getenv('openai_rpm', 500)),
+    tpm=int(os.getenv('openai_tpm', 200000)),
+)
+
 
 # Función para clasificar comentarios utilizando OpenAI
+def mensajes_clasificacion_texto(texto):
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Eres un sistema que clasifica comentarios dirigidos a la Secretaría Técnica "
+                "Ecuador Crece Sin Desnutrición Infantil. Debes responder únicamente con una "
+                "de las siguientes categorías: 'Positivo' (actitud positiva, emojis de apoyo, etc), "
+                "'Negativo' (descontento o crítica, emojis de molestia), 'Neutral' (comentario neutral) y 'Sin Contexto' (emojis o texto que no permite clasificar adecuadamente) "
+              
+            )
+        },
+        {
+            "role": "user",
+            "content": (
+                f"En el contexto de comentarios dirigidos a la Secretaría Técnica Ecuador Crece "
+                f"Sin Desnutrición Infantil, clasifica el siguiente comentario como 'Positivo', "
+                f"'Negativo', 'Sin Contexto'  o 'Neutral'. Responde únicamente con una de estas tres: {texto}"
+            )
+        }
+    ]
+
+
 def clasificacion_texto(texto):
     completion = client_openai.chat.completions.create(
         model="gpt-4-turbo",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "Eres un sistema que clasifica comentarios dirigidos a la Secretaría Técnica "
-                    "Ecuador Crece Sin Desnutrición Infantil. Debes responder únicamente con una "
-                    "de las siguientes categorías: 'Positivo' (actitud positiva, emojis de apoyo, etc), "
-                    "'Negativo' (descontento o crítica, emojis de molestia), 'Neutral' (comentario neutral) y 'Sin Contexto' (emojis o texto que no permite clasificar adecuadamente) "
-                  
-                )
-            },
-            {
-                "role": "user",
-                "content": (
-                    f"En el contexto de comentarios dirigidos a la Secretaría Técnica Ecuador Crece "
-                    f"Sin Desnutrición Infantil, clasifica el siguiente comentario como 'Positivo', "
-                    f"'Negativo', 'Sin Contexto'  o 'Neutral'. Responde únicamente con una de estas tres: {texto}"
-                )
-            }
-        ]
+        messages=mensajes_clasificacion_texto(texto)
     )
     respuesta = completion.choices[0].message.content.strip()
     return respuesta
 
+
+async def clasificacion_texto_async(texto):
+    respuesta = await classifier.complete("gpt-4-turbo", mensajes_clasificacion_texto(texto))
+    return respuesta.strip()
+
+
+async def clasificacion_desnutricion_async(texto):
+    # Same labels as the other classifiers: lowercase, without quotes or a final period
+    return (await clasificacion_texto_async(texto)).strip(" .'\"").lower()
+
+
+version_desnutricion = prompt_version(json.dumps(mensajes_clasificacion_texto(""), ensure_ascii=False))
+
+
+prompt_banisi = (
+    "Eres un analista de opinión pública especializado en monitoreo de reputación bancaria. "
+    "Debes clasificar cada comentario en TRES dimensiones: sentimiento, tema y tipo.\n\n"
+
+    "1. SENTIMIENTO (estado emocional del comentario):\n"
+    "- 'positivo': cuando hay elogio, confianza, buena experiencia, agradecimiento o satisfacción.\n"
+    "- 'negativo': cuando hay queja, frustración, crítica, rechazo, acusación o sarcasmo crítico.\n"
+    "- 'neutral': cuando es informativo, descriptivo o pregunta sin valoración clara.\n"
+    "- 'sin contexto': cuando NO se refiere al banco Banisi (ej. otro tema, otro banco, política sin relación), "
+    "o cuando son solo emojis, spam o irrelevante.\n\n"
+
+    "2. TEMA (el área principal del comentario, solo UNA):\n"
+    "- 'plataformas digitales': si trata sobre la app móvil, banca en línea, Yappy, fallas técnicas.\n"
+    "- 'operaciones financieras': si menciona transferencias, débitos, pagos, transacciones.\n"
+    "- 'atención al cliente': si habla de atención en agencia, WhatsApp, correo, falta de respuesta, tiempo de espera, necesidad de asesor.\n"
+    "- 'infraestructura': si se refiere a cajeros automáticos o sucursales físicas.\n"
+    "- 'confianza/seguridad': si cuestiona o apoya la seguridad de cuentas, cobros, comisiones, accesibilidad de horarios/canales.\n"
+    "- 'política/reputación': si menciona corrupción, lavado de dinero, vínculos políticos, reputación institucional.\n"
+    "- 'otro': si no encaja en ninguna categoría anterior.\n\n"
+
+    "3. TIPO DE INTERACCIÓN (intención del usuario):\n"
+    "- 'queja': reclamo explícito, insatisfacción, denuncia.\n"
+    "- 'duda': pregunta, solicitud de información, incertidumbre.\n"
+    "- 'sugerencia': propuesta o recomendación para mejorar.\n"
+    "- 'experiencia positiva': relato favorable o de satisfacción.\n"
+    "- 'comentario general': opinión o mención sin tono de reclamo ni elogio, ni intención de solicitar algo.\n\n"
+
+    "FORMATO DE RESPUESTA:\n"
+    "Devuelve SIEMPRE en JSON válido, por ejemplo:\n"
+    "{\n"
+    "  \"sentimiento\": \"negativo\",\n"
+    "  \"tema\": \"plataformas digitales\",\n"
+    "  \"tipo\": \"queja\"\n"
+    "}\n\n"
+
+    "EJEMPLOS:\n"
+    "Comentario: \"La app de Banisi es una porquería, nunca funciona para transferencias.\"\n"
+    "Respuesta:\n"
+    "{\n"
+    "  \"sentimiento\": \"negativo\",\n"
+    "  \"tema\": \"plataformas digitales\",\n"
+    "  \"tipo\": \"queja\"\n"
+    "}\n"
+)
+
+
+def mensajes_banisi(texto):
+    return [
+        {
+            "role": "system",
+            "content": prompt_banisi
+        },
+        {
+            "role": "user",
+            "content": f"Comentario:\n\"{texto}\"\n\nClasifica en JSON."
+        }
+    ]
+
+
 def clasificacion_banisi(texto):
     """
     Clasifica un comentario sobre Banisi Panamá en tres dimensiones:
@@ -81,63 +155,48 @@ def clasificacion_banisi(texto):
     """
     completion = client_openai.chat.completions.create(
         model="gpt-5",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "Eres un analista de opinión pública especializado en monitoreo de reputación bancaria. "
-                    "Debes clasificar cada comentario en TRES dimensiones: sentimiento, tema y tipo.\n\n"
-
-                    "1. SENTIMIENTO (estado emocional del comentario):\n"
-                    "- 'positivo': cuando hay elogio, confianza, buena experiencia, agradecimiento o satisfacción.\n"
-                    "- 'negativo': cuando hay queja, frustración, crítica, rechazo, acusación o sarcasmo crítico.\n"
-                    "- 'neutral': cuando es informativo, descriptivo o pregunta sin valoración clara.\n"
-                    "- 'sin contexto': cuando NO se refiere al banco Banisi (ej. otro tema, otro banco, política sin relación), "
-                    "o cuando son solo emojis, spam o irrelevante.\n\n"
-
-                    "2. TEMA (el área principal del comentario, solo UNA):\n"
-                    "- 'plataformas digitales': si trata sobre la app móvil, banca en línea, Yappy, fallas técnicas.\n"
-                    "- 'operaciones financieras': si menciona transferencias, débitos, pagos, transacciones.\n"
-                    "- 'atención al cliente': si habla de atención en agencia, WhatsApp, correo, falta de respuesta, tiempo de espera, necesidad de asesor.\n"
-                    "- 'infraestructura': si se refiere a cajeros automáticos o sucursales físicas.\n"
-                    "- 'confianza/seguridad': si cuestiona o apoya la seguridad de cuentas, cobros, comisiones, accesibilidad de horarios/canales.\n"
-                    "- 'política/reputación': si menciona corrupción, lavado de dinero, vínculos políticos, reputación institucional.\n"
-                    "- 'otro': si no encaja en ninguna categoría anterior.\n\n"
-
-                    "3. TIPO DE INTERACCIÓN (intención del usuario):\n"
-                    "- 'queja': reclamo explícito, insatisfacción, denuncia.\n"
-                    "- 'duda': pregunta, solicitud de información, incertidumbre.\n"
-                    "- 'sugerencia': propuesta o recomendación para mejorar.\n"
-                    "- 'experiencia positiva': relato favorable o de satisfacción.\n"
-                    "- 'comentario general': opinión o mención sin tono de reclamo ni elogio, ni intención de solicitar algo.\n\n"
-
-                    "FORMATO DE RESPUESTA:\n"
-                    "Devuelve SIEMPRE en JSON válido, por ejemplo:\n"
-                    "{\n"
-                    "  \"sentimiento\": \"negativo\",\n"
-                    "  \"tema\": \"plataformas digitales\",\n"
-                    "  \"tipo\": \"queja\"\n"
-                    "}\n\n"
-
-                    "EJEMPLOS:\n"
-                    "Comentario: \"La app de Banisi es una porquería, nunca funciona para transferencias.\"\n"
-                    "Respuesta:\n"
-                    "{\n"
-                    "  \"sentimiento\": \"negativo\",\n"
-                    "  \"tema\": \"plataformas digitales\",\n"
-                    "  \"tipo\": \"queja\"\n"
-                    "}\n"
-                )
-            },
-            {
-                "role": "user",
-                "content": f"Comentario:\n\"{texto}\"\n\nClasifica en JSON."
-            }
-        ]
+        messages=mensajes_banisi(texto)
     )
     
     return json.loads(completion.choices[0].message.content)
 
+
+async def clasificacion_banisi_async(texto):
+    return json.loads(await classifier.complete("gpt-5", mensajes_banisi(texto)))
+
+
+def campos_json(respuesta, salida):
+    # JSON answer -> {field: value} following the campaign's [field, json key] pairs
+    datos = json.loads(respuesta)
+    campos = {campo: str(datos[clave]).strip().lower() if datos.get(clave) is not None else None
+              for campo, clave in salida}
+    if not campos.get('clasificacion'):
+        raise ValueError(f"Respuesta sin clasificación: {respuesta!r}")
+    return campos
+
+
+# Campos que guarda la campaña Banisi: sentimiento como clasificacion, más tema y tipo
+salida_banisi = (('clasificacion', 'sentimiento'), ('topic', 'tema'), ('interaction_type', 'tipo'))
+version_banisi = prompt_version(prompt_banisi)
+
+
+async def clasificacion_banisi_campos_async(texto):
+    return campos_json(await classifier.complete("gpt-5", mensajes_banisi(texto)), salida_banisi)
+
+
+def mensajes_coyuntura_politica(texto):
+    return [
+        {
+            "role": "system",
+            "content": prompt_coyuntura_politica
+        },
+        {
+            "role": "user",
+            "content": f"Comentario:\n\"{texto}\"\n\nClasifica con: positivo, negativo, neutral o sin contexto."
+        }
+    ]
+
+
 def clasificacion_texto_coyuntura_politica(texto):
     """
     Clasifica el sentimiento de un comentario sobre coyuntura nacional o social en Ecuador.
@@ -145,62 +204,154 @@ def clasificacion_texto_coyuntura_politica(texto):
     """
     completion = client_openai.chat.completions.create(
         model="gpt-5",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "Eres un analista de opinión pública especializado en monitorear la coyuntura nacional y social en Ecuador. "
-                    "Tu tarea es clasificar comentarios según su tono general (positivo, negativo o neutral) "
-                    "y descartar los que no aportan contexto.\n\n"
-
-                    "OBJETIVO:\n"
-                    "Analizar el sentimiento ciudadano frente a temas de actualidad, política, economía, seguridad, sociedad, "
-                    "instituciones públicas o hechos relevantes del país.\n\n"
-
-                    "REGLAS DE EXCLUSIÓN (contenido que NO debe analizarse):\n"
-                    "• Comentarios vacíos o sin significado ('ok', 'gracias', 'jajaja', emojis, stickers, spam, enlaces, solo etiquetas).\n"
-                
-                    "CRITERIOS DE SENTIMIENTO (solo si es relevante):\n"
-                    "• 'positivo': expresa aprobación, esperanza, optimismo, satisfacción o valoración favorable.\n"
-                    "• 'negativo': expresa crítica, rechazo, indignación, desconfianza o frustración.\n"
-                    "• 'neutral': informativo, descriptivo o sin valoración emocional clara.\n"
-                    "• Si hay sarcasmo con crítica implícita → 'negativo'.\n"
-                    "• Si mezcla opiniones, etiqueta según el tono dominante.\n\n"
-
-                    "FORMATO DE RESPUESTA:\n"
-                    "Responde SIEMPRE con una sola palabra en minúsculas: 'positivo', 'negativo', 'neutral' o 'sin contexto'.\n\n"
-
-                    "EJEMPLOS:\n"
-                    "1) 'Qué bueno que bajó la delincuencia en Quito' → positivo\n"
-                    "2) 'Todo está cada vez peor en este país' → negativo\n"
-                    "3) 'El transporte público está colapsado' → negativo\n"
-                    "4) 'Hoy subió el precio de la gasolina' → neutral\n"
-                    "5) 'Jajaja' → sin contexto\n"
-                    "6) 'Gracias' → sin contexto\n"
-                    "7) 'Al fin una buena noticia para la gente' → positivo\n"
-                    "8) 'Increíble cómo sigue la corrupción en todos lados' → negativo\n"
-                    "9) '😂😂' → sin contexto\n"
-                    "10) 'El presidente anunció nuevas medidas económicas' → neutral\n"
-                )
-            },
-            {
-                "role": "user",
-                "content": f"Comentario:\n\"{texto}\"\n\nClasifica con: positivo, negativo, neutral o sin contexto."
-            }
-        ]
+        messages=mensajes_coyuntura_politica(texto)
     )
     return completion.choices[0].message.content.strip().lower()
 
 
+async def clasificacion_texto_coyuntura_politica_async(texto):
+    respuesta = await classifier.complete("gpt-5", mensajes_coyuntura_politica(texto))
+    return respuesta.strip().lower()
+
+
+# Modo por lotes: el prompt largo se envía una sola vez para varios comentarios
+instrucciones_lote = (
+    "\nMODO POR LOTES:\n"
+    "Recibirás un arreglo JSON de objetos con 'id' y 'texto'. Clasifica cada comentario por separado con los "
+    "mismos criterios y responde ÚNICAMENTE con un arreglo JSON, un objeto por cada id recibido, por ejemplo:\n"
+    "[{\"id\": \"123\", \"clasificacion\": \"negativo\"}, {\"id\": \"456\", \"clasificacion\": \"sin contexto\"}]\n"
+)
+
+prompt_lote_coyuntura_politica = prompt_coyuntura_politica + instrucciones_lote
+
+
+def mensajes_lote_coyuntura_politica(comentarios):
+    lote = [{"id": comment_id, "texto": texto} for comment_id, texto in comentarios]
+    return [
+        {
+            "role": "system",
+            "content": prompt_lote_coyuntura_politica
+        },
+        {
+            "role": "user",
+            "content": f"Comentarios:\n{json.dumps(lote, ensure_ascii=False)}\n\nClasifica cada id con: positivo, negativo, neutral o sin contexto."
+        }
+    ]
+
+
+async def clasificacion_lote_coyuntura_politica_async(comentarios):
+    """
+    Clasifica varios comentarios (lista de (comment_id, texto)) en una sola petición.
+    Devuelve un dict comment_id -> 'positivo', 'negativo', 'neutral' o 'sin contexto'.
+    """
+    return await classify_batch(
+        classifier, "gpt-5", mensajes_lote_coyuntura_politica, comentarios,
+        etiquetas_coyuntura_politica, clasificacion_texto_coyuntura_politica_async
+    )
+
+
+class CampaignClassifier:
+    # The classifier of one campaign. classify_one answers a single comment with
+    # its label (or, for classifiers with an output schema, a dict of fields);
+    # classify_many, when the classifier supports batches, answers a list of
+    # (comment_id, texto) with {comment_id: label}. version keys the cache.
+    def __init__(self, campaign, model, version, classify_one, classify_many=None, output=None, local_model=None):
+        self.campaign = campaign
+        self.name = campaign.name
+        self.model = model
+        self.version = version
+        self.classify_one = classify_one
+        self.classify_many = classify_many or self._one_at_a_time
+        self.batch_size = classification_batch_size if classify_many else 1
+        self.output = output
+        self.local_model = local_model
+
+    def __repr__(self):
+        return f"CampaignClassifier({self.name!r}, model={self.model!r})"
+
+    async def _one_at_a_time(self, comentarios):
+        return {comment_id: await self.classify_one(texto) for comment_id, texto in comentarios}
+
+    def sin_contexto(self, label="sin contexto"):
+        if self.output is None:
+            return label
+        return {campo: label if campo == 'clasificacion' else None for campo, _ in self.output}
+
+    @staticmethod
+    def fields(value, source=None):
+        # Stored form of an answer: {'clasificacion': ..., plus the other output fields, 'fuente': source}.
+        # Only 'llm' answers are real labels (local_model.py trains on those).
+        campos = dict(value) if isinstance(value, dict) else {'clasificacion': value}
+        campos['fuente'] = source
+        return campos
+
+
+def prompt_classifier(campaign):
+    # Classifier built from a campaign's own prompt (campaigns.json "prompt")
+    model = campaign.model or "gpt-5"
+    if campaign.output:
+        def mensajes_json(texto):
+            return [
+                {"role": "system", "content": campaign.prompt},
+                {"role": "user", "content": f"Comentario:\n\"{texto}\"\n\nClasifica en JSON."},
+            ]
+
+        async def clasificar_json(texto):
+            return campos_json(await classifier.complete(model, mensajes_json(texto)), campaign.output)
+
+        version = prompt_version(campaign.prompt + json.dumps(campaign.output))
+        return CampaignClassifier(campaign, model, version, clasificar_json, output=campaign.output)
+
+    etiquetas = campaign.labels or etiquetas_coyuntura_politica
+    opciones = ", ".join(sorted(etiquetas))
+    prompt_lote = campaign.prompt + instrucciones_lote
+
+    def mensajes(texto):
+        return [
+            {"role": "system", "content": campaign.prompt},
+            {"role": "user", "content": f"Comentario:\n\"{texto}\"\n\nClasifica con: {opciones}."},
+        ]
+
+    def mensajes_lote(comentarios):
+        lote = [{"id": comment_id, "texto": texto} for comment_id, texto in comentarios]
+        return [
+            {"role": "system", "content": prompt_lote},
+            {"role": "user", "content": f"Comentarios:\n{json.dumps(lote, ensure_ascii=False)}\n\nClasifica cada id con: {opciones}."},
+        ]
+
+    async def clasificar(texto):
+        return (await classifier.complete(model, mensajes(texto))).strip().lower()
+
+    async def clasificar_lote(comentarios):
+        return await classify_batch(classifier, model, mensajes_lote, comentarios, etiquetas, clasificar)
+
+    return CampaignClassifier(campaign, model, prompt_version(campaign.prompt), clasificar, clasificar_lote)
+
+
+def build_campaign_classifier(campaign):
+    if campaign.classifier == 'coyuntura_politica':
+        return CampaignClassifier(campaign, "gpt-5", version_coyuntura_politica,
+                                  clasificacion_texto_coyuntura_politica_async,
+                                  clasificacion_lote_coyuntura_politica_async, local_model=local_model)
+    if campaign.classifier == 'banisi':
+        return CampaignClassifier(campaign, "gpt-5", version_banisi, clasificacion_banisi_campos_async,
+                                  output=salida_banisi)
+    if campaign.classifier == 'desnutricion':
+        return CampaignClassifier(campaign, "gpt-4-turbo", version_desnutricion, clasificacion_desnutricion_async)
+    if campaign.classifier == 'prompt' and campaign.prompt:
+        return prompt_classifier(campaign)
+    raise ValueError(f"Campaign {campaign.name}: unknown classifier {campaign.classifier!r}")
+
+
 # Se
 
 # Send telegram message to Canal Cerrado
-async def coyuntura_politica_send_telegram_message_async(post_comments, bot, chat_id):
-    url = f"https://api.telegram.org/bot{bot}/sendMessage"
-
+async def coyuntura_politica_send_telegram_message_async(post_comments, bot, chat_id, on_delivered=None):
     comment = post_comments.get('text', '')
     if comment is None or not comment.strip():
-        print("No se envía mensaje: comentario vacío o None")
+        logger.debug("No se envía mensaje: comentario vacío o None", extra=kv(comment_id=post_comments.get('comment_id')))
+        if on_delivered is not None:
+            on_delivered(False)
         return
     
     sentimiento = post_comments['clasificacion']
@@ -219,41 +370,20 @@ async def coyuntura_politica_send_telegram_message_async(post_comments, bot, cha
         f"👤 Nombre: {post_comments['user']}\n\n"
         f"📝 Comment: {post_comments['text']}\n\n"
         f"🌍 Tiktok POST URL: {post_comments['url']}\n\n"
-         f"Sentimiento: {sentimiento.capitalize()} {emoji}\n"
-         f"🤖 Tipo de Usuario: Usuario Real\n"
+         f"Sentimiento: {(sentimiento or '').capitalize()} {emoji}\n"
+         f"🤖 Tipo de Usuario: {post_comments.get('tipo_usuario') or usuario_real}\n"
     )
 
-    data = {
-        'chat_id': chat_id,
-        'text': message_text,
-        'parse_mode': 'HTML'
-    }
+    # Queued on the pooled dispatcher: delivery, rate limits and retries happen in the background
+    dispatcher_for(bot).enqueue(chat_id, message_text, on_delivered=on_delivered)
 
-    while True:  #try to send the message until the waiting time passes
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, data=data) as response:
-                    if response.status == 429:  # Error 429: Too Many Requests
-                        retry_after = int(response.headers.get("Retry-After", 31))  # get timeout
-                        print(f"Too many requests. Retrying in {retry_after} seconds...")
-                        await asyncio.sleep(retry_after)
-                    elif response.status != 200:
-                        response_data = await response.text()
-                        print(f"Failed to send message: {response_data}")
-                    else:
-                        print("Message sent successfully to Canal Cerrado!")
-                        break  # This ends if the message was sent correctly
-        except aiohttp.ClientError as e:
-            print(f"An error occurred: {e}")
-            await asyncio.sleep(31)  # wait 31 seconds
-
-
-async def send_telegram_message_async_canal_cerrado_banisi(tweet_data, bot, chat_id):
-    url = f"https://api.telegram.org/bot{bot}/sendMessage"
 
+async def send_telegram_message_async_canal_cerrado_banisi(tweet_data, bot, chat_id, on_delivered=None):
     sentiment = tweet_data['clasificacion']
     if sentiment.strip().lower() in {"sin contexto", "sin contexto."}:
-        print(f"Message ignored, sentiment is 'Sin Contexto'")
+        logger.debug("Message ignored, sentiment is 'Sin Contexto'")
+        if on_delivered is not None:
+            on_delivered(False)
         return   
 
     if sentiment == "positivo":
@@ -272,242 +402,587 @@ async def send_telegram_message_async_canal_cerrado_banisi(tweet_data, bot, chat
         f"📝 Comentario: {tweet_data['text']}\n\n"
         f"🌍 Tiktok POST URL: {tweet_data['url']}\n\n"
         
-        f"Sentimiento: {sentiment.capitalize()} {emoji}\n"
-        f"📂 Categoría: {tweet_data['topic'].capitalize()}\n"
-        f"🔢 Tipo: {tweet_data['interaction_type'].capitalize()}\n"
+        f"Sentimiento: {(sentiment or '').capitalize()} {emoji}\n"
+        f"📂 Categoría: {(tweet_data.get('topic') or '').capitalize()}\n"
+        f"🔢 Tipo: {(tweet_data.get('interaction_type') or '').capitalize()}\n"
 
     )
 
-    data = {
-        'chat_id': chat_id,
-        'text': message_text,
-        'parse_mode': 'HTML'
-    }
+    dispatcher_for(bot).enqueue(chat_id, message_text, on_delivered=on_delivered)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, data=data) as response:
-            if response.status != 200:
-                response_data = await response.text()
-                print(f"Failed to send message: {response_data}")
-            else:
-                print("Message sent successfully to Canal Cerrado!")
 
+# Alert layout per campaign (campaigns.json "telegram": {"format": ...}); the names
+# are validated against campaigns.telegram_format_names when the registry loads
+telegram_formats = {
+    'sentimiento': coyuntura_politica_send_telegram_message_async,
+    'banisi': send_telegram_message_async_canal_cerrado_banisi,
+}
 
 
-def save_data_to_json(data, local_file_name, consolidated_file_name):
-    # Save to local JSON file for each social media
-    if not os.path.exists(local_file_name):
-        # If the file does not exist, create a new one and write the data as a list
-        with open(local_file_name, 'w') as file:
-            json.dump([data], file, indent=4)
-    else:
-        # If the file exists, load the existing data
-        with open(local_file_name, 'r+') as file:
-            try:
-                existing_data = json.load(file)
-            except json.JSONDecodeError:
-                existing_data = []
-
-            # Append the new data to the list
-            existing_data.append(data)
-
-            # Set the file cursor to the beginning, truncate the file, and save the updated list
-            file.seek(0)
-            json.dump(existing_data, file, indent=4)
-            file.truncate()
-
-    print(f"Data saved to {local_file_name}")
-
-    # Ensure the folder for the consolidated file exists
-    consolidated_folder = os.path.dirname(consolidated_file_name)
-    if not os.path.exists(consolidated_folder):
-        os.makedirs(consolidated_folder)
-        print(f"Created folder: {consolidated_folder}")
-
-    # Save to consolidated JSON file
-    if not os.path.exists(consolidated_file_name):
-        # If the consolidated file does not exist, create it
-        with open(consolidated_file_name, 'w') as file:
-            json.dump([data], file, indent=4)
-    else:
-        # If the consolidated file exists, load its data
-        with open(consolidated_file_name, 'r+') as file:
-            try:
-                existing_data = json.load(file)
-            except json.JSONDecodeError:
-                existing_data = []
+def es_prioritario(post_comments):
+    # Negative comments with traction still go out one by one in digest mode
+    return (post_comments['clasificacion'] or '').strip().lower() == "negativo" \
+        and (post_comments['likes_count'] or 0) >= telegram_priority_min_likes
 
-            # Append the new data to the list
-            existing_data.append(data)
 
-            # Write the updated data back to the file
-            file.seek(0)
-            json.dump(existing_data, file, indent=4)
-            file.truncate()
+def digest_for(campaign, bot, chat_id):
+    digest = campaign_digests.get(campaign.name)
+    if digest is None:
+        digest = campaign_digests[campaign.name] = TelegramDigest(
+            dispatcher_for(bot), chat_id, window=telegram_digest_window
+        )
+    return digest
 
-    print(f"Data also saved to {consolidated_file_name}\n")
 
+def flush_digests():
+    for digest in campaign_digests.values():
+        digest.flush()
 
-# Function to load existing data and create a set for existing post_ids                       #-----------New function--------------#
-def load_existing_data(file_path):
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, 'r') as file:
-                existing_data = json.load(file)
-                post_ids = {post.get('comment_id') for post in existing_data}
-                return post_ids
-        except json.JSONDecodeError:
-            return set()
-    else:
-        return set()
 
+def alerts_for(post_comments):
+    # (outbox key, campaign, alert) for each campaign following the post, with that campaign's labels
+    alerts = []
+    for name, campos in (post_comments['campanas'] or {}).items():
+        if (campos.get('clasificacion') or '').strip().lower() == "sin contexto":
+            continue
+        if campaign_classifiers[name].campaign.telegram_destination()[0] is None:
+            continue
+        alerts.append((f"{name}:{post_comments['comment_id']}", name, {**as_dict(post_comments), **campos}))
+    return alerts
+
+
+# Outbox keys queued in a dispatcher or digest of this process and not settled yet
+alerts_in_flight = set()
 
-# Función para extraer los URLs de los posts más recientes
-def extract_recent_urls(file_path):
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-    
-    urls = []
-    current_date = datetime.now()
-    one_week_ago = current_date - timedelta(days=1)                       #<----------change the number of weeks to retrieve all comments
-    
-    for post in data:
-        created_at_str = post.get("created_at")
-        created_at = datetime.strptime(created_at_str, "%Y-%m-%d %H:%M:%S")
-        
-        if created_at >= one_week_ago:
-            url = post.get("url")
-            if url:
-                urls.append(url)
-    
-    return urls
 
-def load_existing_csv(filename):
-    if os.path.exists(filename):
-        df = pd.read_csv(filename)
+async def deliver_alert(key, name, alert):
+    # The outbox entry is closed once Telegram accepts the message (or rejects it for good).
+    # delivered is None when the message was never tried (queue full, shutdown): it stays pending.
+    def on_delivered(delivered):
+        alerts_in_flight.discard(key)
+        if delivered is not None:
+            work_log.mark_alert(key, 'sent' if delivered else 'failed')
+
+    alerts_in_flight.add(key)
+
+    campaign_classifier = campaign_classifiers.get(name)
+    bot, chat_id = campaign_classifier.campaign.telegram_destination() if campaign_classifier else (None, None)
+    if bot is None:
+        # Campaign removed from the registry or without a destination any more
+        on_delivered(False)
+        return
+    campaign = campaign_classifier.campaign
+    comment = alert.get('text')
+    if telegram_digest_mode and comment and comment.strip() and not es_prioritario(alert):
+        digest_for(campaign, bot, chat_id).add(alert, on_delivered=on_delivered)
     else:
-        df = pd.DataFrame(columns=['Red social', 'Comentario', 'Clasificación', 'URL'])
-    return df
+        await telegram_formats[campaign.telegram_format](alert, bot, chat_id, on_delivered=on_delivered)
+
+
+async def resend_pending_alerts():
+    # Alerts still pending in the outbox and not queued right now: left by a previous
+    # process, or dropped from a full Telegram queue in an earlier cycle
+    pending = [(key, name, alert) for key, name, alert in work_log.pending_alerts() if key not in alerts_in_flight]
+    if pending:
+        logger.info("Resending alerts left in the outbox", extra=kv(count=len(pending)))
+    for key, name, alert in pending:
+        await deliver_alert(key, name, alert)
+
+
+def save_data_to_json(data, local_file_name, consolidated_writer, on_commit=None):
+    # Records become plain dicts only here, on their way to disk
+    data = as_dict(data)
+
+    # Append to the local JSONL log for each social media
+    append_record(data, local_file_name)
+
+    logger.debug("Data saved", extra=kv(file=local_file_name))
+
+    # Searchable right away (python comment_search.py)
+    comment_search.add(data)
+
+    # The consolidated file is shared with the other collectors: queue the record
+    # and let the writer commit the whole dataset batch under the lock
+    consolidated_writer.add(data, on_commit)
+
+
+# Function to load existing data and create a set for existing post_ids                       #-----------New function--------------#
+def load_existing_data(file_path):
+    return {post.get('comment_id') for post in iter_records(file_path)}
+
 
 # initializes a set with previously calculated values ​​or with an empty set                          #---------New-----------------#
-seen_comments = load_existing_data('tiktok_comments.json')
-print(f"Loaded {len(seen_comments)} existing comments")
+migrate_json_array('tiktok_comments.json', 'tiktok_comments.jsonl')
+migrate_json_array('tiktok_posts.json', 'tiktok_posts.jsonl')
+seen_comments = open_dedup_index('seen_comments.db', seed=lambda: load_existing_data('tiktok_comments.jsonl'))
+logger.info("Loaded dedup index", extra=kv(index=seen_comments))
+
+# Full-text / attribute search index of the saved comments, seeded once from the JSONL history
+comment_search = open_comment_search('comment_search.db', seed=lambda: iter_records('tiktok_comments.jsonl'))
+
+# Near-duplicate clusters and per-account activity of the last day: copy-pasted
+# campaigns are classified once and the alerts carry the bot / real user verdict
+near_duplicates = NearDuplicateDetector(
+    threshold=float(os.getenv('near_duplicate_threshold', 0.9)),
+    campaign_min_users=int(os.getenv('campaign_min_users', 3)),
+    db_file='near_duplicates.db',
+)
+
+# Ids older than this are forgotten (checked at most once a day)
+seen_comments_max_age = 180 * 86400
+
+# Actor runs with their dataset offset, and the outbox of alerts not delivered yet
+work_log = WorkLog('work_log.db')
+
+# Reply counts of the top-level comments, to expand only the threads that grew
+reply_threads = ReplyThreads('reply_threads.db')
+
+# Labels already paid for, keyed by normalized text, model and prompt version
+classification_cache = ClassificationCache('classification_cache.json')
+
+# Local model in front of the LLM (python local_model.py train): comments it labels
+# with at least local_model_threshold confidence never reach the LLM. A small
+# share of those is still sent to the LLM to keep measuring the agreement.
+local_model = NaiveBayesModel.load(version=version_coyuntura_politica)
+local_model_threshold = float(os.getenv('local_model_threshold', 0.9))
+local_model_audit_rate = float(os.getenv('local_model_audit_rate', 0.05))
+if local_model is not None:
+    logger.info("Loaded local model", extra=kv(threshold=local_model_threshold, vocabulary=local_model.vocabulary_size))
+
+# Keep tiktok_comments.json as a periodically refreshed snapshot for analysts
+start_background_compaction('tiktok_comments.jsonl', key='comment_id', snapshot_file='tiktok_comments.json')
+
+# Digest mode: alerts are coalesced per window into one message per batch
+telegram_digest_mode = os.getenv('telegram_digest_mode', '0') == '1'
+telegram_digest_window = int(os.getenv('telegram_digest_window', 300))
+telegram_priority_min_likes = int(os.getenv('telegram_priority_min_likes', 50))
+campaign_digests = {}
 
 # Define the number of seconds to wait before the next run
 #seconds_for_next_run = 0 # 1h
 seconds_for_next_run = 3600 # 1h
 
+# Number of new comments each classify worker takes from the pipeline at once
+classification_chunk_size = int(os.getenv('classification_chunk_size', 50))
+
+# Apify actor that scrapes the comments of a list of posts
+comments_actor_id = "BDec00yAmCm1QbMEI"
+
+# Post URLs per actor run: shards run in parallel (apify_fan_out) and fail independently
+comments_urls_per_shard = int(os.getenv('comments_urls_per_shard', 10))
+
+# Reply pass: threads with at least reply_min_count replies that grew since their last
+# expansion, at most reply_threads_per_cycle of them (biggest growth first). The actor
+# only returns replies together with their post, so the posts of those threads are
+# fetched again in shards of reply_urls_per_shard, with up to replies_per_comment_max
+# replies per comment, and only the replies of the due threads are kept. A thread whose
+# parent does not come back reply_max_misses times in a row is given up on.
+reply_min_count = int(os.getenv('reply_min_count', 5))
+reply_threads_per_cycle = int(os.getenv('reply_threads_per_cycle', 200))
+reply_urls_per_shard = int(os.getenv('reply_urls_per_shard', 5))
+reply_comments_per_post = int(os.getenv('reply_comments_per_post', 100))
+replies_per_comment_max = int(os.getenv('replies_per_comment_max', 100))
+reply_max_misses = int(os.getenv('reply_max_misses', 3))
+
+# Pipeline sizing: bounded queues between stages and concurrent classify workers
+pipeline_queue_size = int(os.getenv('pipeline_queue_size', 200))
+pipeline_classify_workers = int(os.getenv('pipeline_classify_workers', 4))
+
+# Dataset items per normalization batch
+normalize_batch_size = int(os.getenv('normalize_batch_size', 100))
+
+# Number of comments packed into a single classification request
+classification_batch_size = int(os.getenv('classification_batch_size', 20))
+
+# One classifier per campaign (campaigns.py); each new comment is classified by
+# every campaign following its post
+campaign_classifiers = {campaign.name: build_campaign_classifier(campaign) for campaign in campaigns}
+for campaign in campaigns:
+    if campaign.telegram_destination()[0] is None:
+        logger.warning("Campaign has no Telegram destination, its alerts are not sent", extra=kv(campaign=campaign.name))
+
+
+def next_run_delay():
+    # Wake up for the next hot post, but never sleep longer than seconds_for_next_run
+    return min(seconds_for_next_run, max(60, post_tier_scheduler.seconds_until_next_poll()))
+
+
+async def resume_unfinished_runs(consolidated_writer):
+    # Runs a crash left unfinished are read from their checkpoint instead of paying for new ones
+    runs, resumed = [], []
+    new_by_post = Counter()
+    pipeline = comment_pipeline(consolidated_writer, new_by_post)
+    await pipeline.run(actor_runner.resume_items(comments_actor_id, work_log, dedup_key='cid', runs=runs, resumed=resumed))
+    consolidated_writer.commit()
+    work_log.finish_runs(runs)
+    if not runs:
+        return
+    logger.info("Pipeline summary", extra=kv(resumed_runs=len(runs), **{
+        name: f"{stats['processed']}/{stats['errors']}" for name, stats in pipeline.summary().items()}))
+    for run_input in resumed:
+        for url in run_input.get('postURLs') or []:
+            post_tier_scheduler.record_poll(url, new_by_post.get(post_key(url), 0))
+
+
+async def only_replies(items, parents, returned):
+    # Keeps the replies to the due threads; everything else is finished right away.
+    # The threads whose parent or replies came back in the run go to returned.
+    async for item in items:
+        parent = str(item.get('repliesToId'))
+        if parent in parents:
+            returned.add(parent)
+            yield item
+        else:
+            if str(item.get('cid')) in parents:
+                returned.add(str(item['cid']))
+            work_log.done(item.pop('_position', None))
+
+
+async def expand_reply_threads(consolidated_writer):
+    threads = reply_threads.due(reply_min_count, reply_threads_per_cycle, reply_max_misses)
+    if not threads:
+        return
+    parents = {comment_id for comment_id, _, _, _ in threads}
+    # The actor returns the oldest replies first: asking only for the growth would bring back stored ones
+    replies_by_url = {}
+    for _, url, reply_count, _ in threads:
+        if url:
+            replies_by_url[url] = max(replies_by_url.get(url, 0), reply_count)
+    urls = list(replies_by_url)
+    logger.info("Expanding reply threads", extra=kv(threads=len(threads), posts=len(urls)))
+
+    def build_input(shard):
+        # maxRepliesPerComment applies to every post of the run: sized for this shard's biggest thread
+        return {
+            "postURLs": shard,
+            "commentsPerPost": reply_comments_per_post,
+            "maxRepliesPerComment": min(replies_per_comment_max, max(replies_by_url[url] for url in shard)),
+        }
+
+    # Replies go through the same dedup / classify / persist / notify pipeline
+    failed_urls = []
+    runs = []
+    returned = set()
+    pipeline = comment_pipeline(consolidated_writer, Counter())
+    await pipeline.run(only_replies(actor_runner.iter_items(
+        comments_actor_id, build_input, urls, reply_urls_per_shard, dedup_key='cid', failed=failed_urls,
+        work_log=work_log, runs=runs
+    ), parents, returned))
+    consolidated_writer.commit()
+    work_log.finish_runs(runs)
+    logger.info("Pipeline summary", extra=kv(replies=True, **{
+        name: f"{stats['processed']}/{stats['errors']}" for name, stats in pipeline.summary().items()}))
+
+    # Threads that did not come back stay due; the ones of a failed shard do not count a miss,
+    # the ones whose parent is outside commentsPerPost stop being due after reply_max_misses
+    reply_threads.mark_expanded((comment_id, reply_count) for comment_id, url, reply_count, _ in threads
+                                if comment_id in returned)
+    missed = [comment_id for comment_id, url, _, _ in threads if comment_id not in returned and url not in failed_urls]
+    reply_threads.mark_missed(missed)
+    if len(returned) < len(threads):
+        logger.info("Reply threads not returned, still due", extra=kv(
+            count=len(threads) - len(returned), missed=len(missed)))
+
+
 # Define the function to fetch Tiktok comments
 async def fetch_tiktok_comments():
     try:
-        # Determine the URLs of the most recent Instagram posts
-        urls = extract_recent_urls('tiktok_posts.json')
-        print(f"Extracting comments from {len(urls)} recent Tiktok posts")
+        await resend_pending_alerts()
 
-        if not urls:
-            print("No recent URLs found or failed to extract URLs.")
-            return
-        
-        run_input = {
-            "postURLs": urls,
-            "commentsPerPost": 10,                                  #<-------------------- update the maximum number of comments ------
-            "maxRepliesPerComment": 0,
-        }
+        # One group commit to the consolidated file per dataset batch
+        consolidated_writer = ConsolidatedWriter("../aggregated_data/all_comments.json")
 
-        # Run the Actor and wait for it to finish
-        run = client.actor("BDec00yAmCm1QbMEI").call(run_input=run_input)
-
-        # Fetch and print Actor results from the run's dataset (if there are any)
-        for item in client.dataset(run["defaultDatasetId"]).iterate_items():
+        try:
+            await resume_unfinished_runs(consolidated_writer)
+
+            # Hot posts are polled often with bigger pages, cold ones back off exponentially
+            track_recent_posts(recent_post_index)
+            due_groups = post_tier_scheduler.due_groups()
+            hot, warm, cold = post_tier_scheduler.tiers()
+            logger.info("Extracting comments from due Tiktok posts", extra=kv(
+                due=sum(len(urls) for urls in due_groups.values()), hot=hot, warm=warm, cold=cold))
+
+            if not due_groups:
+                logger.info("No posts due for comment polling.")
+                return
+
+            # commentsPerPost applies to the whole run, so there is one sharded run per page size
+            for comments_per_post, urls in due_groups.items():
+                def build_input(shard, comments_per_post=comments_per_post):
+                    return {
+                        "postURLs": shard,
+                        "commentsPerPost": comments_per_post,
+                        "maxRepliesPerComment": 0,
+                    }
+
+                # Parallel actor runs, their datasets stream straight into the pipeline.
+                # Each run is checkpointed in the work log until its whole dataset is through.
+                new_by_post = Counter()
+                failed_urls = []
+                runs = []
+                pipeline = comment_pipeline(consolidated_writer, new_by_post)
+                await pipeline.run(actor_runner.iter_items(
+                    comments_actor_id, build_input, urls, comments_urls_per_shard, dedup_key='cid', failed=failed_urls,
+                    work_log=work_log, runs=runs
+                ))
+                # Runs are only finished once their comments are in the consolidated file
+                consolidated_writer.commit()
+                work_log.finish_runs(runs)
+                logger.info("Pipeline summary", extra=kv(page_size=comments_per_post, **{
+                    name: f"{stats['processed']}/{stats['errors']}" for name, stats in pipeline.summary().items()}))
+
+                # Posts whose shard failed keep their schedule and are retried next cycle
+                for url in urls:
+                    if url not in failed_urls:
+                        post_tier_scheduler.record_poll(url, new_by_post.get(post_key(url), 0))
+
+            await expand_reply_threads(consolidated_writer)
+        finally:
+            consolidated_writer.commit()
+            seen_comments.save()
+            comment_search.save()
+            near_duplicates.save()
+            classification_cache.save()
+            post_tier_scheduler.save()
+            recent_post_index.save_snapshot()
+            work_log.save()
+            work_log.expire_runs()
+            work_log.expire_alerts()
+            reply_threads.expire()
+            seen_comments.maybe_expire(seen_comments_max_age)
+
+        # Columnar snapshot for the analysts, only the rows appended this cycle
+        await export_in_background(comments_archive)
+    except Exception as e:
+        logger.exception("An error occurred while fetching comments", extra=kv(error=e))
+
+
+def build_post_comments(item):
+    # Single-item form of the batch normalizer (normalizer.comment_schema holds the mapping)
+    return normalize_comments([item])[0]
+
+
+def needs_classification(post_comments):
+    # Replies are only collected for busy threads, so they are always classified
+    return post_comments['parent_id'] is not None or (post_comments['reply_count'] or 0) >= 5
+
+
+async def classify_campaign_chunk(campaign_classifier, chunk):
+    # ({comment_id: label}, {comment_id: source}) for one campaign; the label is None or an
+    # exception where no usable answer came back. source is where the label came from:
+    # 'llm', 'local', 'cache', 'cluster', 'prefilter', or None for comments not classified.
+    name, model, version = campaign_classifier.name, campaign_classifier.model, campaign_classifier.version
+    local_model = campaign_classifier.local_model
+    labels = {}
+    sources = {}
+    pending_groups = {}
+    local_predictions = {}
+
+    for c in chunk:
+        if not needs_classification(c):
+            labels[c['comment_id']] = campaign_classifier.sin_contexto("Sin Contexto")
+            continue
+        # Trivially empty comments, clusters already classified and known texts never reach the LLM
+        prelabel = campaign_classifier.sin_contexto() if preclasificar(c['text']) else None
+        cluster_label = None if prelabel else near_duplicates.label_for(c['comment_id'], name)
+        label = prelabel or cluster_label or classification_cache.get(c['text'], model, version)
+        if label is not None:
+            source = 'prefilter' if prelabel else 'cluster' if cluster_label else 'cache'
+            classifications_total.inc(source=source, campaign=name)
+            labels[c['comment_id']] = label
+            sources[c['comment_id']] = source
+            near_duplicates.set_label(c['comment_id'], label, name)
+            continue
+
+        # Confident local answers skip the LLM, except for the audited sample
+        local_label, confidence = local_model.predict(c['text']) if local_model is not None else (None, 0.0)
+        confident = local_label is not None and confidence >= local_model_threshold
+        if confident and random.random() >= local_model_audit_rate:
+            classifications_total.inc(source='local', campaign=name)
+            labels[c['comment_id']] = local_label
+            sources[c['comment_id']] = 'local'
+            near_duplicates.set_label(c['comment_id'], local_label, name)
+            continue
+        if local_label is not None:
+            local_predictions[c['comment_id']] = (local_label, confident)
+
+        # Exact and near copy-pastes inside the chunk are classified once
+        pending_groups.setdefault(near_duplicates.group_key(c['comment_id'], c['text']), []).append(c)
+
+    # Comments that need the LLM are packed into batches (when the classifier supports them),
+    # and the batches run concurrently, bounded by the classifier's semaphore
+    pending = [(group[0]['comment_id'], group[0]['text']) for group in pending_groups.values()]
+    group_of = {group[0]['comment_id']: group for group in pending_groups.values()}
+    classifications_total.inc(len(pending), source='llm', campaign=name)
+    size = campaign_classifier.batch_size
+    batches = [pending[i:i + size] for i in range(0, len(pending), size)]
+    results = await asyncio.gather(*(campaign_classifier.classify_many(batch) for batch in batches), return_exceptions=True)
+
+    for batch, result in zip(batches, results):
+        for comment_id, texto in batch:
+            label = result if isinstance(result, Exception) else result.get(comment_id)
+            if isinstance(label, (str, dict)):
+                classification_cache.put(texto, model, version, label)
+                near_duplicates.set_label(comment_id, label, name)
+                if comment_id in local_predictions:
+                    local_label, confident = local_predictions[comment_id]
+                    local_model_agreement_total.inc(agree=str(local_label == label.strip().lower()).lower(),
+                                                    confident=str(confident).lower())
+            # The copies in the group share the answer given to the first one
+            for c in group_of[comment_id]:
+                labels[c['comment_id']] = label
+                sources[c['comment_id']] = 'llm' if c['comment_id'] == comment_id else 'cluster'
+
+    return labels, sources
+
+
+async def classify_chunk(chunk):
+    # [{campaign: (label, source)}] per comment, for the campaigns that follow the comment's post.
+    # Every campaign classifies its share of the chunk concurrently.
+    selected = [(campaign_classifier, [c for c in chunk if campaign_classifier.campaign.matches(c['url'])])
+                for campaign_classifier in campaign_classifiers.values()]
+    selected = [(campaign_classifier, comments) for campaign_classifier, comments in selected if comments]
+    results = await asyncio.gather(*(classify_campaign_chunk(campaign_classifier, comments)
+                                     for campaign_classifier, comments in selected))
+
+    return [{campaign_classifier.name: (labels[c['comment_id']], sources.get(c['comment_id']))
+             for (campaign_classifier, _), (labels, sources) in zip(selected, results) if c['comment_id'] in labels}
+            for c in chunk]
+
+
+def comment_pipeline(consolidated_writer, new_by_post):
+    # fetch -> normalize/dedup -> classify -> persist -> notify, with bounded queues
+    # between the stages so LLM, disk and Telegram latency overlap instead of adding up
+    in_flight = set()
+    # comment_id -> dataset position; the work log offset moves once the comment is finished
+    positions = {}
+
+    async def normalize(items):
+        new_items = []
+        # Reply totals of every top-level comment, new or not, drive the reply pass
+        reply_threads.observe_many((item.get('cid'), item.get('videoWebUrl'), item.get('replyCommentTotal'))
+                                   for item in items if item.get('repliesToId') is None)
+        for item in items:
             comment_id = item.get('cid')
+            position = item.pop('_position', None)
 
             # Check if the post has already been seen
-            if comment_id not in seen_comments and comment_id is not None:
-                post_comments = {}
-                # Extract the relevant data from the item
-                created_at = item.get('createTimeISO')
-
-                if created_at:
-                    # Parse the timestamp as a datetime object in UTC
-                    utc_time = datetime.strptime(created_at, "%Y-%m-%dT%H:%M:%S.%fZ")
-
-                    # Define the timezone for Guayaquil, Ecuador (which is UTC-5)
-                    guayaquil_tz = pytz.timezone('America/Guayaquil')
-
-                    # Convert the UTC time to Guayaquil time
-                    guayaquil_time = utc_time.replace(tzinfo=pytz.utc).astimezone(guayaquil_tz)
-
-                    guayaquil_time_str = guayaquil_time.strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    guayaquil_time_str = "Unknown time"
-
-                # Extract the relevant data from the item
-                post_url = item.get('videoWebUrl')
-                comment = item.get('text')
-                user = item.get('uniqueId')
-                user_id = item.get('uid')
-                user_profile = item.get('avatarThumbnail')
-                created_at = guayaquil_time_str
-                likes_count = item.get('diggCount')
-                reply_count = item.get('replyCommentTotal')
-                 
-                if reply_count<5:
-                    clasificacion = "Sin Contexto"
-                else:
-                    clasificacion = clasificacion_texto_coyuntura_politica(comment)
-
-
-                # Add the extracted data to the post_comments dictionary
-                post_comments['url'] = post_url
-                post_comments['comment_id'] = comment_id
-                post_comments['text'] = comment
-                post_comments['user'] = user
-                post_comments['user_profile'] = user_profile
-                post_comments['created_at'] = created_at
-                post_comments['likes_count'] = likes_count
-                post_comments['user_id'] = user_id
-                post_comments['reply_count'] = reply_count
-                post_comments['clasificacion'] = clasificacion
-                post_comments['red_social'] = 'Tiktok'
-
-
-                # Add the post ID to the seen_posts set
-                seen_comments.add(comment_id)
-
-                # Print the extracted data
-                print(f"Comment {[comment_id]} extracted")
-
-                # Save the extracted data to a JSON file
-                save_data_to_json(post_comments, 'tiktok_comments.json', "../aggregated_data/all_comments.json")
-
-                # Skip sending the tweet if clasificacion is 'Sin Contexto'
-                if post_comments["clasificacion"] == "Sin Contexto":
-                    print("No se envía el comment 'Sin Contexto'")
-                    return  # Exit the function without further processing 
-                if reply_count<5:
-                    print("No se envía el comment con menos de 5 respuestas")
-                    return  # Exit the function without further processing
-
-                # Send the message to Canal Cerrado
-                await coyuntura_politica_send_telegram_message_async(post_comments, canal_cerrado_telegram_bot_token, canal_cerrado_telegram_chat_id)
-
-            else:
-                print(f"Comment {comment_id} already extracted sometime ago")
-    except Exception as e:
-        print(f"An error occurred while fetching comments: {e}")
+            if comment_id is None or comment_id in in_flight or comment_id in seen_comments:
+                comments_total.inc(result='duplicate')
+                logger.debug("Comment already extracted sometime ago", extra=kv(comment_id=comment_id))
+                work_log.done(position)
+                continue
+            in_flight.add(comment_id)
+            positions[comment_id] = position
+            comments_total.inc(result='new')
+            new_by_post[post_key(item.get('videoWebUrl'))] += 1
+            new_items.append(item)
+        # One pass over the whole batch: timestamps, field mapping, __slots__ records
+        records = normalize_comments(new_items)
+        for record in records:
+            near_duplicates.observe(record['comment_id'], record['text'], record['user_id'], record['url'])
+        return records
+
+    async def classify(chunk):
+        classified = []
+        for post_comments, labels in zip(chunk, await classify_chunk(chunk)):
+            failed = {name: label for name, (label, _) in labels.items() if label is None or isinstance(label, Exception)}
+            if failed:
+                # Not marked as seen, so it is retried in the next cycle
+                logger.warning("Comment could not be classified", extra=kv(
+                    comment_id=post_comments['comment_id'], campaigns=','.join(failed),
+                    error=next(iter(failed.values()))))
+                work_log.done(positions.pop(post_comments['comment_id'], None))
+                continue
+            # Every campaign's fields are kept; clasificacion is the first campaign's, as before
+            post_comments['campanas'] = {name: CampaignClassifier.fields(label, source)
+                                         for name, (label, source) in labels.items()}
+            first = next(iter(post_comments['campanas'].values()), None)
+            post_comments['clasificacion'] = first['clasificacion'] if first else "Sin Contexto"
+            classified.append(post_comments)
+        return classified
+
+    async def persist(post_comments):
+        comment_id = post_comments['comment_id']
+
+        # Bot / real user, from the near-duplicate clusters and the account's recent activity
+        post_comments['tipo_usuario'] = near_duplicates.verdict(comment_id, post_comments['user_id'])
+        bot_verdicts_total.inc(verdict=post_comments['tipo_usuario'])
+
+        logger.debug("Comment extracted", extra=kv(comment_id=comment_id))
+
+        # Save the extracted data to a JSON file. The comment only counts as seen (and its
+        # dataset offset only moves) once the consolidated batch holding it is committed
+        position = positions.pop(comment_id, None)
+
+        def committed():
+            seen_comments.add(comment_id)
+            work_log.done(position)
+        save_data_to_json(post_comments, 'tiktok_comments.jsonl', consolidated_writer, committed)
+
+        # Skip sending the tweet if every campaign classified it as 'Sin Contexto'
+        alerts = []
+        if all((campos['clasificacion'] or '').strip().lower() == "sin contexto"
+               for campos in post_comments['campanas'].values()):
+            logger.debug("No se envía el comment 'Sin Contexto'", extra=kv(comment_id=comment_id))
+        elif not needs_classification(post_comments):
+            logger.debug("No se envía el comment con menos de 5 respuestas", extra=kv(comment_id=comment_id))
+        else:
+            # Alerts go to the outbox before the comment counts as seen, so a crash
+            # in between leaves them pending instead of lost
+            alerts = [alert for alert in alerts_for(post_comments) if work_log.add_alert(*alert)]
+
+        # One item per alert for the notify stage
+        return alerts or None
+
+    async def notify(alert):
+        # Send the message to the campaign's channel
+        await deliver_alert(*alert)
+
+    return Pipeline([
+        Stage('normalize', normalize, workers=1, queue_size=pipeline_queue_size,
+              batch_size=normalize_batch_size, batch_timeout=0.2),
+        Stage('classify', classify, workers=pipeline_classify_workers, queue_size=pipeline_queue_size,
+              batch_size=classification_chunk_size, batch_timeout=1.0),
+        Stage('persist', persist, workers=1, queue_size=pipeline_queue_size),
+        Stage('notify', notify, workers=1, queue_size=pipeline_queue_size),
+    ])
+
 
 async def main():
     while True:
         try:
             await fetch_tiktok_comments()
-            print("Waiting for 20 minutes before the next execution... \n\n\n")
-            await asyncio.sleep(seconds_for_next_run)  # Sleep for 20 minutes (1200 seconds)
+            delay = next_run_delay()
+            logger.info("Waiting before the next execution", extra=kv(seconds=round(delay)))
+            await asyncio.sleep(delay)
         except Exception as e:
-            print(f"An error occurred in the main loop: {e}")
+            logger.exception("An error occurred in the main loop", extra=kv(error=e))
             await asyncio.sleep(seconds_for_next_run)  # Wait before trying again to avoid rapid failure loop
 
+
+async def shutdown():
+    # Flush whatever alerts are still queued and persist the indexes before the process exits
+    flush_digests()
+    await close_dispatchers()
+    seen_comments.close()
+    comment_search.close()
+    near_duplicates.close()
+    classification_cache.save()
+    work_log.close()
+    reply_threads.close()
+
+
+async def run_forever():
+    try:
+        await main()
+    finally:
+        await shutdown()
+
+
 if __name__ == "__main__":
+    start_metrics_server()
     try:
-        asyncio.run(main())
+        asyncio.run(run_forever())
     except Exception as e:
-        print(f"An error occurred while running the main function: {e}")
+        logger.exception("An error occurred while running the main function", extra=kv(error=e))
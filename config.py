@@ -0,0 +1,99 @@
+import os
+from dotenv import load_dotenv, find_dotenv
+from actor_runner import ActorRunner
+from structured_log import configure_logging, get_logger, kv
+
+# Environment and API clients shared by posts_bg and comments_bg. When both run
+# under main.py's supervisor they live in one process, so the clients are built
+# once here instead of once per script. The SDKs (apify_client, openai) are only
+# imported, and the clients only built, the first time a client is used: a
+# one-shot run with nothing due never pays for them.
+
+# Clear any existing environment variables
+keys = ['apify_key', 'canal_cerrado_telegram_bot_token', 'canal_cerrado_telegram_chat_id', 'openai_key']
+
+for key in keys:
+    if key in os.environ:
+        del os.environ[key]
+
+# Load dotenv()
+try:
+    load_dotenv(find_dotenv())
+    dotenv_error = None
+except Exception as e:
+    dotenv_error = e
+
+configure_logging()
+logger = get_logger(__name__)
+if dotenv_error is None:
+    logger.info("Environment variables loaded successfully")
+else:
+    logger.error("An error occurred while loading the environment variables", extra=kv(error=dotenv_error))
+
+# Accesing Environment Variables
+apify_key = os.getenv("apify_token")
+canal_cerrado_telegram_bot_token = os.getenv('canal_cerrado_telegram_bot_token')
+canal_cerrado_telegram_chat_id = os.getenv('canal_cerrado_telegram_chat_id')
+openai_key = os.getenv('openai_key')
+
+# Optional API endpoints, used to point the collectors at local stand-ins (benchmark.py)
+apify_api_url = os.getenv('apify_api_url')
+openai_base_url = os.getenv('openai_base_url')
+
+# Only whether each secret is set is logged, never its value
+logger.info("Environment Variables Loaded from Functions", extra=kv(
+    apify_key=apify_key is not None,
+    canal_cerrado_telegram_bot_token=canal_cerrado_telegram_bot_token is not None,
+    canal_cerrado_telegram_chat_id=canal_cerrado_telegram_chat_id,
+    openai_key=openai_key is not None,
+))
+
+
+class LazyClient:
+    # Stands in for a client and builds it on first attribute access
+    def __init__(self, build):
+        self._build = build
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            self._client = self._build()
+        return getattr(self._client, name)
+
+
+def _apify_client():
+    from apify_client import ApifyClient
+    return ApifyClient(apify_key, api_url=apify_api_url)
+
+
+def _apify_client_async():
+    from apify_client import ApifyClientAsync
+    return ApifyClientAsync(apify_key, api_url=apify_api_url)
+
+
+def _openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=openai_key, base_url=openai_base_url)
+
+
+def _openai_client_async():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=openai_key, base_url=openai_base_url)
+
+
+# Cliente de Apify
+client = LazyClient(_apify_client)
+
+# Cliente asíncrono de Apify: corridas de actores en paralelo por shards
+client_async = LazyClient(_apify_client_async)
+actor_runner = ActorRunner(
+    client_async,
+    fan_out=int(os.getenv('apify_fan_out', 4)),
+    max_retries=int(os.getenv('apify_shard_retries', 2)),
+)
+
+# Cliente de Open AI
+client_openai = LazyClient(_openai_client)
+
+# Cliente asíncrono de Open AI: clasificaciones concurrentes sin bloquear el event loop
+client_openai_async = LazyClient(_openai_client_async)
@@ -0,0 +1,117 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+from metrics import save_seconds
+from structured_log import get_logger, kv
+
+# Shared consolidated store (../aggregated_data/all_comments.json).
+# Every social-network collector appends to the same JSON array, so writes are
+# serialized with an inter-process lock on a sidecar .lock file and published
+# with an atomic rename: readers see either the old or the new array, never a
+# truncated one.
+
+logger = get_logger(__name__)
+
+
+@contextmanager
+def locked(file_name):
+    # Blocking exclusive flock, released when the lock file is closed
+    lock_file = f"{file_name}.lock"
+    with open(lock_file, 'a') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def _read_array(file_name):
+    if not os.path.exists(file_name):
+        return []
+    with open(file_name, 'r') as file:
+        try:
+            existing_data = json.load(file)
+        except json.JSONDecodeError:
+            existing_data = []
+    return existing_data if isinstance(existing_data, list) else []
+
+
+def _write_atomic(data, file_name):
+    folder = os.path.dirname(os.path.abspath(file_name))
+    tmp_file = f"{file_name}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(data, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, file_name)
+
+    # fsync the directory so the rename itself survives a crash
+    dir_fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def append_batch(records, file_name):
+    # One locked read-extend-rename cycle for the whole batch
+    if not records:
+        return 0
+
+    consolidated_folder = os.path.dirname(file_name)
+    if consolidated_folder and not os.path.exists(consolidated_folder):
+        os.makedirs(consolidated_folder, exist_ok=True)
+        logger.info("Created folder", extra=kv(folder=consolidated_folder))
+
+    with save_seconds.time(store='consolidated'), locked(file_name):
+        existing_data = _read_array(file_name)
+        existing_data.extend(records)
+        _write_atomic(existing_data, file_name)
+
+    return len(records)
+
+
+class ConsolidatedWriter:
+    # Group commit: records are buffered during a dataset batch and land in a
+    # single durable write. on_commit callbacks run once their record is on disk,
+    # so whatever marks a record as done (dedup index, work log offset) waits for
+    # the commit and a crash before it replays the record instead of losing it.
+
+    def __init__(self, file_name, max_pending=500):
+        self.file_name = file_name
+        self.max_pending = max_pending
+        self.pending = []
+        self.callbacks = []
+
+    def add(self, record, on_commit=None):
+        self.pending.append(record)
+        self.callbacks.append(on_commit)
+        if len(self.pending) >= self.max_pending:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        callbacks, self.callbacks = self.callbacks, []
+        try:
+            count = append_batch(batch, self.file_name)
+        except Exception:
+            # Keep the batch so the next commit retries it
+            self.pending = batch + self.pending
+            self.callbacks = callbacks + self.callbacks
+            raise
+        logger.info("Records committed", extra=kv(count=count, file=self.file_name))
+        for callback in callbacks:
+            if callback is not None:
+                callback()
+        return count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.commit()
+        return False
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+from structured_log import get_logger, kv
+
+# Persistent dedup index for seen post/comment ids.
+# Ids live in an SQLite primary-key table, so opening the index costs the same
+# whatever the size of the history, and membership is a single indexed lookup.
+# A Bloom filter saved next to the database answers most "never seen" checks
+# without touching SQLite at all.
+
+logger = get_logger(__name__)
+
+
+class BloomFilter:
+    def __init__(self, bits=1 << 23, hashes=7, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = data if data is not None else bytearray(bits // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def save(self, file_name):
+        tmp_file = f"{file_name}.tmp"
+        with open(tmp_file, 'wb') as file:
+            file.write(self.data)
+        os.replace(tmp_file, file_name)
+
+    @classmethod
+    def load(cls, file_name, bits, hashes):
+        if not os.path.exists(file_name) or os.path.getsize(file_name) != bits // 8:
+            return None
+        with open(file_name, 'rb') as file:
+            return cls(bits, hashes, bytearray(file.read()))
+
+
+class DedupIndex:
+    def __init__(self, db_file, bloom_bits=1 << 23, bloom_hashes=7, use_bloom=True):
+        self.db_file = db_file
+        self.bloom_file = f"{db_file}.bloom"
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, seen_at REAL NOT NULL) WITHOUT ROWID")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS seen_at_idx ON seen (seen_at)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+        self.bloom = None
+        self.bloom_dirty = False
+        if use_bloom:
+            # A dirty flag left behind by a crash means the saved filter may miss
+            # ids that are in the table, so it has to be rebuilt once
+            if self.get_meta('bloom_dirty') != '1':
+                self.bloom = BloomFilter.load(self.bloom_file, bloom_bits, bloom_hashes)
+            if self.bloom is None:
+                self.rebuild_bloom()
+
+    def __repr__(self):
+        return f"DedupIndex({self.db_file!r})"
+
+    def __contains__(self, key):
+        if key is None:
+            return False
+        key = str(key)
+        if self.bloom is not None and key not in self.bloom:
+            return False
+        row = self.conn.execute("SELECT 1 FROM seen WHERE id = ?", (key,)).fetchone()
+        return row is not None
+
+    def add(self, key):
+        self.add_many([key])
+
+    def add_many(self, keys, seen_at=None):
+        seen_at = seen_at if seen_at is not None else time.time()
+        rows = [(str(key), seen_at) for key in keys if key is not None]
+        if not rows:
+            return
+        if self.bloom is not None:
+            if not self.bloom_dirty:
+                self.set_meta('bloom_dirty', '1', commit=False)
+                self.bloom_dirty = True
+            for key, _ in rows:
+                self.bloom.add(key)
+        self.conn.executemany("INSERT OR IGNORE INTO seen (id, seen_at) VALUES (?, ?)", rows)
+        self.conn.commit()
+
+    def expire(self, max_age_seconds):
+        # Forget ids older than max_age_seconds. Bloom filters cannot delete, so
+        # the filter is rebuilt from what is left.
+        cutoff = time.time() - max_age_seconds
+        deleted = self.conn.execute("DELETE FROM seen WHERE seen_at < ?", (cutoff,)).rowcount
+        self.conn.commit()
+        if deleted and self.bloom is not None:
+            self.rebuild_bloom()
+        return deleted
+
+    def maybe_expire(self, max_age_seconds, every=86400):
+        # Expiry rebuilds the filter, so run it at most once per `every` seconds
+        last_expire = float(self.get_meta('last_expire', 0))
+        if time.time() - last_expire < every:
+            return 0
+        deleted = self.expire(max_age_seconds)
+        self.set_meta('last_expire', str(time.time()))
+        if deleted:
+            logger.info("Expired ids", extra=kv(count=deleted, db=self.db_file))
+        return deleted
+
+    def rebuild_bloom(self):
+        self.bloom = BloomFilter(self.bloom_bits, self.bloom_hashes)
+        for (key,) in self.conn.execute("SELECT id FROM seen"):
+            self.bloom.add(key)
+        self.bloom_dirty = True
+        self.save()
+
+    def save(self):
+        # Persist the filter, then clear the dirty flag
+        if self.bloom is not None and self.bloom_dirty:
+            self.bloom.save(self.bloom_file)
+            self.set_meta('bloom_dirty', '0')
+            self.bloom_dirty = False
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value, commit=True):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        if commit:
+            self.conn.commit()
+
+    def close(self):
+        self.save()
+        self.conn.close()
+
+
+def open_dedup_index(db_file, seed=None, **kwargs):
+    # seed is a callable returning the ids of the existing history; it only runs
+    # once, the first time the index is opened
+    index = DedupIndex(db_file, **kwargs)
+    if seed is not None and index.get_meta('seeded') != '1':
+        ids = list(seed())
+        index.add_many(ids)
+        index.set_meta('seeded', '1')
+        index.save()
+        logger.info("Seeded dedup index", extra=kv(db=db_file, count=len(ids)))
+    return index
@@ -0,0 +1,196 @@
+import sqlite3
+import sys
+import time
+
+from normalizer import post_schema
+from post_tiering import post_key
+
+# Engagement time series per post.
+# seen_posts only lets a post through once, so the counters stored in
+# tiktok_posts.jsonl are frozen at first sight. Every time the posts actor sees
+# a post again its counters are recorded here as a snapshot.
+#
+# Each post is one SQLite row: the last absolute values (to compute the next
+# delta without decoding anything) and a BLOB of delta-encoded snapshots, each
+# one (seconds since the previous snapshot, delta per metric) as zigzag varints.
+# A snapshot where nothing moved takes no space at all, and a typical one is a
+# handful of bytes.
+#
+#   python engagement_series.py top playCount 24      # top movers of the last 24 hours
+
+# Tracked counters, named as in the stored posts; the Apify field comes from the schema table
+metric_fields = ('playCount', 'likesCount', 'sharesCount', 'commentsCount', 'collectCount')
+metric_sources = {field: source for field, source in post_schema if field in metric_fields}
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def encode_varints(values, out):
+    for value in values:
+        value = _zigzag(value)
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(data):
+    values = []
+    shift = result = 0
+    for byte in data:
+        result |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(_unzigzag(result))
+        shift = result = 0
+    return values
+
+
+class EngagementSeries:
+    def __init__(self, db_file='engagement_series.db'):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS series ("
+            "post TEXT PRIMARY KEY, url TEXT, first_ts INTEGER NOT NULL, first_values TEXT NOT NULL, "
+            "last_ts INTEGER NOT NULL, last_values TEXT NOT NULL, seen_ts INTEGER NOT NULL, "
+            "count INTEGER NOT NULL, deltas BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def __repr__(self):
+        return f"EngagementSeries({self.db_file!r})"
+
+    @staticmethod
+    def values_from_item(item):
+        # Raw Apify post item -> tuple of counters (missing counters count as 0)
+        return tuple(int(item.get(metric_sources[field]) or 0) for field in metric_fields)
+
+    def record(self, url, values, now=None, commit=False):
+        # values follow metric_fields. Returns True when a snapshot was stored.
+        now = int(now or time.time())
+        key = post_key(url)
+        values = tuple(int(value or 0) for value in values)
+        row = self.conn.execute("SELECT last_ts, last_values, deltas FROM series WHERE post = ?", (key,)).fetchone()
+
+        if row is None:
+            self.conn.execute(
+                "INSERT INTO series VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)",
+                (key, url, now, _pack(values), now, _pack(values), now, b'')
+            )
+            stored = True
+        else:
+            last_ts, last_values = row[0], _unpack(row[1])
+            deltas = [value - last for value, last in zip(values, last_values)]
+            if any(deltas):
+                encoded = bytearray(row[2])
+                encode_varints([now - last_ts] + deltas, encoded)
+                self.conn.execute(
+                    "UPDATE series SET last_ts = ?, last_values = ?, seen_ts = ?, count = count + 1, "
+                    "deltas = ? WHERE post = ?",
+                    (now, _pack(values), now, bytes(encoded), key)
+                )
+                stored = True
+            else:
+                # Nothing moved: only remember that the post was checked
+                self.conn.execute("UPDATE series SET seen_ts = ? WHERE post = ?", (now, key))
+                stored = False
+        if commit:
+            self.conn.commit()
+        return stored
+
+    def record_item(self, item, now=None):
+        return self.record(item.get('webVideoUrl'), self.values_from_item(item), now)
+
+    def save(self):
+        self.conn.commit()
+
+    def _decode(self, first_ts, first_values, deltas):
+        points = [(first_ts, _unpack(first_values))]
+        values = decode_varints(deltas)
+        step = len(metric_fields) + 1
+        ts, current = first_ts, list(points[0][1])
+        for i in range(0, len(values) - step + 1, step):
+            ts += values[i]
+            current = [value + delta for value, delta in zip(current, values[i + 1:i + step])]
+            points.append((ts, tuple(current)))
+        return points
+
+    def _decode_row(self, key):
+        row = self.conn.execute("SELECT first_ts, first_values, deltas FROM series WHERE post = ?", (key,)).fetchone()
+        return self._decode(*row) if row else []
+
+    def series(self, url):
+        # [(timestamp, {metric: value})] for one post, oldest first
+        return [(ts, dict(zip(metric_fields, values))) for ts, values in self._decode_row(post_key(url))]
+
+    def _growth(self, points, index, since):
+        # Growth of one metric from the last snapshot at or before `since` (or
+        # the first one) to the latest, and that growth per hour
+        if not points:
+            return 0, 0.0
+        base_ts, base_values = points[0]
+        for ts, values in points:
+            if ts > since:
+                break
+            base_ts, base_values = ts, values
+        last_ts, last_values = points[-1]
+        growth = last_values[index] - base_values[index]
+        hours = (last_ts - base_ts) / 3600
+        return growth, growth / hours if hours > 0 else 0.0
+
+    def growth_rate(self, url, metric='playCount', window=86400, now=None):
+        # (absolute growth, growth per hour) of a metric over the last `window` seconds
+        now = now or time.time()
+        points = self._decode_row(post_key(url))
+        return self._growth(points, metric_fields.index(metric), now - window)
+
+    def top_movers(self, metric='playCount', window=86400, limit=10, now=None):
+        # Posts with the largest growth of `metric` over the last window: [(url, growth, per_hour)]
+        now = now or time.time()
+        since = now - window
+        index = metric_fields.index(metric)
+        movers = []
+        rows = self.conn.execute(
+            "SELECT url, first_ts, first_values, deltas FROM series WHERE last_ts > ?", (since,)
+        )
+        for url, first_ts, first_values, deltas in rows:
+            growth, per_hour = self._growth(self._decode(first_ts, first_values, deltas), index, since)
+            if growth > 0:
+                movers.append((url, growth, per_hour))
+        movers.sort(key=lambda mover: mover[1], reverse=True)
+        return movers[:limit]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def _pack(values):
+    return ','.join(str(value) for value in values)
+
+
+def _unpack(text):
+    return tuple(int(value) for value in text.split(','))
+
+
+if __name__ == "__main__":
+    series = EngagementSeries()
+    if len(sys.argv) > 1 and sys.argv[1] == 'series':
+        for ts, values in series.series(sys.argv[2]):
+            print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)), values)
+    else:
+        metric = sys.argv[2] if len(sys.argv) > 2 else 'playCount'
+        hours = float(sys.argv[3]) if len(sys.argv) > 3 else 24
+        for url, growth, per_hour in series.top_movers(metric, window=hours * 3600):
+            print(f"{growth:>10} {per_hour:>10.1f}/h  {url}")
+    series.close()
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from normalizer import comment_schema, post_schema
+
+# Local stand-ins for the Apify, OpenAI and Telegram HTTP APIs, used by
+# benchmark.py to measure the collectors without spending credits or tokens.
+# Each service has a configurable latency and a 429 injection rate. Datasets are
+# generated lazily per page, so millions of synthetic comments never sit in memory.
+
+posts_actor_id = "OtzYfK1ndEGdwWFKQ"
+comments_actor_id = "BDec00yAmCm1QbMEI"
+
+etiquetas = ['positivo', 'negativo', 'neutral', 'sin contexto']
+
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _to_item(record, schema, created_at):
+    # Inverse of the normalizer's schema table: stored record -> raw Apify item
+    item = {source: record.get(field) for field, source in schema if source is not None}
+    item['createTimeISO'] = _iso(created_at)
+    return item
+
+
+def post_to_item(post, created_at):
+    return _to_item(post, post_schema, created_at)
+
+
+def comment_to_item(comment, created_at=None):
+    return _to_item(comment, comment_schema, created_at or datetime.now(timezone.utc))
+
+
+class FakeState:
+    def __init__(self, posts=(), comments=(), synthetic_comments=0, latency=None, error_rate=None, seed=42):
+        self.latency = {'apify': 0.0, 'openai': 0.0, 'telegram': 0.0, **(latency or {})}
+        self.error_rate = {'apify': 0.0, 'openai': 0.0, 'telegram': 0.0, **(error_rate or {})}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {'runs': 0, 'dataset_pages': 0, 'completions': 0, 'messages': 0, 'throttled': 0}
+        self.datasets = {}
+        self.runs = {}
+
+        # Posts are re-dated to the last hours so the comment scheduler considers them
+        now = datetime.now(timezone.utc)
+        self.posts = [post_to_item(post, now - timedelta(minutes=10 * i)) for i, post in enumerate(posts)]
+        self.comments = list(comments)
+
+        # Comments whose post is not in the replayed posts get a stub post, so they are polled too
+        known = {_video_id(post['webVideoUrl']) for post in self.posts}
+        for comment in self.comments:
+            if comment.get('url') and _video_id(comment['url']) not in known:
+                known.add(_video_id(comment['url']))
+                self.posts.append(post_to_item({'id': _video_id(comment['url']), 'url': comment['url'], 'commentsCount': 0},
+                                               now - timedelta(minutes=10 * len(self.posts))))
+        self.comment_texts = [c.get('text') or '' for c in self.comments] or ["Todo está cada vez peor en este país"]
+        self.synthetic_comments = synthetic_comments
+        self.synthetic_served = 0
+
+    def maybe_throttle(self, service):
+        time.sleep(self.latency[service])
+        with self.lock:
+            throttled = self.random.random() < self.error_rate[service]
+            if throttled:
+                self.counters['throttled'] += 1
+        return throttled
+
+    def new_id(self, prefix):
+        with self.lock:
+            self.counters['runs'] += 1
+            return f"{prefix}{self.counters['runs']}"
+
+    def start_run(self, actor_id, run_input):
+        run_id = self.new_id('run')
+        dataset_id = self.new_id('ds')
+        if actor_id == posts_actor_id:
+            profiles = set(run_input.get('profiles') or [])
+            items = [p for p in self.posts if not profiles or _profile(p['webVideoUrl']) in profiles]
+            self.datasets[dataset_id] = (len(items), lambda offset, limit: items[offset:offset + limit])
+        else:
+            self.datasets[dataset_id] = self._comments_dataset(run_input.get('postURLs') or [],
+                                                               run_input.get('commentsPerPost'))
+        self.runs[run_id] = {
+            'id': run_id, 'actId': actor_id, 'status': 'SUCCEEDED', 'defaultDatasetId': dataset_id,
+            'startedAt': _iso(datetime.now(timezone.utc)), 'finishedAt': _iso(datetime.now(timezone.utc)),
+        }
+        return self.runs[run_id]
+
+    def _comments_dataset(self, urls, comments_per_post=None):
+        if not self.synthetic_comments:
+            per_post = {_video_id(url): [] for url in urls}
+            for comment in self.comments:
+                found = per_post.get(_video_id(comment.get('url')))
+                if found is not None and (not comments_per_post or len(found) < comments_per_post):
+                    found.append(comment_to_item(comment))
+            items = [item for found in per_post.values() for item in found]
+            return len(items), lambda offset, limit: items[offset:offset + limit]
+
+        # Synthetic: the requested volume is spread over the runs and generated on demand.
+        # commentsPerPost is ignored on purpose so one cycle can carry the whole load.
+        with self.lock:
+            count = min(self.synthetic_comments - self.synthetic_served,
+                        max(1, self.synthetic_comments // max(1, len(self.posts))) * max(1, len(urls)))
+            start = self.synthetic_served
+            self.synthetic_served += count
+        texts = self.comment_texts
+
+        def page(offset, limit):
+            items = []
+            for n in range(start + offset, start + min(count, offset + limit)):
+                url = urls[n % len(urls)] if urls else None
+                items.append({
+                    'cid': f"synthetic{n}",
+                    'videoWebUrl': url,
+                    'text': f"{texts[n % len(texts)]} {n}",
+                    'uniqueId': f"user{n % 5000}",
+                    'uid': str(n % 5000),
+                    'avatarThumbnail': None,
+                    'createTimeISO': _iso(datetime.now(timezone.utc)),
+                    'diggCount': n % 97,
+                    'replyCommentTotal': n % 12,
+                })
+            return items
+        return count, page
+
+
+def _video_id(url):
+    match = re.search(r'/video/(\d+)', url or '')
+    return match.group(1) if match else url
+
+
+def _profile(url):
+    match = re.search(r'/@([^/]+)/', url or '')
+    return match.group(1) if match else None
+
+
+def fake_label(texto):
+    digest = hashlib.md5((texto or '').encode('utf-8')).digest()
+    return etiquetas[digest[0] % len(etiquetas)]
+
+
+def fake_completion(body):
+    messages = body.get('messages') or []
+    content = messages[-1].get('content', '') if messages else ''
+    match = re.search(r'Comentarios:\n(\[.*\])', content, re.S)
+    if match:
+        lote = json.loads(match.group(1))
+        answer = json.dumps([{'id': c['id'], 'clasificacion': fake_label(c['texto'])} for c in lote])
+    else:
+        answer = fake_label(content)
+    prompt_tokens = sum(len(m.get('content') or '') for m in messages) // 4
+    completion_tokens = len(answer) // 4 + 1
+    return {
+        'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': body.get('model'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        state = self.state
+
+        match = re.match(r'^/v2/actor-runs/([^/]+)$', url.path)
+        if match and match.group(1) in state.runs:
+            return self._send(200, {'data': state.runs[match.group(1)]})
+
+        match = re.match(r'^/v2/datasets/([^/]+)/items$', url.path)
+        if match and match.group(1) in state.datasets:
+            if state.maybe_throttle('apify'):
+                return self._send(429, {'error': {'type': 'rate-limit-exceeded'}})
+            total, page = state.datasets[match.group(1)]
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', [str(total)])[0] or total)
+            items = page(offset, limit)
+            with state.lock:
+                state.counters['dataset_pages'] += 1
+            return self._send(200, items, {
+                'x-apify-pagination-total': total, 'x-apify-pagination-offset': offset,
+                'x-apify-pagination-count': len(items), 'x-apify-pagination-limit': limit,
+                'x-apify-pagination-desc': 'false',
+            })
+
+        self._send(404, {'error': {'type': 'record-not-found'}})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._body()
+        state = self.state
+
+        match = re.match(r'^/v2/acts/([^/]+)/runs$', url.path)
+        if match:
+            if state.maybe_throttle('apify'):
+                return self._send(429, {'error': {'type': 'rate-limit-exceeded'}})
+            run_input = json.loads(body or b'{}')
+            return self._send(201, {'data': state.start_run(match.group(1), run_input)})
+
+        if url.path.endswith('/chat/completions'):
+            if state.maybe_throttle('openai'):
+                return self._send(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                                  {'retry-after': 1})
+            with state.lock:
+                state.counters['completions'] += 1
+            return self._send(200, fake_completion(json.loads(body)))
+
+        if re.match(r'^/bot[^/]*/sendMessage$', url.path):
+            if state.maybe_throttle('telegram'):
+                return self._send(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                                        'parameters': {'retry_after': 1}}, {'Retry-After': 1})
+            with state.lock:
+                state.counters['messages'] += 1
+            return self._send(200, {'ok': True, 'result': {'message_id': state.counters['messages']}})
+
+        self._send(404, {'error': {'type': 'record-not-found'}})
+
+
+def start_fake_server(state, host='127.0.0.1', port=0):
+    # Returns (server, base_url); the server runs in a daemon thread
+    handler = type('BoundFakeHandler', (FakeHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-services', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+
+from metrics import save_seconds
+from structured_log import get_logger, kv
+
+# Append-only storage: one JSON record per line. Appending a record costs O(1)
+# instead of re-reading and re-writing the whole JSON array on every save.
+
+logger = get_logger(__name__)
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+# (jsonl_file, key, snapshot_file, interval) of every background compaction started
+_compactions = []
+
+
+def _lock_for(file_name):
+    path = os.path.abspath(file_name)
+    with _locks_guard:
+        if path not in _locks:
+            _locks[path] = threading.Lock()
+        return _locks[path]
+
+
+def append_records(records, file_name):
+    # A single write() per batch keeps lines whole under O_APPEND
+    if not records:
+        return
+    payload = "".join(json.dumps(record) + "\n" for record in records)
+    with save_seconds.time(store='jsonl'), _lock_for(file_name):
+        with open(file_name, 'a') as file:
+            file.write(payload)
+
+
+def append_record(data, file_name):
+    append_records([data], file_name)
+
+
+def iter_records(file_name):
+    if not os.path.exists(file_name):
+        return
+    with open(file_name, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Torn line from a crash mid-write, compaction will drop it
+                continue
+
+
+def load_records(file_name):
+    # Returns the same list of dicts json.load() gave for the old JSON array files
+    return list(iter_records(file_name))
+
+
+def migrate_json_array(json_file, jsonl_file):
+    # One-time migration of a legacy JSON array file into the JSONL log.
+    # The JSONL file is published with os.link so two processes migrating at the
+    # same time cannot overwrite each other.
+    if os.path.exists(jsonl_file) or not os.path.exists(json_file):
+        return False
+
+    try:
+        with open(json_file, 'r') as file:
+            existing_data = json.load(file)
+    except json.JSONDecodeError:
+        existing_data = []
+
+    tmp_file = f"{jsonl_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as file:
+        for record in existing_data:
+            file.write(json.dumps(record) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+    try:
+        os.link(tmp_file, jsonl_file)
+        migrated = True
+    except FileExistsError:
+        migrated = False
+    finally:
+        os.remove(tmp_file)
+
+    if migrated:
+        logger.info("Migrated records", extra=kv(count=len(existing_data), source=json_file, target=jsonl_file))
+    return migrated
+
+
+def parse_lines(text):
+    records = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return records
+
+
+def _dedup(records, key):
+    if key is None:
+        return records
+    unique = {}
+    without_key = []
+    for record in records:
+        record_key = record.get(key)
+        if record_key is None:
+            without_key.append(record)
+        else:
+            # First position, last value
+            unique[record_key] = record
+    return list(unique.values()) + without_key
+
+
+def compact(jsonl_file, key=None, snapshot_file=None):
+    # Rewrites the log without torn lines and duplicate keys, and optionally
+    # refreshes a pretty-printed JSON array snapshot for legacy readers.
+    # The lock is only held to capture the size and to splice in the tail that
+    # was appended while the compacted copy was being written.
+    lock = _lock_for(jsonl_file)
+    if not os.path.exists(jsonl_file):
+        return 0
+
+    with lock:
+        size = os.path.getsize(jsonl_file)
+
+    with open(jsonl_file, 'rb') as file:
+        records = _dedup(parse_lines(file.read(size).decode('utf-8', errors='replace')), key)
+
+    tmp_file = f"{jsonl_file}.compact.tmp"
+    with open(tmp_file, 'w') as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+        with lock:
+            with open(jsonl_file, 'rb') as source:
+                source.seek(size)
+                tail = source.read().decode('utf-8', errors='replace')
+            file.write(tail)
+            file.flush()
+            os.fsync(file.fileno())
+            os.replace(tmp_file, jsonl_file)
+
+    if snapshot_file:
+        snapshot = _dedup(records + parse_lines(tail), key)
+        tmp_snapshot = f"{snapshot_file}.tmp"
+        with open(tmp_snapshot, 'w') as file:
+            json.dump(snapshot, file, indent=4)
+        os.replace(tmp_snapshot, snapshot_file)
+
+    return len(records)
+
+
+def start_background_compaction(jsonl_file, key=None, snapshot_file=None, interval=3600):
+    # Daemon thread so compaction never blocks the ingestion loop
+    _compactions.append((jsonl_file, key, snapshot_file, interval))
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                count = compact(jsonl_file, key, snapshot_file)
+                logger.info("Compacted", extra=kv(file=jsonl_file, records=count))
+            except Exception as e:
+                logger.error("An error occurred while compacting", extra=kv(file=jsonl_file, error=e))
+
+    thread = threading.Thread(target=run, name=f"compact-{os.path.basename(jsonl_file)}", daemon=True)
+    thread.start()
+    return thread
+
+
+def _last_compaction(jsonl_file, snapshot_file):
+    # The snapshot (or a marker file) is rewritten by every compaction
+    marker = snapshot_file or f"{jsonl_file}.compacted"
+    return os.path.getmtime(marker) if os.path.exists(marker) else 0
+
+
+def run_due_compactions():
+    # A short-lived process (main.py --once) exits before the daemon threads ever fire:
+    # compact, synchronously, every log whose last compaction is older than its interval
+    for jsonl_file, key, snapshot_file, interval in _compactions:
+        if not os.path.exists(jsonl_file) or time.time() - _last_compaction(jsonl_file, snapshot_file) < interval:
+            continue
+        try:
+            count = compact(jsonl_file, key, snapshot_file)
+            if snapshot_file is None:
+                with open(f"{jsonl_file}.compacted", 'w'):
+                    pass
+            logger.info("Compacted", extra=kv(file=jsonl_file, records=count))
+        except Exception as e:
+            logger.error("An error occurred while compacting", extra=kv(file=jsonl_file, error=e))
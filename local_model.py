@@ -0,0 +1,175 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+from collections import Counter
+
+from classification_cache import normalizar_texto
+from coyuntura_politica import etiquetas_coyuntura_politica, version_coyuntura_politica
+from jsonl_store import iter_records
+from structured_log import get_logger, kv
+
+# Local CPU model in front of the LLM.
+# A multinomial naive Bayes over words and word bigrams is trained offline from
+# the labels gpt-5 itself gave (tiktok_comments.jsonl, 'fuente': 'llm'). At run time it answers
+# the comments it is confident about and only the rest go to the LLM; the
+# threshold trades LLM cost against agreement with the LLM labels.
+#
+#   python local_model.py train              # retrain from the stored labels
+#   python local_model.py report             # agreement vs LLM labels per threshold (held-out split)
+
+logger = get_logger(__name__)
+
+model_file = os.getenv('local_model_file', 'local_model.json')
+
+_token = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+
+def tokens(texto):
+    words = _token.findall(normalizar_texto(texto))
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def labeled_examples(file_name='tiktok_comments.jsonl', allowed_labels=None, campaign='coyuntura_politica'):
+    # Only comments the LLM itself answered carry a real label ('fuente': 'llm'). Labels from
+    # this model, the cache, near-duplicate clusters or the pre-filter would feed the model its
+    # own output. Comments stored before there were campaigns have no 'campanas': there the
+    # LLM answer was saved lowercased, while the default for quiet threads is "Sin Contexto".
+    for comment in iter_records(file_name):
+        if 'campanas' in comment:
+            campos = (comment.get('campanas') or {}).get(campaign) or {}
+            if campos.get('fuente') != 'llm':
+                continue
+            label = (campos.get('clasificacion') or '').strip().lower()
+        else:
+            label = comment.get('clasificacion')
+            if not isinstance(label, str) or label != label.strip().lower():
+                continue
+        if not label or (allowed_labels and label not in allowed_labels):
+            continue
+        if not comment.get('text'):
+            continue
+        yield comment['text'], label
+
+
+class NaiveBayesModel:
+    def __init__(self, labels=(), priors=None, counts=None, totals=None, vocabulary_size=0, version=None):
+        self.labels = list(labels)
+        self.priors = priors or {}
+        self.counts = counts or {}
+        self.totals = totals or {}
+        self.vocabulary_size = vocabulary_size
+        self.version = version
+
+    @classmethod
+    def train(cls, examples, min_count=2, version=None):
+        examples = list(examples)
+        label_counts = Counter(label for _, label in examples)
+        token_counts = {label: Counter() for label in label_counts}
+        for texto, label in examples:
+            token_counts[label].update(tokens(texto))
+
+        # Rare tokens only add noise and size
+        overall = Counter()
+        for counts in token_counts.values():
+            overall.update(counts)
+        vocabulary = {token for token, count in overall.items() if count >= min_count}
+
+        counts = {label: {token: count for token, count in label_tokens.items() if token in vocabulary}
+                  for label, label_tokens in token_counts.items()}
+        return cls(
+            labels=sorted(label_counts),
+            priors={label: math.log(count / len(examples)) for label, count in label_counts.items()},
+            counts=counts,
+            totals={label: sum(label_tokens.values()) for label, label_tokens in counts.items()},
+            vocabulary_size=len(vocabulary),
+            version=version,
+        )
+
+    def predict(self, texto):
+        # (label, confidence): the posterior probability of the best label
+        if not self.labels:
+            return None, 0.0
+        text_tokens = [token for token in tokens(texto) if any(token in counts for counts in self.counts.values())]
+        if not text_tokens:
+            # Nothing known in the text: the prior alone is no evidence
+            return None, 0.0
+        scores = {}
+        for label in self.labels:
+            counts = self.counts[label]
+            denominator = math.log(self.totals[label] + self.vocabulary_size + 1)
+            scores[label] = self.priors[label] + sum(math.log(counts.get(token, 0) + 1) - denominator
+                                                    for token in text_tokens)
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / normalizer
+
+    def save(self, file_name=model_file):
+        tmp_file = f"{file_name}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as file:
+            json.dump({'labels': self.labels, 'priors': self.priors, 'counts': self.counts, 'totals': self.totals,
+                       'vocabulary_size': self.vocabulary_size, 'version': self.version}, file, ensure_ascii=False)
+        os.replace(tmp_file, file_name)
+
+    @classmethod
+    def load(cls, file_name=model_file, version=None):
+        # None when there is no model yet, or when it was trained for another prompt version
+        try:
+            with open(file_name, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if version is not None and data.get('version') != version:
+            logger.warning("Local model was trained for another prompt version, ignoring it",
+                           extra=kv(model_version=data.get('version'), prompt_version=version))
+            return None
+        return cls(**data)
+
+
+def agreement_report(examples, thresholds=(0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99), holdout=0.2, seed=7):
+    # Trains on part of the labels and checks the rest: for each threshold, the share
+    # of comments answered locally (LLM calls saved) and how often they match the LLM
+    examples = list(examples)
+    random.Random(seed).shuffle(examples)
+    split = int(len(examples) * (1 - holdout))
+    model = NaiveBayesModel.train(examples[:split])
+    predictions = [(model.predict(texto), label) for texto, label in examples[split:]]
+
+    rows = []
+    for threshold in thresholds:
+        answered = [(predicted, label) for (predicted, confidence), label in predictions if confidence >= threshold]
+        agree = sum(1 for predicted, label in answered if predicted == label)
+        rows.append({
+            'threshold': threshold,
+            'coverage': len(answered) / len(predictions) if predictions else 0.0,
+            'agreement': agree / len(answered) if answered else 0.0,
+            'answered': len(answered),
+        })
+    return {'train': split, 'test': len(predictions), 'rows': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local naive Bayes model in front of the LLM classifier")
+    parser.add_argument('command', choices=['train', 'report'])
+    parser.add_argument('--source', default='tiktok_comments.jsonl')
+    parser.add_argument('--min-count', type=int, default=2)
+    args = parser.parse_args()
+
+    examples = list(labeled_examples(args.source, etiquetas_coyuntura_politica))
+    if args.command == 'train':
+        model = NaiveBayesModel.train(examples, min_count=args.min_count, version=version_coyuntura_politica)
+        model.save()
+        print(f"Trained on {len(examples)} labeled comments, {model.vocabulary_size} tokens, "
+              f"labels {dict(Counter(label for _, label in examples))} -> {model_file}")
+    else:
+        report = agreement_report(examples)
+        print(f"Train {report['train']} / test {report['test']} comments")
+        print(f"{'threshold':>10} {'coverage':>10} {'agreement':>10} {'answered':>10}")
+        for row in report['rows']:
+            print(f"{row['threshold']:>10.2f} {row['coverage']:>10.1%} {row['agreement']:>10.1%} {row['answered']:>10}")
+
+
+if __name__ == "__main__":
+    main()
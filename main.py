@@ -1,27 +1,147 @@
-import concurrent.futures
-import subprocess
+import argparse
+import asyncio
+import importlib
+import os
+import signal
+import time
 
-def run_script(script_name):
-    # This function will run the script
+process_started = time.monotonic()
+
+from jsonl_store import run_due_compactions
+from metrics import start_metrics_server
+from structured_log import get_logger, kv
+
+# Single-process supervisor: the post and comment collectors run as cooperating
+# asyncio tasks that share the API clients (config.py) and the in-memory recent
+# post index (recent_posts.py). A collector that crashes is restarted on its own
+# with backoff, and SIGINT/SIGTERM let the running cycles finish before exiting.
+#
+# With --once (or run_once=1) each collector runs a single cycle and the process
+# exits, for cron / serverless schedulers: the collectors only poll what is due,
+# so a run with nothing to do is over in well under a second. The cold start
+# (imports + loading the state) is logged on every one-shot run, and the JSONL
+# compactions that came due run before exiting.
+#
+#   python main.py                      # long-running supervisor
+#   python main.py --once               # one cycle of both collectors
+#   python main.py --once --only comments
+
+logger = get_logger('main')
+
+# Collector name -> module; a collector is only imported when it is going to run
+collector_modules = {'posts': 'posts_bg', 'comments': 'comments_bg'}
+
+# Seconds to wait before restarting a collector that crashed (doubles up to the max)
+restart_delay = 30
+max_restart_delay = 900
+
+# Seconds the running cycles get to finish once shutdown is requested
+shutdown_grace = 120
+
+
+async def wait_or_stop(stop, seconds):
     try:
-        subprocess.run(["python3", script_name], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"An error occurred while running {script_name}: {e}")
-
-def main():
-    scripts = ["posts_bg.py", "comments_bg.py"]
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Use the executor to run both scripts concurrently
-        futures = [executor.submit(run_script, script) for script in scripts]
-        
-        # Wait for both scripts to complete
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()  # This will re-raise any exceptions that occurred
-            except Exception as e:
-                print(f"An error occurred: {e}")
+        await asyncio.wait_for(stop.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def run_periodic(name, fetch, interval, stop):
+    # interval is a number of seconds or a callable returning it after each cycle
+    while not stop.is_set():
+        await fetch()
+        seconds = interval() if callable(interval) else interval
+        logger.info("Waiting before the next execution", extra=kv(collector=name, seconds=round(seconds)))
+        await wait_or_stop(stop, seconds)
+
+
+async def supervise(name, fetch, interval, stop):
+    delay = restart_delay
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            await run_periodic(name, fetch, interval, stop)
+        except Exception:
+            # A long healthy run resets the backoff
+            if time.monotonic() - started > max_restart_delay:
+                delay = restart_delay
+            logger.exception("An error occurred in the collector, restarting", extra=kv(collector=name, restart_in=delay))
+            await wait_or_stop(stop, delay)
+            delay = min(delay * 2, max_restart_delay)
+
+
+def load_collectors(only=None):
+    # Importing a collector builds its indexes and loads its schedules and snapshots
+    names = [only] if only else list(collector_modules)
+    return {name: importlib.import_module(collector_modules[name]) for name in names}
 
-if __name__ == "__main__":
-    main()
 
+def fetch_of(name, collector):
+    return collector.fetch_tiktok_posts if name == 'posts' else collector.fetch_tiktok_comments
+
+
+async def shutdown_collectors(collectors):
+    if 'posts' in collectors:
+        collectors['posts'].shutdown()
+    if 'comments' in collectors:
+        await collectors['comments'].shutdown()
+
+
+async def main(only=None):
+    collectors = load_collectors(only)
+    start_metrics_server()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = [
+        asyncio.create_task(supervise(name, fetch_of(name, collector), collector.next_run_delay, stop))
+        for name, collector in collectors.items()
+    ]
+
+    await stop.wait()
+    logger.info("Shutting down, waiting for the running cycles to finish...")
+    _, pending = await asyncio.wait(tasks, timeout=shutdown_grace)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    await shutdown_collectors(collectors)
+
+
+async def run_once(only=None):
+    # Returns the exit code: 1 when a cycle raised
+    collectors = load_collectors(only)
+    loaded = time.monotonic()
+    results = await asyncio.gather(*(fetch_of(name, collector)() for name, collector in collectors.items()),
+                                   return_exceptions=True)
+    finished = time.monotonic()
+    await shutdown_collectors(collectors)
+    run_due_compactions()
+
+    failed = False
+    for name, result in zip(collectors, results):
+        if isinstance(result, Exception):
+            failed = True
+            logger.error("An error occurred in the collector", extra=kv(collector=name, error=result))
+    logger.info("One-shot run finished", extra=kv(
+        collectors=','.join(collectors), cold_start_seconds=round(loaded - process_started, 3),
+        cycle_seconds=round(finished - loaded, 3), total_seconds=round(time.monotonic() - process_started, 3)))
+    return 1 if failed else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TikTok posts and comments collectors")
+    parser.add_argument('--once', action='store_true', default=os.getenv('run_once', '0') == '1',
+                        help="run a single cycle and exit (also run_once=1)")
+    parser.add_argument('--only', choices=tuple(collector_modules), default=os.getenv('run_only') or None,
+                        help="run only one collector (also run_only=posts|comments)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.once:
+        raise SystemExit(asyncio.run(run_once(args.only)))
+    asyncio.run(main(args.only))
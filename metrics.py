@@ -0,0 +1,203 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from structured_log import get_logger, kv
+
+# In-process counters, gauges and histograms, exposed in the Prometheus text
+# format on a local HTTP endpoint (GET /metrics). Updating a metric is a dict
+# lookup and an add under a lock, so it is cheap enough for per-item paths.
+
+logger = get_logger(__name__)
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+registry = []
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def render(self):
+        with self.lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.functions = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+    def set_function(self, function, **labels):
+        # Evaluated at scrape time, e.g. the size of a queue
+        with self.lock:
+            self.functions[_label_key(labels)] = function
+
+    def remove(self, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values.pop(key, None)
+            self.functions.pop(key, None)
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in values.items()]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=default_buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics of the collectors
+actor_call_seconds = Histogram('tiktok_actor_call_seconds', "Duration of Apify actor runs", buckets=(5, 15, 30, 60, 120, 300, 600, 1200, 2400))
+actor_runs_total = Counter('tiktok_actor_runs_total', "Apify actor runs by result")
+dataset_items_total = Counter('tiktok_dataset_items_total', "Items read from Apify datasets")
+classification_seconds = Histogram('tiktok_classification_seconds', "Latency of OpenAI classification requests")
+openai_tokens_total = Counter('tiktok_openai_tokens_total', "OpenAI tokens used")
+openai_requests_total = Counter('tiktok_openai_requests_total', "OpenAI requests by result")
+classifications_total = Counter('tiktok_classifications_total', "Comments classified, by campaign and source (llm, local, cluster, cache, prefilter)")
+local_model_agreement_total = Counter('tiktok_local_model_agreement_total', "Local model predictions checked against the LLM label")
+save_seconds = Histogram('tiktok_save_seconds', "Latency of writes to the local stores")
+telegram_send_seconds = Histogram('tiktok_telegram_send_seconds', "Latency of Telegram sendMessage calls")
+telegram_messages_total = Counter('tiktok_telegram_messages_total', "Telegram messages by result")
+telegram_throttled_total = Counter('tiktok_telegram_throttled_total', "Telegram 429 responses")
+queue_depth = Gauge('tiktok_queue_depth', "Items waiting in the in-process queues")
+pipeline_stage_seconds = Histogram('tiktok_pipeline_stage_seconds', "Handler latency per pipeline stage")
+pipeline_items_total = Counter('tiktok_pipeline_items_total', "Items processed per pipeline stage")
+comments_total = Counter('tiktok_comments_total', "Comments seen, by result (new, duplicate)")
+bot_verdicts_total = Counter('tiktok_bot_verdicts_total', "Comments by bot / real user verdict")
+posts_total = Counter('tiktok_posts_total', "Posts seen, by result (new, duplicate)")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        data = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+metrics_port = int(os.getenv('metrics_port', 9108))
+metrics_host = os.getenv('metrics_host', '127.0.0.1')
+
+_server = None
+
+
+def start_metrics_server(port=metrics_port, host=metrics_host):
+    # Serves /metrics from a daemon thread; port 0 in the env disables it
+    global _server
+    if _server is not None or not port:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning("Metrics endpoint not started", extra=kv(port=port, error=e))
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+    logger.info("Metrics endpoint started", extra=kv(url=f"http://{host}:{port}/metrics"))
+    return _server
@@ -0,0 +1,291 @@
+import hashlib
+import json
+import random
+import sqlite3
+import struct
+import time
+from collections import deque
+
+from classification_cache import normalizar_texto
+from post_tiering import post_key
+
+# Streaming near-duplicate and coordinated-account detection.
+# Every comment text gets a MinHash signature over character shingles, and an
+# LSH index (bands of the signature) finds the recent comments that look alike
+# in roughly constant time. Comments above the similarity threshold join the
+# same cluster, across posts, so a copy-pasted campaign is classified once.
+# A per-user_id activity index, together with the clusters, decides whether an
+# account looks like a real user or a bot. Only the last `window` seconds are
+# kept in memory, and a comment observed again (retried, resumed run) counts once.
+#
+# Shingles are hashed with blake2b (the built-in hash() of a str is salted per
+# process), so signatures mean the same in every run; each of the num_perm
+# permutations is a seeded universal hash (a * x + b) mod p over that value.
+# With a db_file the clusters and the comments of the window are saved to
+# SQLite after each cycle and loaded on start, so one-shot runs see the last
+# day too.
+
+usuario_real = "Usuario Real"
+bot_campana = "Posible Bot (campaña coordinada)"
+bot_actividad = "Posible Bot (actividad masiva)"
+
+class Cluster:
+    __slots__ = ('id', 'signature', 'size', 'users', 'posts', 'labels', 'last_seen')
+
+    def __init__(self, cluster_id, signature, now):
+        self.id = cluster_id
+        self.signature = signature
+        self.size = 0
+        self.users = set()
+        self.posts = set()
+        self.labels = {}
+        self.last_seen = now
+
+
+# Mersenne prime 2**61 - 1, modulus of the permutations
+_prime = (1 << 61) - 1
+
+
+def stable_hash(text):
+    # 64-bit hash that does not change between processes
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class NearDuplicateDetector:
+    def __init__(self, num_perm=64, bands=16, threshold=0.9, window=86400, shingle_size=4, min_length=20,
+                 campaign_min_users=3, campaign_min_posts=2, burst_comments=30, burst_posts=10, seed=1,
+                 db_file=None):
+        # bands * rows_per_band = num_perm; threshold is the estimated Jaccard similarity to join a cluster
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.window = window
+        self.shingle_size = shingle_size
+        self.min_length = min_length
+        self.campaign_min_users = campaign_min_users
+        self.campaign_min_posts = campaign_min_posts
+        self.burst_comments = burst_comments
+        self.burst_posts = burst_posts
+
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, _prime), rng.randrange(_prime)) for _ in range(num_perm)]
+        self.buckets = {}
+        self.clusters = {}
+        self.cluster_of = {}
+        self.entries = deque()
+        self.users = {}
+        # comment_id -> (time, user_id, post, cluster id) of every comment in the window, oldest first
+        self.observed = {}
+        self.observed_order = deque()
+        self.last_expire = 0
+
+        self.db_file = db_file
+        self.conn = None
+        if db_file is not None:
+            self._open()
+            self.load()
+
+    def signature(self, texto):
+        # None for texts too short to say anything about copy-paste
+        texto = normalizar_texto(texto)
+        if len(texto) < self.min_length:
+            return None
+        size = self.shingle_size
+        hashes = {stable_hash(texto[i:i + size]) for i in range(len(texto) - size + 1)}
+        return tuple(min([(a * x + b) % _prime for x in hashes]) for a, b in self.permutations)
+
+    def similarity(self, first, second):
+        return sum(1 for a, b in zip(first, second) if a == b) / self.num_perm
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def observe(self, comment_id, texto, user_id, url, now=None):
+        # Adds one comment; returns its Cluster, or None when the text is too short
+        now = now or time.time()
+        self.expire(now)
+        if comment_id in self.observed:
+            return self.cluster_of.get(comment_id)
+        post = post_key(url)
+        if user_id is not None:
+            self.users.setdefault(user_id, deque()).append((now, post))
+
+        signature = self.signature(texto)
+        if signature is None:
+            self._record(comment_id, now, user_id, post, None)
+            return None
+        band_keys = self._band_keys(signature)
+
+        cluster = None
+        best = self.threshold
+        for band_key in band_keys:
+            for candidate_id in self.buckets.get(band_key, ()):
+                candidate = self.clusters.get(candidate_id)
+                if candidate is None or candidate is cluster:
+                    continue
+                score = self.similarity(signature, candidate.signature)
+                if score >= best:
+                    cluster, best = candidate, score
+        if cluster is None:
+            cluster = self.clusters[comment_id] = Cluster(comment_id, signature, now)
+            for band_key in band_keys:
+                self.buckets.setdefault(band_key, []).append(comment_id)
+            self.entries.append((now, comment_id, band_keys))
+
+        cluster.size += 1
+        cluster.last_seen = now
+        if user_id is not None:
+            cluster.users.add(user_id)
+        cluster.posts.add(post)
+        self.cluster_of[comment_id] = cluster
+        self._record(comment_id, now, user_id, post, cluster.id)
+        return cluster
+
+    def _record(self, comment_id, now, user_id, post, cluster_id):
+        self.observed[comment_id] = (now, user_id, post, cluster_id)
+        self.observed_order.append((now, comment_id))
+
+    def expire(self, now=None, every=60):
+        # Sweeps at most once every `every` seconds
+        now = now or time.time()
+        if now - self.last_expire < every:
+            return
+        self.last_expire = now
+        cutoff = now - self.window
+        while self.entries and self.entries[0][0] < cutoff:
+            _, cluster_id, band_keys = self.entries.popleft()
+            cluster = self.clusters.get(cluster_id)
+            if cluster is not None and cluster.last_seen >= cutoff:
+                # Still active: keep it indexed for another window
+                self.entries.append((cluster.last_seen, cluster_id, band_keys))
+                continue
+            self.clusters.pop(cluster_id, None)
+            for band_key in band_keys:
+                bucket = self.buckets.get(band_key)
+                if bucket is not None:
+                    bucket.remove(cluster_id)
+                    if not bucket:
+                        del self.buckets[band_key]
+        if len(self.cluster_of) > 4 * max(1, len(self.clusters)) + 10000:
+            self.cluster_of = {key: cluster for key, cluster in self.cluster_of.items() if cluster.id in self.clusters}
+        while self.observed_order and self.observed_order[0][0] < cutoff:
+            _, comment_id = self.observed_order.popleft()
+            self.observed.pop(comment_id, None)
+        for user_id in list(self.users):
+            activity = self.users[user_id]
+            while activity and activity[0][0] < cutoff:
+                activity.popleft()
+            if not activity:
+                del self.users[user_id]
+
+    def label_for(self, comment_id, key=None):
+        # key tells apart the labels of different classifiers (one per campaign)
+        cluster = self.cluster_of.get(comment_id)
+        return cluster.labels.get(key) if cluster is not None else None
+
+    def set_label(self, comment_id, label, key=None):
+        cluster = self.cluster_of.get(comment_id)
+        if cluster is not None and key not in cluster.labels:
+            cluster.labels[key] = label
+
+    def group_key(self, comment_id, texto):
+        # Comments sharing a key are classified with a single LLM answer
+        cluster = self.cluster_of.get(comment_id)
+        return ('cluster', cluster.id) if cluster is not None else ('text', normalizar_texto(texto))
+
+    def is_campaign(self, cluster):
+        return (cluster is not None and len(cluster.users) >= self.campaign_min_users
+                and len(cluster.posts) >= self.campaign_min_posts)
+
+    def verdict(self, comment_id, user_id):
+        if self.is_campaign(self.cluster_of.get(comment_id)):
+            return bot_campana
+        activity = self.users.get(user_id) or ()
+        if len(activity) >= self.burst_comments or len({post for _, post in activity}) >= self.burst_posts:
+            return bot_actividad
+        return usuario_real
+
+    # Persistence
+
+    def _params(self):
+        # Signatures saved with other parameters cannot be compared with new ones
+        a, b = self.permutations[0]
+        return f"blake2b-universal:{self.num_perm}:{self.shingle_size}:{a}:{b}"
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS clusters (id TEXT PRIMARY KEY, signature BLOB NOT NULL, size INTEGER NOT NULL, "
+            "users TEXT NOT NULL, posts TEXT NOT NULL, labels TEXT NOT NULL, last_seen REAL NOT NULL)"
+        )
+        # No affinity on user_id / post: ids come back with the type they were saved with
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS comments (comment_id TEXT PRIMARY KEY, ts REAL NOT NULL, user_id, post, "
+            "cluster_id TEXT) WITHOUT ROWID"
+        )
+        self.conn.execute("DROP TABLE IF EXISTS activity")
+        self.conn.commit()
+
+    def load(self, now=None):
+        now = now or time.time()
+        cutoff = now - self.window
+        params = self.conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if params is None or params[0] != self._params():
+            return
+
+        rows = self.conn.execute(
+            "SELECT id, signature, size, users, posts, labels, last_seen FROM clusters "
+            "WHERE last_seen >= ? ORDER BY last_seen", (cutoff,)
+        )
+        for cluster_id, signature, size, users, posts, labels, last_seen in rows:
+            cluster = Cluster(cluster_id, struct.unpack(f'<{self.num_perm}Q', signature), last_seen)
+            cluster.size = size
+            cluster.users = set(json.loads(users))
+            cluster.posts = set(json.loads(posts))
+            cluster.labels = json.loads(labels)
+            self.clusters[cluster_id] = cluster
+            band_keys = self._band_keys(cluster.signature)
+            for band_key in band_keys:
+                self.buckets.setdefault(band_key, []).append(cluster_id)
+            self.entries.append((last_seen, cluster_id, band_keys))
+
+        for comment_id, ts, user_id, post, cluster_id in self.conn.execute(
+                "SELECT comment_id, ts, user_id, post, cluster_id FROM comments WHERE ts >= ? ORDER BY ts", (cutoff,)):
+            if user_id is not None:
+                self.users.setdefault(user_id, deque()).append((ts, post))
+            cluster = self.clusters.get(cluster_id)
+            if cluster is not None:
+                self.cluster_of[comment_id] = cluster
+            self._record(comment_id, ts, user_id, post, cluster_id)
+
+    def save(self):
+        # The window is small (one day): the whole state is rewritten in one transaction
+        if self.conn is None:
+            return
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('params', ?)", (self._params(),))
+            self.conn.execute("DELETE FROM clusters")
+            self.conn.executemany(
+                "INSERT INTO clusters VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((cluster.id, struct.pack(f'<{self.num_perm}Q', *cluster.signature), cluster.size,
+                  json.dumps(list(cluster.users)), json.dumps(list(cluster.posts)),
+                  json.dumps(cluster.labels, ensure_ascii=False), cluster.last_seen)
+                 for cluster in self.clusters.values())
+            )
+            self.conn.execute("DELETE FROM comments")
+            self.conn.executemany(
+                "INSERT INTO comments VALUES (?, ?, ?, ?, ?)",
+                ((str(comment_id), ts, user_id, post, cluster_id)
+                 for comment_id, (ts, user_id, post, cluster_id) in self.observed.items())
+            )
+
+    def close(self):
+        if self.conn is not None:
+            self.save()
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+# Batch normalization of Apify dataset items.
+# The post and comment mappings are declared once in the schema tables below
+# (output field -> Apify field), records are __slots__ objects instead of fresh
+# dicts, and the timestamps of a whole page are converted in one pass: the
+# timezone object is cached and the UTC offset is computed once per hour of
+# data instead of once per item.
+
+unknown_time = "Unknown time"
+
+# (output field, Apify field); None copies a constant from the defaults
+post_schema = (
+    ('url', 'webVideoUrl'),
+    ('id', 'id'),
+    ('caption', 'text'),
+    ('hashtags', 'hashtags'),
+    ('commentsCount', 'commentCount'),
+    ('likesCount', 'diggCount'),
+    ('created_at', 'createTimeISO'),
+    ('sharesCount', 'shareCount'),
+    ('playCount', 'playCount'),
+    ('collectCount', 'collectCount'),
+    ('mentionsCount', 'mentions'),
+    ('stickers', 'effectStickers'),
+    ('isSlideshow', 'isSlideshow'),
+    ('isPinned', 'isPinned'),
+    ('isAd', 'isAd'),
+)
+
+comment_schema = (
+    ('url', 'videoWebUrl'),
+    ('comment_id', 'cid'),
+    ('text', 'text'),
+    ('user', 'uniqueId'),
+    ('user_profile', 'avatarThumbnail'),
+    ('created_at', 'createTimeISO'),
+    ('likes_count', 'diggCount'),
+    ('user_id', 'uid'),
+    ('reply_count', 'replyCommentTotal'),
+    ('parent_id', 'repliesToId'),
+    ('clasificacion', None),
+    ('red_social', None),
+    ('tipo_usuario', None),
+    ('campanas', None),
+)
+
+
+class Record:
+    # Dict-like access on top of __slots__, so the code that handled the old
+    # dicts (record['text'], record.get('url')) keeps working
+    __slots__ = ()
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return field in self.__slots__
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self):
+        # Field order follows the schema, as the stored JSON always had
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class PostRecord(Record):
+    __slots__ = tuple(field for field, _ in post_schema)
+
+
+class CommentRecord(Record):
+    __slots__ = tuple(field for field, _ in comment_schema)
+
+
+def as_dict(record):
+    return record.to_dict() if isinstance(record, Record) else record
+
+
+@lru_cache(maxsize=None)
+def cached_timezone(name):
+    # pytz is imported with the first timestamp to convert
+    import pytz
+    return pytz.timezone(name)
+
+
+def convert_timestamps(values, tz_name):
+    # Apify ISO timestamps (UTC) -> naive local datetimes, None where missing.
+    # The offset is looked up once per distinct UTC hour of the page.
+    tz = cached_timezone(tz_name)
+    offsets = {}
+    converted = []
+    for value in values:
+        if not value:
+            converted.append(None)
+            continue
+        try:
+            utc_time = datetime.fromisoformat(value[:19])
+        except ValueError:
+            converted.append(None)
+            continue
+        hour = (utc_time.toordinal(), utc_time.hour)
+        offset = offsets.get(hour)
+        if offset is None:
+            offset = offsets[hour] = utc_time.replace(tzinfo=timezone.utc).astimezone(tz).utcoffset()
+        converted.append(utc_time + offset)
+    return converted
+
+
+def format_local(local_time):
+    return local_time.isoformat(' ', 'seconds') if local_time is not None else unknown_time
+
+
+def _normalize(items, schema, record_type, tz_name, defaults):
+    local_times = convert_timestamps([item.get('createTimeISO') for item in items], tz_name)
+    records = []
+    for item, local_time in zip(items, local_times):
+        record = record_type.__new__(record_type)
+        for field, source in schema:
+            if source is None:
+                value = defaults.get(field)
+            elif source == 'createTimeISO':
+                value = format_local(local_time)
+            else:
+                value = item.get(source)
+            setattr(record, field, value)
+        records.append(record)
+    return records, local_times
+
+
+def normalize_posts(items, tz_name='America/Panama'):
+    # Returns (records, local_times); the local times feed the NewerThan watermark
+    return _normalize(items, post_schema, PostRecord, tz_name, {})
+
+
+def normalize_comments(items, tz_name='America/Guayaquil'):
+    records, _ = _normalize(items, comment_schema, CommentRecord, tz_name,
+                            {'clasificacion': None, 'red_social': 'Tiktok'})
+    return records
+
+
+def previous_day(created_at):
+    # 'YYYY-MM-DD HH:MM:SS' local time -> the day before as 'YYYY-MM-DD' (NewerThan format)
+    if not created_at or created_at == unknown_time:
+        return None
+    return (datetime.strptime(created_at[:10], "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
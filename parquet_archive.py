@@ -0,0 +1,244 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+from dedup_index import DedupIndex
+from jsonl_store import parse_lines
+from metrics import save_seconds
+from structured_log import get_logger, kv
+
+# Columnar archive of posts and comments for the analysts.
+# Each export reads only the lines appended to the JSONL log since the last one
+# and writes them as zstd-compressed Parquet files with typed columns, partitioned
+# hive-style by date and profile:
+#
+#   archive/comments/date=2025-10-30/profile=presidenciaec/part-1761840000123.parquet
+#
+# Existing files are never rewritten, so an export only adds files. The reader
+# memory-maps the files and reads just the columns and partitions a query needs.
+# pyarrow is optional: without it the export is skipped with a warning.
+#
+#   python parquet_archive.py export
+#   python parquet_archive.py stats comments clasificacion
+
+logger = get_logger(__name__)
+
+archive_root = os.getenv('parquet_archive_root', 'archive')
+
+# Column -> arrow type name, per dataset. created_at is local time (America/Guayaquil)
+schemas = {
+    'comments': {
+        'source': 'tiktok_comments.jsonl',
+        'key': 'comment_id',
+        'columns': {
+            'comment_id': 'string', 'url': 'string', 'text': 'string', 'user': 'string', 'user_id': 'string',
+            'user_profile': 'string', 'created_at': 'timestamp', 'likes_count': 'int64', 'reply_count': 'int32',
+            'parent_id': 'string',
+            'clasificacion': 'category', 'red_social': 'category', 'tipo_usuario': 'category', 'campanas': 'json',
+        },
+    },
+    'posts': {
+        'source': 'tiktok_posts.jsonl',
+        'key': 'id',
+        'columns': {
+            'id': 'string', 'url': 'string', 'caption': 'string', 'created_at': 'timestamp',
+            'commentsCount': 'int64', 'likesCount': 'int64', 'sharesCount': 'int64', 'playCount': 'int64',
+            'collectCount': 'int64', 'isSlideshow': 'bool', 'isPinned': 'bool', 'isAd': 'bool',
+        },
+    },
+}
+
+_warned = False
+
+
+def _pyarrow():
+    global _warned
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        if not _warned:
+            logger.warning("pyarrow is not installed, the Parquet archive is disabled")
+            _warned = True
+        return None
+    return pyarrow
+
+
+def _arrow_type(pa, name):
+    return {
+        'string': pa.string(),
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'timestamp': pa.timestamp('ms'),
+        'int64': pa.int64(),
+        'int32': pa.int32(),
+        'bool': pa.bool_(),
+        'json': pa.string(),
+    }[name]
+
+
+def _profile(url):
+    match = re.search(r'/@([^/?]+)', url or '')
+    return match.group(1) if match else 'unknown'
+
+
+def _timestamp(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _convert(record, columns):
+    row = {}
+    for column, type_name in columns.items():
+        value = record.get(column)
+        if type_name == 'timestamp':
+            value = _timestamp(value)
+        elif type_name in ('int64', 'int32'):
+            value = _int(value)
+        elif type_name == 'bool':
+            value = bool(value) if value is not None else None
+        elif type_name == 'json':
+            value = json.dumps(value, ensure_ascii=False) if value is not None else None
+        elif value is not None:
+            value = str(value)
+        row[column] = value
+    return row
+
+
+class ParquetArchive:
+    def __init__(self, kind, root=archive_root, source=None):
+        self.kind = kind
+        self.columns = schemas[kind]['columns']
+        self.key = schemas[kind]['key']
+        self.source = source or schemas[kind]['source']
+        self.folder = os.path.join(root, kind)
+
+    def _new_records(self, exported):
+        # Same tail read as RecentPostIndex. Compaction swaps the inode and the
+        # file is read again from the start; the exported ids keep that from
+        # duplicating rows.
+        stat = os.stat(self.source)
+        offset = int(exported.get_meta('offset', 0))
+        if str(stat.st_ino) != exported.get_meta('inode') or stat.st_size < offset:
+            exported.set_meta('inode', str(stat.st_ino), commit=False)
+            offset = 0
+        with open(self.source, 'rb') as file:
+            file.seek(offset)
+            chunk = file.read()
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        return offset + len(complete), parse_lines(complete.decode('utf-8', errors='replace'))
+
+    def export(self):
+        # Returns the number of rows written
+        pa = _pyarrow()
+        if pa is None or not os.path.exists(self.source):
+            return 0
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.folder, exist_ok=True)
+        exported = DedupIndex(os.path.join(self.folder, '_exported.db'), bloom_bits=1 << 20)
+        try:
+            offset, records = self._new_records(exported)
+            new_ids = set()
+            partitions = {}
+            for record in records:
+                record_id = record.get(self.key)
+                if record_id is None or record_id in new_ids or record_id in exported:
+                    continue
+                new_ids.add(record_id)
+                created_at = _timestamp(record.get('created_at'))
+                partition = (created_at.strftime("%Y-%m-%d") if created_at else 'unknown', _profile(record.get('url')))
+                partitions.setdefault(partition, []).append(_convert(record, self.columns))
+
+            schema = self.schema(pa)
+            stamp = int(time.time() * 1000)
+            with save_seconds.time(store='parquet'):
+                for (date, profile), rows in partitions.items():
+                    folder = os.path.join(self.folder, f"date={date}", f"profile={profile}")
+                    os.makedirs(folder, exist_ok=True)
+                    table = pa.Table.from_pylist(rows, schema=schema)
+                    tmp_file = os.path.join(folder, f".part-{stamp}.parquet.tmp")
+                    pq.write_table(table, tmp_file, compression='zstd')
+                    os.replace(tmp_file, os.path.join(folder, f"part-{stamp}.parquet"))
+
+            # The offset only moves once the files are in place
+            exported.add_many(new_ids)
+            exported.set_meta('offset', str(offset))
+            exported.save()
+        finally:
+            exported.close()
+
+        if new_ids:
+            logger.info("Parquet archive exported", extra=kv(kind=self.kind, rows=len(new_ids), partitions=len(partitions)))
+        return len(new_ids)
+
+    def schema(self, pa, partitions=False):
+        fields = [(column, _arrow_type(pa, type_name)) for column, type_name in self.columns.items()]
+        if partitions:
+            fields += [('date', pa.string()), ('profile', pa.string())]
+        return pa.schema(fields)
+
+    def read(self, columns=None, filters=None):
+        # Memory-mapped read of the archive as one pyarrow Table, e.g.
+        # read(['clasificacion', 'likes_count'], filters=[('date', '>=', '2025-10-01')])
+        pa = _pyarrow()
+        if pa is None or not os.path.isdir(self.folder):
+            return None
+        import pyarrow.parquet as pq
+        # The schema is given explicitly: files written before a column was added read it as nulls
+        dataset = pq.ParquetDataset(self.folder, schema=self.schema(pa, partitions=True), filters=filters,
+                                    memory_map=True, partitioning='hive')
+        # Each file has its own dictionaries for the category columns
+        return dataset.read(columns=columns).unify_dictionaries()
+
+    def count_by(self, *group_columns, filters=None):
+        # Row counts per group, straight on the arrow table (no pandas needed)
+        table = self.read(list(group_columns), filters=filters)
+        if table is None:
+            return []
+        grouped = table.group_by(list(group_columns)).aggregate([([], 'count_all')])
+        return grouped.sort_by([('count_all', 'descending')]).to_pylist()
+
+
+comments_archive = ParquetArchive('comments')
+posts_archive = ParquetArchive('posts')
+
+
+async def export_in_background(archive):
+    # Called at the end of each collector cycle; the export runs in a thread and never fails the cycle
+    try:
+        return await asyncio.to_thread(archive.export)
+    except Exception as e:
+        logger.error("An error occurred while exporting the Parquet archive", extra=kv(kind=archive.kind, error=e))
+        return 0
+
+
+def export_all():
+    return {archive.kind: archive.export() for archive in (posts_archive, comments_archive)}
+
+
+if __name__ == "__main__":
+    from structured_log import configure_logging
+    configure_logging()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'export'
+    if command == 'export':
+        print(export_all())
+    elif command == 'stats':
+        kind = sys.argv[2] if len(sys.argv) > 2 else 'comments'
+        group = sys.argv[3:] or ['date', 'profile']
+        for row in ParquetArchive(kind).count_by(*group):
+            print(row)
+    else:
+        print("usage: python parquet_archive.py export | stats [comments|posts] [column ...]")
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from collections import deque
+
+from metrics import pipeline_items_total, pipeline_stage_seconds, queue_depth
+from structured_log import get_logger, kv
+
+# Staged streaming pipeline with bounded queues.
+# Each stage has its own workers and an input queue of queue_size items; a full
+# queue blocks the stage before it (backpressure), so a slow stage never makes
+# the others buffer without limit and fast stages keep working meanwhile.
+# A handler returns the item for the next stage, a list of items, or None to
+# drop it. Stages with batch_size > 1 get a list of up to batch_size items,
+# collected for at most batch_timeout seconds.
+
+logger = get_logger(__name__)
+
+_done = object()
+
+# Stages of the last finished runs, kept for reporting (benchmark.py)
+completed_runs = deque(maxlen=100)
+
+
+class Stage:
+    def __init__(self, name, handler, workers=1, queue_size=200, batch_size=1, batch_timeout=0.5):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.processed = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=10000)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = stages
+
+    async def _next_batch(self, stage, queue):
+        # Returns (items, finished). The first get waits for as long as needed.
+        first = await queue.get()
+        if first is _done:
+            return [], True
+        items = [first]
+        deadline = time.monotonic() + stage.batch_timeout
+        while len(items) < stage.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _done:
+                return items, True
+            items.append(item)
+        return items, False
+
+    async def _worker(self, stage, queue, next_queue):
+        finished = False
+        while not finished:
+            items, finished = await self._next_batch(stage, queue)
+            if not items:
+                break
+
+            started = time.monotonic()
+            try:
+                output = await stage.handler(items if stage.batch_size > 1 else items[0])
+            except Exception as e:
+                stage.errors += len(items)
+                logger.error("Stage failed", extra=kv(stage=stage.name, items=len(items), error=e))
+                continue
+            finally:
+                elapsed = time.monotonic() - started
+                stage.latencies.append(elapsed)
+                pipeline_stage_seconds.observe(elapsed, stage=stage.name)
+            stage.processed += len(items)
+            pipeline_items_total.inc(len(items), stage=stage.name)
+
+            if next_queue is None or output is None:
+                continue
+            for result in output if isinstance(output, list) else [output]:
+                if result is not None:
+                    await next_queue.put(result)
+
+        if finished:
+            # Pass the end marker on so the other workers of this stage stop too
+            await queue.put(_done)
+
+    async def run(self, source):
+        # source is an async iterable or a plain iterable feeding the first stage
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+
+        async def feed():
+            if hasattr(source, '__aiter__'):
+                async for item in source:
+                    await queues[0].put(item)
+            else:
+                for item in source:
+                    await queues[0].put(item)
+            await queues[0].put(_done)
+
+        for stage, queue in zip(self.stages, queues):
+            queue_depth.set_function(queue.qsize, queue=stage.name)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            for index, stage in enumerate(self.stages):
+                next_queue = queues[index + 1] if index + 1 < len(self.stages) else None
+                stage.tasks = [asyncio.create_task(self._worker(stage, queues[index], next_queue))
+                               for _ in range(stage.workers)]
+
+            await feeder
+            for index, stage in enumerate(self.stages):
+                await asyncio.gather(*stage.tasks)
+                if index + 1 < len(self.stages):
+                    await queues[index + 1].put(_done)
+        except BaseException:
+            feeder.cancel()
+            for stage in self.stages:
+                for task in getattr(stage, 'tasks', []):
+                    task.cancel()
+            raise
+        finally:
+            for stage in self.stages:
+                queue_depth.remove(queue=stage.name)
+        completed_runs.append(self.stages)
+
+    def summary(self):
+        return {stage.name: {'processed': stage.processed, 'errors': stage.errors} for stage in self.stages}
+
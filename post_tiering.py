@@ -0,0 +1,165 @@
+import json
+import os
+import re
+import time
+from datetime import timedelta
+
+# Hot/cold tiering of posts for comment polling.
+# Every post tracks a comment velocity (EWMA of new comments per hour) fed by
+# successive commentCount/commentsCount observations and by what each poll
+# actually found. Posts where comments keep appearing are polled often and with
+# larger pages; posts that go quiet back off exponentially up to max_interval,
+# so old posts that are still being discussed are not dropped.
+# The state file is shared by both collectors; save() merges what the other
+# process saved in between.
+
+page_sizes = [10, 25, 50, 100, 200]
+
+
+def post_key(url):
+    # Post and comment datasets spell the URL differently, the video id is stable
+    match = re.search(r'/video/(\d+)', url or '')
+    return match.group(1) if match else url
+
+
+class PostTierScheduler:
+    def __init__(self, state_file='post_tiers.json', min_interval=900, base_interval=3600,
+                 max_interval=7 * 86400, max_post_age=30 * 86400, hot_velocity=10, alpha=0.5):
+        self.state_file = state_file
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.max_post_age = max_post_age
+        self.hot_velocity = hot_velocity
+        self.alpha = alpha
+        self.posts, self.loaded_mtime = self._read()
+
+    def _read(self):
+        # (posts, mtime) of the state file as it is on disk
+        if not os.path.exists(self.state_file):
+            return {}, None
+        try:
+            mtime = os.path.getmtime(self.state_file)
+            with open(self.state_file, 'r') as file:
+                return json.load(file), mtime
+        except json.JSONDecodeError:
+            return {}, None
+
+    def track(self, url, created_at, comments_count=None, now=None):
+        # Registers a post; new posts are due right away
+        now = now or time.time()
+        key = post_key(url)
+        if key not in self.posts:
+            self.posts[key] = {
+                'url': url,
+                'created_at': created_at.timestamp(),
+                'velocity': 0.0,
+                'interval': self.base_interval,
+                'next_poll': now,
+                'page_size': page_sizes[0],
+                'last_count': None,
+                'last_observed': None,
+            }
+        if comments_count is not None:
+            self.observe(url, comments_count, now)
+
+    def _update_velocity(self, post, per_hour):
+        post['velocity'] = self.alpha * per_hour + (1 - self.alpha) * post['velocity']
+
+    def observe(self, url, comments_count, now=None):
+        # commentCount from the posts actor: the growth between two observations is a velocity sample
+        post = self.posts.get(post_key(url))
+        if post is None or comments_count is None:
+            return
+        now = now or time.time()
+        if post['last_count'] is not None and post['last_observed'] and now > post['last_observed']:
+            hours = (now - post['last_observed']) / 3600
+            self._update_velocity(post, max(0, comments_count - post['last_count']) / hours)
+            if post['velocity'] >= self.hot_velocity:
+                post['next_poll'] = min(post['next_poll'], now)
+        post['last_count'] = comments_count
+        post['last_observed'] = now
+
+    def record_poll(self, url, new_comments, now=None):
+        post = self.posts.get(post_key(url))
+        if post is None:
+            return
+        now = now or time.time()
+        previous_poll = post.get('last_poll')
+        if previous_poll and now > previous_poll:
+            self._update_velocity(post, new_comments / ((now - previous_poll) / 3600))
+        post['last_poll'] = now
+
+        if new_comments >= post['page_size']:
+            # The page was full, so there is more: poll sooner with a bigger page
+            post['interval'] = self.min_interval
+        elif new_comments > 0:
+            post['interval'] = max(self.min_interval, post['interval'] / 2)
+        else:
+            post['interval'] = min(self.max_interval, post['interval'] * 2)
+        if post['velocity'] >= self.hot_velocity:
+            post['interval'] = self.min_interval
+
+        # Enough room for what the velocity predicts until the next poll, with margin
+        expected = post['velocity'] * post['interval'] / 3600 * 1.5
+        if new_comments >= post['page_size']:
+            expected = max(expected, post['page_size'] * 2)
+        post['page_size'] = next((size for size in page_sizes if size >= expected), page_sizes[-1])
+        post['next_poll'] = now + post['interval']
+
+    def due_groups(self, now=None):
+        # Due posts grouped by page size: commentsPerPost is per actor run
+        now = now or time.time()
+        groups = {}
+        for key, post in list(self.posts.items()):
+            if now - post['created_at'] > self.max_post_age:
+                del self.posts[key]
+                continue
+            if post['next_poll'] <= now:
+                groups.setdefault(post['page_size'], []).append(post['url'])
+        return groups
+
+    def seconds_until_next_poll(self, now=None):
+        now = now or time.time()
+        if not self.posts:
+            return self.base_interval
+        return max(0, min(post['next_poll'] for post in self.posts.values()) - now)
+
+    def tiers(self):
+        hot = sum(1 for post in self.posts.values() if post['interval'] <= self.min_interval)
+        cold = sum(1 for post in self.posts.values() if post['interval'] >= self.max_interval)
+        return hot, len(self.posts) - hot - cold, cold
+
+    def _merge(self, posts):
+        # posts_bg (observe) and comments_bg (record_poll) may run as separate processes:
+        # per post, the observation fields come from whoever observed last and the
+        # schedule fields from whoever polled last
+        for key, theirs in posts.items():
+            mine = self.posts.get(key)
+            if mine is None:
+                self.posts[key] = theirs
+                continue
+            if (theirs.get('last_observed') or 0) > (mine.get('last_observed') or 0):
+                mine.update({field: theirs[field] for field in ('last_count', 'last_observed', 'velocity')})
+            if (theirs.get('last_poll') or 0) > (mine.get('last_poll') or 0):
+                mine.update({field: theirs.get(field) for field in
+                             ('last_poll', 'interval', 'page_size', 'next_poll', 'velocity')})
+
+    def save(self):
+        posts, mtime = self._read()
+        if mtime is not None and mtime != self.loaded_mtime:
+            self._merge(posts)
+        tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as file:
+            json.dump(self.posts, file)
+        os.replace(tmp_file, self.state_file)
+        self.loaded_mtime = os.path.getmtime(self.state_file)
+
+
+post_tier_scheduler = PostTierScheduler()
+
+
+def track_recent_posts(recent_index, scheduler=post_tier_scheduler):
+    # Feed every post the index knows about that is still young enough to be polled
+    for url, created_at in recent_index.recent_posts(timedelta(seconds=scheduler.max_post_age)).items():
+        scheduler.track(url, created_at)
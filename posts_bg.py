@@ -1,90 +1,121 @@
 import asyncio
-from apify_client import ApifyClient
-import json
 import os
-from datetime import datetime, timedelta
-import pytz
-from dotenv import load_dotenv, find_dotenv
-
-# Clear any existing environment variables
-keys = ['apify_key']
-
-for key in keys:
-    if key in os.environ:
-        del os.environ[key]
-
-# Load dotenv()
-try:
-    load_dotenv(find_dotenv())
-    print("Environment variables loaded successfully")
-except Exception as e:
-    print(f"An error occurred while loading the environment variables: {e}")
-
-# Accesing Environment Variables
-apify_key = os.getenv("apify_token")                                           #<---------- Testing with my free key                                    
-
-print("Environment Variables Loaded from Functions:")
-print(f"APIFY_API_KEY: {apify_key}")
-
-# Initialize the ApifyClient with your API token
-client = ApifyClient(apify_key)
-
-def save_data_to_json(data, file_name):
-    if not os.path.exists(file_name):
-        # If the file does not exist, create a new one and write the data as a list
-        with open(file_name, 'w') as file:
-            json.dump([data], file, indent=4)
-    else:
-        # If the file exists, load the existing data
-        with open(file_name, 'r+') as file:
-            try:
-                existing_data = json.load(file)
-            except json.JSONDecodeError:
-                existing_data = []
-            
-            # Append the new data to the list
-            existing_data.append(data)
-            
-            # Set the file cursor to the beginning, truncate the file, and save the updated list
-            file.seek(0)
-            json.dump(existing_data, file, indent=4)
-            file.truncate()
-
-    print(f"Data saved to {file_name}")
+from datetime import timedelta
+from campaigns import all_profiles, campaigns, profile_of
+from config import actor_runner
+from dedup_index import open_dedup_index
+from engagement_series import EngagementSeries
+from jsonl_store import append_records, iter_records, load_records, migrate_json_array, start_background_compaction
+from metrics import posts_total, start_metrics_server
+from normalizer import normalize_posts, previous_day, unknown_time
+from parquet_archive import export_in_background, posts_archive
+from post_tiering import post_tier_scheduler
+from profile_schedule import ProfileScheduler
+from recent_posts import recent_post_index
+from structured_log import get_logger, kv
+
+logger = get_logger('posts_bg')
 
 
 # Function to load existing data and create sets for existing post_ids and post_dates           #-----------New function--------------#
 def load_existing_data(file_path):
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, 'r') as file:
-                post_dates = set()  # Changed to a set
-                existing_data = json.load(file)
-                post_ids = {post.get('id') for post in existing_data}
-                post_dates_raw = {post.get('created_at') for post in existing_data}
-                for guayaquil_time_str in post_dates_raw:
-                    guayaquil_time = datetime.strptime(guayaquil_time_str, "%Y-%m-%d %H:%M:%S")
-                    guayaquil_time_adjusted = guayaquil_time - timedelta(days=1)
-                    date_str = guayaquil_time_adjusted.strftime("%Y-%m-%d")
-                    post_dates.add(date_str)  # Correct usage of .add() with a set
-                return post_ids, post_dates
-        except json.JSONDecodeError:
-            return set(), set()
-    else:
-        return set(), set()
-   
+    existing_data = load_records(file_path)
+    post_ids = {post.get('id') for post in existing_data}
+    # 'YYYY-MM-DD HH:MM:SS' strings sort chronologically: only the newest one is parsed
+    created = [post.get('created_at') for post in existing_data if post.get('created_at') not in (None, unknown_time)]
+    newest = previous_day(max(created)) if created else None
+    return post_ids, {newest} if newest else set()
+
+
+def save_new_posts(items):
+    # One normalization pass and one JSONL write per batch of new posts
+    if not items:
+        return
+    records, local_times = normalize_posts(items)
+    for tiktok_post, local_time in zip(records, local_times):
+        profile = profile_keys.get(profile_of(tiktok_post.url))
+        if profile is not None:
+            new_posts[profile] = new_posts.get(profile, 0) + 1
+            if local_time is not None:
+                # Subtract one day from the date: yyyy-mm-dd for the profile's NewerThan watermark
+                newer_than = (local_time - timedelta(days=1)).strftime("%Y-%m-%d")
+                watermarks[profile] = max(watermarks.get(profile, newer_than), newer_than)
+        posts_total.inc(result='new')
+        logger.info("Post extracted", extra=kv(post_id=tiktok_post.id, url=tiktok_post.url))
+        recent_post_index.add(tiktok_post)
+
+    # Add the post IDs to the seen_posts index
+    seen_posts.add_many(tiktok_post.id for tiktok_post in records)
+    append_records([tiktok_post.to_dict() for tiktok_post in records], 'tiktok_posts.jsonl')
+    logger.debug("Data saved", extra=kv(file='tiktok_posts.jsonl', count=len(records)))
+
 
 # Initializes sets with previously calculated values ​​or with an empty set                     ------------New------------------
-seen_posts, dates = load_existing_data('tiktok_posts.json')
+migrate_json_array('tiktok_posts.json', 'tiktok_posts.jsonl')
+
+# Persistent dedup index: opens in constant time, the JSONL history is only read
+# once to seed it
+seen_posts = open_dedup_index(
+    'seen_posts.db',
+    seed=lambda: (post.get('id') for post in iter_records('tiktok_posts.jsonl'))
+)
+
+# Engagement counters of every post each time it is seen again (delta-encoded)
+engagement_series = EngagementSeries('engagement_series.db')
+
+# Keep tiktok_posts.json as a periodically refreshed snapshot for analysts
+start_background_compaction('tiktok_posts.jsonl', key='id', snapshot_file='tiktok_posts.json')
+
+# Profiles of every campaign (campaigns.py), each one fetched once even if several campaigns follow it
+profiles = all_profiles(campaigns)
+
+profile_keys = {profile.lower(): profile for profile in profiles}
+
+# Profiles per actor run: the profiles that come due together share a run, bigger batches are sharded
+profiles_per_shard = int(os.getenv('profiles_per_shard', 10))
+
+# New posts per normalization batch
+normalize_batch_size = 100
 
 seconds_for_next_run = 28800 # 8 hour               
 #seconds_for_next_run = 200 # 8 hour               
 
-NewerThan = max(dates) if dates else "2025-10-20"  # Define the date from which to retrieve posts     <---------------Define a new date
+# The watermark is kept in the index metadata instead of re-parsing every stored created_at
+NewerThan = seen_posts.get_meta('newer_than')
+if NewerThan is None:
+    _, dates = load_existing_data('tiktok_posts.jsonl')
+    NewerThan = max(dates) if dates else "2025-10-20"  # Define the date from which to retrieve posts     <---------------Define a new date
+
+# Each profile is polled on its own schedule (posting rate) from its own watermark;
+# the global NewerThan only seeds the profiles the scheduler has not seen yet
+profile_scheduler = ProfileScheduler(
+    'profile_schedule.json',
+    min_interval=int(os.getenv('profile_min_interval', 1800)),
+    base_interval=seconds_for_next_run,
+    max_interval=int(os.getenv('profile_max_interval', 86400)),
+)
+profile_scheduler.sync(profiles, NewerThan)
+
+# New posts and newest watermark per profile found during the current cycle
+new_posts = {}
+watermarks = {}
+
+
+def next_run_delay():
+    # Wake up for the next profile that comes due
+    return min(profile_scheduler.max_interval, max(60, profile_scheduler.seconds_until_next_poll()))
+
 
 async def fetch_tiktok_posts():
     global NewerThan  # Declare NewerThan as global so we can modify it
-    print(f"NewerThan: {NewerThan}")
+    due = profile_scheduler.due()
+    if not due:
+        logger.info("No profiles due")
+        return
+    newer_than = profile_scheduler.newer_than(due)
+    logger.info("Fetching Tiktok posts", extra=kv(profiles=len(due), newer_than=newer_than))
+    new_posts.clear()
+    watermarks.clear()
     
     # Define the maximum number of posts to retrieve
     results = 30                                                                 #<------------------- To retrieve all posts 
@@ -92,11 +123,7 @@ async def fetch_tiktok_posts():
 
     run_input = {                                       # New variables for tiktok api
         "excludePinnedPosts": False,
-        "oldestPostDate": NewerThan,
-        "profiles": [
-            "danielnoboaok","presidenciaec","comunicacionec",
-            "aquilesalvarz.h","alcaldiagye"
-        ],
+        "oldestPostDate": newer_than,
         "resultsPerPage": results,
         "shouldDownloadCovers": False,
         "shouldDownloadSlideshowImages": False,
@@ -105,104 +132,92 @@ async def fetch_tiktok_posts():
     }
 
     try:
-        # Run the Tiktok Actor and wait for it to finish
-        run = client.actor("OtzYfK1ndEGdwWFKQ").call(run_input=run_input)
+        # Run the Tiktok Actor on the due profiles: one run per shard, runs go in parallel,
+        # a failed shard is retried on its own and the datasets are merged without duplicates.
+        # A run takes the oldest watermark of its profiles; older posts of the others are duplicates.
+        failed = []
+        items = actor_runner.iter_items(
+            "OtzYfK1ndEGdwWFKQ", lambda shard: {**run_input, "profiles": shard},
+            due, profiles_per_shard, dedup_key='id', failed=failed
+        )
+
+        # New posts are collected and normalized a batch at a time
+        new_items = []
+        snapshots = 0
 
         # Fetch and print Actor results from the run's dataset (if there are any)
-        for item in client.dataset(run["defaultDatasetId"]).iterate_items():
+        async for item in items:
             post_id = item.get('id', None)
 
+            # Every sighting, new or not, is a comment-velocity sample for the tiering scheduler
+            # and an engagement snapshot
+            post_tier_scheduler.observe(item.get('webVideoUrl'), item.get('commentCount'))
+            if engagement_series.record_item(item):
+                snapshots += 1
+
             # Check if the post has already been seen
             if post_id not in seen_posts and post_id is not None:
-               
-                tiktok_post = {}
-
-                created_at = item.get('createTimeISO', None)
-
-                if created_at:
-                    # Parse the timestamp as a datetime object in UTC
-                    utc_time = datetime.strptime(created_at, "%Y-%m-%dT%H:%M:%S.%fZ")
-
-                    # Define the timezone for Guayaquil, Ecuador (which is UTC-5)
-                    guayaquil_tz = pytz.timezone('America/Panama')
-
-                    # Convert the UTC time to Guayaquil time
-                    guayaquil_time = utc_time.replace(tzinfo=pytz.utc).astimezone(guayaquil_tz)
-
-                    # Subtract one day from the date
-                    guayaquil_time_adjusted = guayaquil_time - timedelta(days=1)
-
-                    # Convert to the desired format yyyy-mm-dd and add to the dates set
-                    date_str = guayaquil_time_adjusted.strftime("%Y-%m-%d")
-                    print(f"Post date: {date_str}")
-                    dates.add(date_str)
-
-                    guayaquil_time_str = guayaquil_time.strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    guayaquil_time_str = "Unknown time"
-
-                post_url = item.get('webVideoUrl', None)
-                post_text = item.get('text', None)
-                post_hashtags = item.get('hashtags', None)
-                post_commentsCount = item.get('commentCount', None)
-                post_likes = item.get("diggCount",None)
-                post_shares = item.get('shareCount', None)
-                post_play = item.get('playCount', None)
-                post_collect = item.get('collectCount', None)
-                post_mentions = item.get('mentions', None)
-                post_stickers = item.get('effectStickers', None)
-                post_isSlideshow = item.get('isSlideshow', None)
-                post_isPinned = item.get('isPinned', None)
-                post_isAd = item.get('isAd', None)
-
-
-                tiktok_post['url'] = post_url
-                tiktok_post['id'] = post_id
-                tiktok_post['caption'] = post_text
-                tiktok_post['hashtags'] = post_hashtags
-                tiktok_post['commentsCount'] = post_commentsCount
-                tiktok_post['likesCount'] = post_likes
-                tiktok_post['created_at'] = guayaquil_time_str
-                tiktok_post['sharesCount'] = post_shares
-                tiktok_post['playCount'] = post_play
-                tiktok_post['collectCount'] = post_collect
-                tiktok_post['mentionsCount'] = post_mentions
-                tiktok_post['stickers'] = post_stickers
-                tiktok_post['isSlideshow'] = post_isSlideshow
-                tiktok_post['isPinned'] = post_isPinned
-                tiktok_post['isAd'] = post_isAd
-
-                # Add the post ID to the seen_posts set
-                seen_posts.add(post_id)
-                
-                print(f"Post {[post_text]} extracted")
-                print(seen_posts)
-
-                save_data_to_json(tiktok_post, 'tiktok_posts.json')
-
+                new_items.append(item)
+                if len(new_items) >= normalize_batch_size:
+                    save_new_posts(new_items)
+                    new_items = []
             else:
-                print(f"Post {post_id} already extracted sometime ago" if post_id else "Post ID not found in the dataset")
-
-        # Find the most recent date in the dates set
-        if dates:
-            NewerThan = max(dates)
-            print(f"NewerThan updated to: {NewerThan}")
+                posts_total.inc(result='duplicate' if post_id else 'missing_id')
+                logger.debug("Post already extracted sometime ago" if post_id else "Post ID not found in the dataset",
+                             extra=kv(post_id=post_id))
+
+        save_new_posts(new_items)
+        engagement_series.save()
+        # The velocity samples above; comments_bg saves the schedule on its side
+        post_tier_scheduler.save()
+        logger.info("Engagement snapshots recorded", extra=kv(snapshots=snapshots))
+
+        # Failed profiles stay due; the rest move their rate, watermark and next poll
+        for profile in due:
+            if profile in failed:
+                continue
+            profile_scheduler.record_poll(profile, new_posts.get(profile, 0), watermarks.get(profile))
+            state = profile_scheduler.profiles[profile]
+            logger.info("Profile polled", extra=kv(
+                profile=profile, new_posts=new_posts.get(profile, 0), newer_than=state['newer_than'],
+                posts_per_hour=round(state['rate'], 3), next_poll_in=round(state['interval'])))
+        profile_scheduler.save()
+
+        # The newest watermark seeds the profiles added later
+        if watermarks:
+            NewerThan = max(NewerThan, max(watermarks.values()))
+            seen_posts.set_meta('newer_than', NewerThan)
+
+        seen_posts.save()
+
+        # Columnar snapshot for the analysts, only the rows appended this cycle
+        await export_in_background(posts_archive)
 
     except Exception as e:
-        print(f"An error occurred while fetching Tiktok posts: {e}")
+        logger.exception("An error occurred while fetching Tiktok posts", extra=kv(error=e))
+
+
+def shutdown():
+    seen_posts.close()
+    engagement_series.close()
+
 
 async def main():
     while True:
         try:
             await fetch_tiktok_posts()
-            print("Waiting for 10 hours before the next execution... \n\n\n")
-            await asyncio.sleep(seconds_for_next_run)  # Sleep for 10 hours (360000 seconds)
+            delay = next_run_delay()
+            logger.info("Waiting before the next execution", extra=kv(seconds=round(delay)))
+            await asyncio.sleep(delay)
         except Exception as e:
-            print(f"An error occurred in the main loop: {e}")
+            logger.exception("An error occurred in the main loop", extra=kv(error=e))
             await asyncio.sleep(seconds_for_next_run)  # Wait before trying again to avoid rapid failure loop
 
 if __name__ == "__main__":
+    start_metrics_server()
     try:
         asyncio.run(main())
     except Exception as e:
-        print(f"An error occurred while running the main function: {e}")
\ No newline at end of file
+        logger.exception("An error occurred while running the main function", extra=kv(error=e))
+    finally:
+        shutdown()
\ No newline at end of file
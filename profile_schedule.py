@@ -0,0 +1,88 @@
+import json
+import os
+import time
+
+# Adaptive post polling per profile.
+# Every profile keeps its own NewerThan watermark and an EWMA of how many posts
+# it publishes per hour. After each poll the next one is set to roughly when the
+# profile is expected to have posted again, within [min_interval, max_interval];
+# a profile that published nothing backs off exponentially. Profiles that come
+# due within batch_window of each other are polled together in one actor run.
+
+
+class ProfileScheduler:
+    def __init__(self, state_file='profile_schedule.json', min_interval=1800, base_interval=28800,
+                 max_interval=86400, alpha=0.3, batch_window=900):
+        self.state_file = state_file
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.batch_window = batch_window
+        self.profiles = {}
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, 'r') as file:
+                    self.profiles = json.load(file)
+            except json.JSONDecodeError:
+                self.profiles = {}
+
+    def sync(self, profiles, newer_than, now=None):
+        # New profiles are due right away from the default watermark; removed ones are forgotten
+        now = now or time.time()
+        for profile in profiles:
+            if profile not in self.profiles:
+                self.profiles[profile] = {
+                    'newer_than': newer_than,
+                    'rate': 0.0,
+                    'interval': self.base_interval,
+                    'next_poll': now,
+                    'last_poll': None,
+                }
+        for profile in list(self.profiles):
+            if profile not in profiles:
+                del self.profiles[profile]
+
+    def due(self, now=None):
+        # Profiles due now, plus the ones due within batch_window, which ride along in the same run
+        now = now or time.time()
+        return [profile for profile, state in self.profiles.items() if state['next_poll'] <= now + self.batch_window]
+
+    def newer_than(self, profiles):
+        # One run takes one oldestPostDate: the oldest watermark of its profiles
+        return min(self.profiles[profile]['newer_than'] for profile in profiles)
+
+    def record_poll(self, profile, new_posts, newer_than=None, now=None):
+        state = self.profiles.get(profile)
+        if state is None:
+            return
+        now = now or time.time()
+        # The first poll has no previous one to measure the rate against
+        observed = bool(state['last_poll']) and now > state['last_poll']
+        if observed:
+            per_hour = new_posts / ((now - state['last_poll']) / 3600)
+            state['rate'] = self.alpha * per_hour + (1 - self.alpha) * state['rate']
+            if new_posts == 0 and state['rate'] < 3600 / self.max_interval:
+                # Quiet profile: back off
+                state['interval'] = min(self.max_interval, state['interval'] * 2)
+            elif state['rate'] > 0:
+                # Poll about once per expected new post
+                state['interval'] = min(self.max_interval, max(self.min_interval, 3600 / state['rate']))
+        # else: first poll, no rate yet, the interval stays at base_interval
+        state['last_poll'] = now
+        state['next_poll'] = now + state['interval']
+
+        if newer_than and newer_than > state['newer_than']:
+            state['newer_than'] = newer_than
+
+    def seconds_until_next_poll(self, now=None):
+        now = now or time.time()
+        if not self.profiles:
+            return self.base_interval
+        return max(0, min(state['next_poll'] for state in self.profiles.values()) - now)
+
+    def save(self):
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, 'w') as file:
+            json.dump(self.profiles, file)
+        os.replace(tmp_file, self.state_file)
@@ -0,0 +1,30 @@
+import time
+
+# Token bucket shared by the OpenAI limiter and the Telegram dispatcher.
+# rate_per_minute tokens are refilled continuously; burst caps how many can be
+# spent at once (defaults to a full minute's worth).
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst=None):
+        self.capacity = float(burst if burst is not None else rate_per_minute)
+        self.tokens = self.capacity
+        self.rate = rate_per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount=1):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount=1):
+        # A negative amount refunds an over-estimate, never past a full bucket
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
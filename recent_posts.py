@@ -0,0 +1,95 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from jsonl_store import parse_lines
+
+# In-memory index of post URLs by creation time.
+# The comments collector used to re-parse the whole posts file every cycle to
+# find recent URLs. The index keeps url -> created_at and only reads the lines
+# appended to tiktok_posts.jsonl since the last refresh. Under the supervisor
+# the posts collector also adds new posts to it directly.
+#
+# A fresh process (one-shot runs) starts from a compact snapshot, i.e. the posts
+# of the last snapshot_max_age plus the file offset they cover, instead of
+# parsing the whole posts file again.
+
+
+class RecentPostIndex:
+    def __init__(self, file_name, snapshot_file=None, snapshot_max_age=timedelta(days=31)):
+        self.file_name = file_name
+        self.snapshot_file = snapshot_file
+        self.snapshot_max_age = snapshot_max_age
+        self.posts = {}
+        self.offset = 0
+        self.inode = None
+        self.loaded = snapshot_file is None
+
+    def load_snapshot(self):
+        # Only on the first refresh, so importing the module stays cheap
+        self.loaded = True
+        if not os.path.exists(self.snapshot_file):
+            return
+        try:
+            with open(self.snapshot_file, 'r') as file:
+                snapshot = json.load(file)
+        except (json.JSONDecodeError, OSError):
+            return
+        self.inode = snapshot['inode']
+        self.offset = snapshot['offset']
+        for url, created_at_str in snapshot['posts'].items():
+            self.posts.setdefault(url, datetime.strptime(created_at_str, "%Y-%m-%d %H:%M:%S"))
+
+    def save_snapshot(self):
+        if self.snapshot_file is None or not self.loaded:
+            return
+        cutoff = datetime.now() - self.snapshot_max_age
+        snapshot = {
+            'inode': self.inode,
+            'offset': self.offset,
+            'posts': {url: created_at.strftime("%Y-%m-%d %H:%M:%S")
+                      for url, created_at in self.posts.items() if created_at >= cutoff},
+        }
+        tmp_file = f"{self.snapshot_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(tmp_file, self.snapshot_file)
+
+    def add(self, post):
+        url = post.get('url')
+        created_at_str = post.get('created_at')
+        if not url or not created_at_str or created_at_str == "Unknown time":
+            return
+        self.posts[url] = datetime.strptime(created_at_str, "%Y-%m-%d %H:%M:%S")
+
+    def refresh(self):
+        if not self.loaded:
+            self.load_snapshot()
+        if not os.path.exists(self.file_name):
+            return
+        stat = os.stat(self.file_name)
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # Compaction replaced the file: read it again from the start
+            self.inode = stat.st_ino
+            self.offset = 0
+
+        with open(self.file_name, 'rb') as file:
+            file.seek(self.offset)
+            chunk = file.read()
+
+        # Leave a torn last line for the next refresh
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        self.offset += len(complete)
+        for post in parse_lines(complete.decode('utf-8', errors='replace')):
+            self.add(post)
+
+    def recent_posts(self, max_age=timedelta(days=1)):
+        self.refresh()
+        cutoff = datetime.now() - max_age
+        return {url: created_at for url, created_at in self.posts.items() if created_at >= cutoff}
+
+    def recent_urls(self, max_age=timedelta(days=1)):
+        return list(self.recent_posts(max_age))
+
+
+recent_post_index = RecentPostIndex('tiktok_posts.jsonl', snapshot_file='recent_posts_snapshot.json')
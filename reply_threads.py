@@ -0,0 +1,80 @@
+import sqlite3
+import time
+
+# Reply-thread state for the comments collector.
+# Every time a top-level comment is seen (new or not) its replyCommentTotal is
+# recorded here. A thread whose total grew past what was already expanded is
+# due: the next reply pass asks the actor for its post again, this time with
+# replies, and keeps only the replies of the due threads. After the pass the
+# expanded total catches up, so a thread is only expanded again when it grows.
+# A thread that does not come back (its parent is outside the page the actor
+# returns) counts a miss; after max_misses in a row it is no longer due.
+
+
+class ReplyThreads:
+    def __init__(self, db_file='reply_threads.db'):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            "comment_id TEXT PRIMARY KEY, url TEXT, reply_count INTEGER NOT NULL, "
+            "expanded INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL, misses INTEGER NOT NULL DEFAULT 0) "
+            "WITHOUT ROWID"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(threads)")}
+        if 'misses' not in columns:
+            self.conn.execute("ALTER TABLE threads ADD COLUMN misses INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS threads_growth_idx ON threads (reply_count - expanded)")
+        self.conn.commit()
+
+    def __repr__(self):
+        return f"ReplyThreads({self.db_file!r})"
+
+    def observe_many(self, comments, now=None):
+        # comments: (comment_id, url, reply_count) of top-level comments
+        now = now or time.time()
+        rows = [(str(comment_id), url, int(reply_count or 0), now)
+                for comment_id, url, reply_count in comments if comment_id is not None]
+        if not rows:
+            return
+        self.conn.executemany(
+            "INSERT INTO threads (comment_id, url, reply_count, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(comment_id) DO UPDATE SET reply_count = excluded.reply_count, url = excluded.url, "
+            "updated_at = excluded.updated_at WHERE excluded.reply_count != threads.reply_count",
+            rows
+        )
+        self.conn.commit()
+
+    def due(self, min_reply_count=5, limit=200, max_misses=3):
+        # [(comment_id, url, reply_count, new replies)] of the threads that grew, biggest growth first
+        return self.conn.execute(
+            "SELECT comment_id, url, reply_count, reply_count - expanded FROM threads "
+            "WHERE reply_count > expanded AND reply_count >= ? AND misses < ? "
+            "ORDER BY reply_count - expanded DESC LIMIT ?",
+            (min_reply_count, max_misses, limit)
+        ).fetchall()
+
+    def mark_expanded(self, threads):
+        # threads: (comment_id, reply_count) as they were when the pass started
+        self.conn.executemany(
+            "UPDATE threads SET expanded = MAX(expanded, ?), misses = 0 WHERE comment_id = ?",
+            [(reply_count, comment_id) for comment_id, reply_count in threads]
+        )
+        self.conn.commit()
+
+    def mark_missed(self, comment_ids):
+        # Threads asked for whose parent did not come back
+        self.conn.executemany("UPDATE threads SET misses = misses + 1 WHERE comment_id = ?",
+                              [(comment_id,) for comment_id in comment_ids])
+        self.conn.commit()
+
+    def expire(self, max_age=30 * 86400):
+        # Threads that have not moved for a long time are forgotten
+        self.conn.execute("DELETE FROM threads WHERE updated_at < ?", (time.time() - max_age,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
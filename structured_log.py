@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import sys
+
+# Leveled, structured logging for the collectors (replaces the old prints).
+# Fields go in extra=kv(...) and are rendered as key=value pairs, or as one JSON
+# object per line with log_format=json (log_level and log_format come from
+# the environment). Per-item messages use DEBUG: with the
+# default INFO level, logger.debug returns right after a level check.
+#
+#   logger = get_logger(__name__)
+#   logger.info("Comment extracted", extra=kv(comment_id=comment_id))
+
+def kv(**fields):
+    return {'fields': fields}
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_configured = False
+
+
+def configure_logging(level=None, fmt=None, stream=None):
+    # Idempotent; both collectors call it through config, after the .env is loaded
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    fmt = fmt or os.getenv('log_format', 'text')
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level or os.getenv('log_level', 'INFO').upper())
+
+
+def get_logger(name):
+    return logging.getLogger(name)
@@ -0,0 +1,111 @@
+import asyncio
+import html
+
+from near_duplicates import usuario_real
+from structured_log import get_logger, kv
+
+# Digest mode: instead of one sendMessage per comment, alerts are collected for
+# a time window (or until the text would exceed Telegram's 4096-character limit)
+# and sent as one message per batch, grouped by post URL and sentiment.
+
+logger = get_logger(__name__)
+
+telegram_max_length = 4096
+
+emojis_sentimiento = {"positivo": "🟢", "negativo": "🔴", "neutral": "⚪"}
+
+
+def _render_alert(alert, max_comment_length=500):
+    texto = (alert.get('text') or '').strip()
+    if len(texto) > max_comment_length:
+        texto = texto[:max_comment_length] + "…"
+    # Accounts flagged as bots are marked so they stand out in the digest
+    tipo_usuario = alert.get('tipo_usuario')
+    bot = f" 🤖 {html.escape(tipo_usuario)}" if tipo_usuario and tipo_usuario != usuario_real else ""
+    return f"• {html.escape(alert.get('created_at') or '')} 👤 {html.escape(alert.get('user') or '')}{bot}: {html.escape(texto)}\n"
+
+
+def render_digest(alerts, header="🎵 Tiktok - Resumen de comentarios", limit=telegram_max_length):
+    # Returns the list of messages needed to carry every alert, each under the limit
+    return [message for message, _ in render_digest_parts(alerts, header, limit)]
+
+
+def render_digest_parts(alerts, header="🎵 Tiktok - Resumen de comentarios", limit=telegram_max_length):
+    # Same as render_digest, as (message, indexes of the alerts it carries) pairs
+    groups = {}
+    for index, alert in enumerate(alerts):
+        sentimiento = (alert.get('clasificacion') or '').strip().lower()
+        groups.setdefault((alert.get('url'), sentimiento), []).append((index, alert))
+
+    title = f"<b>{html.escape(header)}</b> ({len(alerts)})\n"
+    messages = []
+    current, carried = title, []
+    for (url, sentimiento), group in groups.items():
+        group_header = (
+            f"\n🌍 {html.escape(url or 'Sin URL')}\n"
+            f"Sentimiento: {sentimiento.capitalize()} {emojis_sentimiento.get(sentimiento, '')} ({len(group)})\n"
+        )
+        pending_header = group_header
+        for index, alert in group:
+            addition = pending_header + _render_alert(alert)
+            if len(current) + len(addition) > limit and current != title:
+                # Close this message and repeat the group header in the next one
+                messages.append((current, carried))
+                current, carried = f"<b>{html.escape(header)}</b> (cont.)\n", []
+                addition = group_header + _render_alert(alert)
+            current += addition
+            carried.append(index)
+            pending_header = ''
+    messages.append((current, carried))
+    return messages
+
+
+class TelegramDigest:
+    def __init__(self, dispatcher, chat_id, window=300, header="🎵 Tiktok - Resumen de comentarios"):
+        self.dispatcher = dispatcher
+        self.chat_id = chat_id
+        self.window = window
+        self.header = header
+        self.pending = []
+        self.callbacks = []
+        self.pending_length = 0
+        self.timer = None
+
+    def add(self, alert, on_delivered=None):
+        # on_delivered is called once the message carrying this alert is delivered (or rejected)
+        self.pending.append(alert)
+        self.callbacks.append(on_delivered)
+        self.pending_length += len(_render_alert(alert)) + 120
+        if self.pending_length >= telegram_max_length:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.timer = None
+        self.flush()
+
+    def flush(self):
+        if self.timer is not None and self.timer is not asyncio.current_task():
+            self.timer.cancel()
+        self.timer = None
+        if not self.pending:
+            return
+        alerts, callbacks = self.pending, self.callbacks
+        self.pending, self.callbacks, self.pending_length = [], [], 0
+        for message_text, carried in render_digest_parts(alerts, self.header):
+            self.dispatcher.enqueue(self.chat_id, message_text,
+                                    on_delivered=_callbacks_for([callbacks[index] for index in carried]))
+        logger.info("Digest queued for Telegram", extra=kv(comments=len(alerts)))
+
+
+def _callbacks_for(callbacks):
+    callbacks = [callback for callback in callbacks if callback is not None]
+    if not callbacks:
+        return None
+
+    def on_delivered(delivered):
+        for callback in callbacks:
+            callback(delivered)
+    return on_delivered
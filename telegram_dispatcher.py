@@ -0,0 +1,209 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from jsonl_store import append_record
+from metrics import queue_depth, telegram_messages_total, telegram_send_seconds, telegram_throttled_total
+from rate_limit import TokenBucket
+from structured_log import get_logger, kv
+
+# Long-lived Telegram sender.
+# Messages are put on an asyncio queue and delivered by background workers over
+# one pooled aiohttp session, so ingestion never waits on delivery. Token buckets
+# keep us under Telegram's limits (about 30 messages/s per bot and 20 messages/min
+# per group or channel), 429s pause the chat for the Retry-After the API asks
+# for, and messages that keep failing end up in a dead-letter list instead of
+# being retried forever. on_delivered(True / False) tells the caller (the outbox)
+# when a message was accepted or rejected for good; messages dropped at shutdown
+# or on a full queue get no answer, so they stay pending for the next start.
+# aiohttp is only imported once the first message is queued.
+
+logger = get_logger(__name__)
+
+telegram_api_url = os.getenv('telegram_api_url', "https://api.telegram.org")
+
+
+class TelegramDispatcher:
+    def __init__(self, bot_token, workers=3, queue_size=1000, max_retries=5,
+                 per_chat_per_minute=20, global_per_second=30,
+                 dead_letter_file='telegram_dead_letters.jsonl', max_dead_letters=1000):
+        self.url = f"{telegram_api_url}/bot{bot_token}/sendMessage"
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.per_chat_per_minute = per_chat_per_minute
+        self.global_bucket = TokenBucket(global_per_second * 60, burst=global_per_second)
+        self.chat_buckets = {}
+        self.paused_until = {}
+        self.dead_letter_file = dead_letter_file
+        # Only the latest ones stay in memory; the file keeps all of them
+        self.dead_letters = deque(maxlen=max_dead_letters)
+        self.sent = 0
+        self.throttled = 0
+        # Seconds from enqueue to delivery of the last messages sent
+        self.latencies = deque(maxlen=10000)
+        self.queue = None
+        self.session = None
+        self.tasks = []
+
+    def _ensure_started(self):
+        # The queue, session and workers must be created inside the running loop
+        if self.session is not None:
+            return
+        import aiohttp
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.workers),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        queue_depth.set_function(self.queue.qsize, queue='telegram')
+
+    def enqueue(self, chat_id, text, parse_mode='HTML', on_delivered=None):
+        # Never blocks: a full queue sends the message straight to the dead letters
+        self._ensure_started()
+        message = {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode, 'attempts': 0,
+                   'queued_at': time.monotonic(), 'on_delivered': on_delivered}
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._dead_letter(message, "queue full", final=False)
+
+    @staticmethod
+    def _notify(message, delivered):
+        if message.get('on_delivered') is None:
+            return
+        try:
+            message['on_delivered'](delivered)
+        except Exception as e:
+            logger.exception("Delivery callback failed", extra=kv(chat_id=message['chat_id'], error=e))
+
+    async def _wait_for_slot(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_per_minute, burst=1)
+        while True:
+            pause = self.paused_until.get(chat_id, 0) - time.monotonic()
+            wait = max(pause, bucket.wait_time(), self.global_bucket.wait_time())
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        bucket.take()
+        self.global_bucket.take()
+
+    async def _worker(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                self._dead_letter(message, f"unexpected error: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, message):
+        import aiohttp
+        chat_id = message['chat_id']
+        while message['attempts'] <= self.max_retries:
+            await self._wait_for_slot(chat_id)
+            message['attempts'] += 1
+
+            data = {'chat_id': chat_id, 'text': message['text']}
+            if message['parse_mode']:
+                data['parse_mode'] = message['parse_mode']
+
+            started = time.monotonic()
+            try:
+                async with self.session.post(self.url, data=data) as response:
+                    telegram_send_seconds.observe(time.monotonic() - started)
+                    if response.status == 200:
+                        self.sent += 1
+                        self.latencies.append(time.monotonic() - message['queued_at'])
+                        telegram_messages_total.inc(status='sent')
+                        logger.debug("Message sent successfully to Canal Cerrado!", extra=kv(chat_id=chat_id))
+                        self._notify(message, True)
+                        return
+
+                    try:
+                        body = await response.json(content_type=None)
+                    except (aiohttp.ContentTypeError, ValueError):
+                        body = {}
+                    body = body if isinstance(body, dict) else {}
+                    description = body.get('description', '')
+
+                    if response.status == 429:
+                        # Telegram puts the wait in parameters.retry_after, proxies in the header
+                        retry_after = (body.get('parameters') or {}).get('retry_after') or response.headers.get("Retry-After", 5)
+                        retry_after = float(retry_after)
+                        self.throttled += 1
+                        telegram_throttled_total.inc()
+                        self.paused_until[chat_id] = time.monotonic() + retry_after
+                        logger.warning("Too many requests, chat paused", extra=kv(chat_id=chat_id, retry_after=retry_after))
+                        continue
+
+                    if response.status == 400 and 'parse entities' in description and message['parse_mode']:
+                        # Comment text broke the HTML markup: resend it as plain text
+                        message['parse_mode'] = None
+                        continue
+
+                    if 400 <= response.status < 500:
+                        self._dead_letter(message, f"{response.status}: {description}")
+                        return
+
+                    logger.warning("Failed to send message", extra=kv(status=response.status, description=description))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("An error occurred while sending to Telegram", extra=kv(error=e))
+
+            # Exponential backoff for 5xx and network errors
+            await asyncio.sleep(min(60, 2 ** message['attempts']))
+
+        self._dead_letter(message, "max retries exceeded")
+
+    def _dead_letter(self, message, reason, final=True):
+        # final=False: the message was not rejected, it just could not be tried now;
+        # on_delivered gets None so the sender can queue it again later
+        entry = {'chat_id': message['chat_id'], 'text': message['text'], 'attempts': message['attempts'],
+                 'reason': reason, 'failed_at': time.strftime("%Y-%m-%d %H:%M:%S")}
+        if len(self.dead_letters) == self.dead_letters.maxlen:
+            evicted = self.dead_letters[0]
+            logger.info("Oldest dead letter dropped from memory", extra=kv(
+                chat_id=evicted['chat_id'], failed_at=evicted['failed_at'], file=self.dead_letter_file))
+        self.dead_letters.append(entry)
+        telegram_messages_total.inc(status='dead_letter')
+        logger.warning("Message moved to dead letters", extra=kv(chat_id=message['chat_id'], reason=reason))
+        if self.dead_letter_file:
+            append_record(entry, self.dead_letter_file)
+        self._notify(message, False if final else None)
+
+    async def close(self, drain_timeout=30):
+        # Give queued messages a chance to go out, then stop the workers
+        if self.session is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Telegram messages still queued at shutdown", extra=kv(count=self.queue.qsize()))
+            while not self.queue.empty():
+                self._dead_letter(self.queue.get_nowait(), "not sent before shutdown", final=False)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.session.close()
+        self.session = None
+        queue_depth.remove(queue='telegram')
+
+
+_dispatchers = {}
+
+
+def dispatcher_for(bot_token):
+    # One dispatcher (and one pooled session) per bot
+    if bot_token not in _dispatchers:
+        _dispatchers[bot_token] = TelegramDispatcher(bot_token)
+    return _dispatchers[bot_token]
+
+
+async def close_dispatchers(drain_timeout=30):
+    for dispatcher in _dispatchers.values():
+        await dispatcher.close(drain_timeout)
@@ -0,0 +1,147 @@
+import json
+import sqlite3
+import time
+
+from structured_log import get_logger, kv
+
+# Durable work log of the comments collector.
+#
+# runs: every actor run is recorded as soon as it starts (run id, dataset id,
+# input) together with how far its dataset has been processed. The offset is a
+# low watermark: it only moves past an item once that item is finished (saved,
+# dropped as a duplicate or left for the next cycle), so items still inside the
+# pipeline are read again after a crash and the dedup index drops the ones that
+# had made it to disk. A restart resumes the unfinished runs from their offset
+# instead of paying for new ones.
+#
+# outbox: alerts are written here before the comment is marked as seen, and
+# only leave it once Telegram accepted them (or rejected them for good). A
+# restart sends what is still pending, and the key (campaign + comment) keeps
+# an alert from being queued twice.
+
+logger = get_logger(__name__)
+
+
+class WorkLog:
+    def __init__(self, db_file='work_log.db', commit_every=2.0):
+        self.db_file = db_file
+        self.commit_every = commit_every
+        self.last_commit = time.monotonic()
+        self.progress = {}
+
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "run_id TEXT PRIMARY KEY, actor_id TEXT NOT NULL, dataset_id TEXT NOT NULL, "
+            "run_input TEXT NOT NULL, offset INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, "
+            "started_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "key TEXT PRIMARY KEY, campaign TEXT NOT NULL, alert TEXT NOT NULL, status TEXT NOT NULL, "
+            "created_at REAL NOT NULL, sent_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_status_idx ON outbox (status)")
+        self.conn.commit()
+
+    def __repr__(self):
+        return f"WorkLog({self.db_file!r})"
+
+    # Actor runs
+
+    def start_run(self, actor_id, run_id, dataset_id, run_input):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, 0, 'running', ?, ?)",
+            (run_id, actor_id, dataset_id, json.dumps(run_input), now, now)
+        )
+        self.conn.commit()
+        self.progress[run_id] = [0, set()]
+
+    def pending_runs(self, actor_id):
+        # [(run_id, dataset_id, run_input, offset)] of the runs a crash left unfinished
+        rows = self.conn.execute(
+            "SELECT run_id, dataset_id, run_input, offset FROM runs "
+            "WHERE actor_id = ? AND status = 'running' ORDER BY started_at", (actor_id,)
+        ).fetchall()
+        runs = []
+        for run_id, dataset_id, run_input, offset in rows:
+            self.progress[run_id] = [offset, set()]
+            runs.append((run_id, dataset_id, json.loads(run_input), offset))
+        return runs
+
+    def done(self, position):
+        # position is the (run id, dataset index) the actor runner tagged the item with
+        if position is None:
+            return
+        run_id, index = position
+        progress = self.progress.get(run_id)
+        if progress is None:
+            return
+        offset, finished = progress
+        if index < offset:
+            return
+        finished.add(index)
+        while offset in finished:
+            finished.remove(offset)
+            offset += 1
+        if offset != progress[0]:
+            progress[0] = offset
+            self.conn.execute("UPDATE runs SET offset = ?, updated_at = ? WHERE run_id = ?", (offset, time.time(), run_id))
+            self._maybe_commit()
+
+    def finish_runs(self, run_ids):
+        # The whole dataset went through the pipeline: nothing to resume
+        run_ids = list(run_ids)
+        self.conn.executemany("UPDATE runs SET status = 'done', updated_at = ? WHERE run_id = ?",
+                              [(time.time(), run_id) for run_id in run_ids])
+        self.conn.commit()
+        for run_id in run_ids:
+            self.progress.pop(run_id, None)
+
+    def expire_runs(self, max_age=7 * 86400):
+        self.conn.execute("DELETE FROM runs WHERE status = 'done' AND updated_at < ?", (time.time() - max_age,))
+        self.conn.commit()
+
+    # Outbox
+
+    def add_alert(self, key, campaign, alert):
+        # False when the alert was already in the outbox (sent or not)
+        inserted = self.conn.execute(
+            "INSERT OR IGNORE INTO outbox (key, campaign, alert, status, created_at) VALUES (?, ?, ?, 'pending', ?)",
+            (key, campaign, json.dumps(alert, ensure_ascii=False), time.time())
+        ).rowcount
+        self.conn.commit()
+        return bool(inserted)
+
+    def pending_alerts(self):
+        # [(key, campaign, alert)], oldest first
+        rows = self.conn.execute(
+            "SELECT key, campaign, alert FROM outbox WHERE status = 'pending' ORDER BY created_at"
+        ).fetchall()
+        return [(key, campaign, json.loads(alert)) for key, campaign, alert in rows]
+
+    def mark_alert(self, key, status='sent'):
+        # Committed right away: a delivered alert must never come back after a crash
+        self.conn.execute("UPDATE outbox SET status = ?, sent_at = ? WHERE key = ?", (status, time.time(), key))
+        self.save()
+
+    def expire_alerts(self, max_age=30 * 86400):
+        self.conn.execute("DELETE FROM outbox WHERE status != 'pending' AND sent_at < ?", (time.time() - max_age,))
+        self.conn.commit()
+
+    def _maybe_commit(self):
+        # Watermark updates are small and frequent: commit at most every commit_every seconds
+        if time.monotonic() - self.last_commit >= self.commit_every:
+            self.save()
+
+    def save(self):
+        self.conn.commit()
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.save()
+        self.conn.close()
+        logger.debug("Work log closed", extra=kv(db=self.db_file))